@@ -1,12 +1,15 @@
+import os
+import sys
 import tkinter
 import serial
 
-from matplotlib.backends.backend_tkagg import (
-    FigureCanvasTkAgg, NavigationToolbar2Tk)
-# Implement the default Matplotlib key bindings.
-from matplotlib.backend_bases import key_press_handler
-
-import matplotlib.pyplot as plt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'Graphic_User_Interface'))
+from Serial_Reader import ChunkReader
+from Serial_Worker import COMMAND_LEFT, COMMAND_RIGHT, COMMAND_SPEED
+from Angle_Model import RotationModel, SPEED_MOTOR, TIME
+from Sweep_Reader import read_sweep
+from Calibration import lookup_table, UNIT_LABELS
    
 
 ser = serial.Serial()
@@ -20,9 +23,12 @@ def serial_port_init():
     ser.baudrate = 9600
     ser.timeout = 1
 
-data_ADC = list()
+voltage = list()
 degree = list()
+calibration = lookup_table()    # lookup table of the detector, ADC counts to volts like the GUI
 motor_state = False
+direction = 1       # 1 - right rotation, -1 - left rotation
+speed = 5           # speed command sent before every rotation, SPEED_MOTOR[speed] rpm
     
 
 # Here, we are creating our class, Window, and inheriting from the Frame
@@ -38,8 +44,12 @@ class Window(tkinter.Frame):
         #reference to the master widget, which is the tk window                 
         self.master = master
 
-        #plot instanses
-        self.fig, self.ax = plt.subplots()
+        #plot instanses are created by init_plot() when the window is shown,
+        #matplotlib is the slowest part of the start
+        self.fig = None
+        self.ax = None
+        self.canvas = None
+        self.toolbar = None
 
         #with that, we want to then run init_window, which doesn't yet exist
         self.init_window()
@@ -64,15 +74,12 @@ class Window(tkinter.Frame):
         # allowing the widget to take the full space of the root window
         #self.pack(fill=tkinter.BOTH, expand=1)
 
-        self.plot()
-
-        self.canvas = FigureCanvasTkAgg(self.fig, master=self.master)  # A tk.DrawingArea.
-        self.canvas.draw()
-        self.canvas.get_tk_widget().pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=1)
-
-        self.toolbar = NavigationToolbar2Tk(self.canvas, self.master)
-        self.toolbar.update()
-        self.canvas.get_tk_widget().pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=1)
+        # place of the canvas and the toolbar, the plot is created as soon as it is visible
+        self.toolbar_frame = tkinter.Frame(master=self.master)
+        self.toolbar_frame.pack(side=tkinter.BOTTOM)
+        self.plot_frame = tkinter.Frame(master=self.master)
+        self.plot_frame.pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=1)
+        self.plot_frame.bind('<Map>', self.on_map)
 
         # creating a button instances
         self.button_quit = tkinter.Button(master=self.master, text="Quit", command=self._quit)
@@ -94,19 +101,47 @@ class Window(tkinter.Frame):
         self.button_rightRotation.pack(side=tkinter.LEFT)
 
 
+    def on_map(self, event):
+        self.plot_frame.unbind('<Map>')
+        self.after_idle(self.init_plot)    # after the window is drawn
+
+    def init_plot(self):
+        """
+        It imports matplotlib and creates the plot. The window and the
+        motor buttons work before it is called
+        """
+
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+
+        self.fig = Figure()
+        self.ax = self.fig.add_subplot()
+        self.plot()
+
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.plot_frame)  # A tk.DrawingArea.
+        self.canvas.draw()
+        self.canvas.get_tk_widget().pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=1)
+
+        self.toolbar = NavigationToolbar2Tk(self.canvas, self.toolbar_frame)
+        self.toolbar.update()
+
     def plot(self):
+        if self.ax is None:
+            return
         self.ax.clear()
-        self.ax.set(xlabel='Numers', ylabel='ADC data', title='Antenna Pattern')
+        self.ax.set(xlabel='Degree', ylabel=UNIT_LABELS['V'], title='Antenna Pattern')
         self.ax.set_xlim(left = 0, right = 180)
-        self.ax.set_ylim(bottom = 0, top = 1100)
-        self.ax.plot(degree, data_ADC)
+        self.ax.set_ylim(*calibration.limits('V'))
+        self.ax.plot(degree, voltage)
         self.ax.grid()
 
     def clear(self):
+        if self.ax is None:
+            return
         self.ax.clear()
-        self.ax.set(xlabel='Numers', ylabel='ADC data', title='Antenna Pattern')
+        self.ax.set(xlabel='Degree', ylabel=UNIT_LABELS['V'], title='Antenna Pattern')
         self.ax.set_xlim(left = 0, right = 180)
-        self.ax.set_ylim(bottom = 0, top = 1100)
+        self.ax.set_ylim(*calibration.limits('V'))
         self.ax.grid()
         self.canvas.draw()
         self.toolbar.update()
@@ -114,11 +149,12 @@ class Window(tkinter.Frame):
     def leftRotation(self):
         """
         Starting of the step motor rotation to the left.
-        It writes '2' to the com port
+        It writes the speed and '7' to the com port
         """
 
         global motor_state
-        cmd = b'2'
+        global direction
+        cmd = COMMAND_SPEED[speed] + COMMAND_LEFT
         try:
             ser.open()
         except serial.SerialException:
@@ -129,6 +165,7 @@ class Window(tkinter.Frame):
             ser.write(cmd)
 
         motor_state = True      
+        direction = -1
 
     def stop(self):
         """
@@ -152,11 +189,12 @@ class Window(tkinter.Frame):
     def rightRotation(self):
         """
         Starting of the step motor rotation to the right.
-        It writes '1' to the com port
+        It writes the speed and '9' to the com port
         """
 
         global motor_state
-        cmd = b'1'
+        global direction
+        cmd = COMMAND_SPEED[speed] + COMMAND_RIGHT
         try:
             ser.open()
         except serial.SerialException:
@@ -167,28 +205,32 @@ class Window(tkinter.Frame):
             ser.write(cmd)
 
         motor_state = True
+        direction = 1
 
     def read_data(self):
+        """
+        It reads the sweep until the motor stands at the limit switch.
+        Samples are timestamped and the angle comes from the speed which
+        was sent with the rotation command, ADC data are converted to volts
+        with the lookup table of the calibration
+        """
 
-        global data_ADC
+        global voltage
         global degree
-        global motor_state
-        number = 0
-
-        while motor_state is True and number <= 180:
+        reader = ChunkReader(ser)
+        model = RotationModel(SPEED_MOTOR[speed], direction=direction)
 
-            data = str(ser.readline())
-            idx = data.find("\\n")
-            data = int(data[2:idx])
-            data_ADC.append(data)       
-            degree.append(number)
-            number += 1        
+        def show(chunk):
+            voltage.extend(chunk.voltage.tolist())
+            degree.extend(chunk.angle.tolist())
+            if self.canvas is not None:
+                self.plot()
+                self.canvas.draw()
+                self.toolbar.update()
 
-            self.plot() 
-            self.canvas.draw()
-            self.toolbar.update()
+        read_sweep(reader, model, [show], calibration.convert, TIME * 1e-6, stopped=lambda: motor_state is False)
 
-        data_ADC = []
+        voltage = []
         degree = []
 
             
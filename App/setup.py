@@ -1,7 +1,6 @@
 import cx_Freeze
+import os
 import sys
-import matplotlib
-import serial
 
 base = None
 
@@ -10,9 +9,22 @@ if sys.platform == 'win32':
 
 executables = [cx_Freeze.Executable("AntennaPatternRecorder.py", base=base, icon="gui.ico")]
 
+# Only the modules which the application imports, matplotlib is loaded lazily
+# by Window.init_plot() and needs the Tk backend only
+includes = ["tkinter", "serial", "numpy", "matplotlib.figure", "matplotlib.backends.backend_tkagg",
+            "Serial_Reader", "Serial_Worker", "Sweep_Reader", "Angle_Model", "Binary_Protocol",
+            "Calibration"]
+excludes = ["matplotlib.tests", "matplotlib.testing", "numpy.tests", "numpy.f2py", "numpy.distutils",
+            "matplotlib.backends.backend_qtagg", "matplotlib.backends.backend_qt5agg",
+            "matplotlib.backends.backend_wxagg", "matplotlib.backends.backend_gtk3agg",
+            "matplotlib.backends.backend_pgf", "matplotlib.backends.backend_webagg",
+            "PyQt5", "PyQt6", "PySide2", "PySide6", "wx", "gi", "IPython", "scipy", "pandas",
+            "PIL.ImageQt", "pytest", "setuptools", "pydoc_data", "lib2to3", "test"]
+
 cx_Freeze.setup(
     name = "Antenna-Pattern-Recorder",
-    options = {"build_exe": {"packages":["tkinter","matplotlib","serial"], "include_files":["gui.ico"]}},
+    options = {"build_exe": {"includes": includes, "excludes": excludes, "include_files":["gui.ico"],
+                             "path": sys.path + [os.path.join(os.pardir, "Graphic_User_Interface")]}},
     version = "0.01",
     description = "Graphic user application for Antenna Pattern Recorder",
     executables = executables
@@ -30,6 +30,22 @@
 #define ADC                 A0
 #define MAX_COMMAND_LENGTH  20
 #define SPEED_NUMBER        6
+#define SYNC_BYTE           0xA5
+#define FRAME_LENGTH        6
+#define SEQUENCE_MASK       0x3F
+#define ADC_BITS            10
+#define FIRMWARE_ID         "AntennaPatternRecorder 1.1"
+#define BAUD_NUMBER         8
+#define BAUD_CONFIRM_TIME   500 // ms to confirm a new baud rate before the old one returns
+#define MIN_TIME            200     // us, shorter periods leave no time for the motor
+#define MAX_TIME            1000000 // us
+#define MIN_STEPS           1
+#define MAX_STEPS           2048
+#define MAX_CHANNELS        6       // analog pins A0 ... A5
+#define MULTI_SYNC_BYTE     0xA6    // frame of several channels
+#define MAX_CHANNEL_MASK    ((1 << MAX_CHANNELS) - 1)
+#define ADC_TIME            112     // us of one analogRead() in the ISR
+#define BITS_PER_BYTE       10      // start, 8 data and stop bit on the serial link
 
 
 ///========================================================================================
@@ -64,6 +80,19 @@ Stepper stepper(STEPS, PIN_8, PIN_10, PIN_9, PIN_11); //Instance of the step \
 volatile motor_state_s motor_state;
 int speed_motor[SPEED_NUMBER] = {0, 100, 200, 300, 400, 500};
 volatile int velocity = speed_motor[ZERO_SPEED];
+volatile bool binary_mode = false;     // frames instead of ASCII lines
+volatile bool continuous_mode = false; // samples are sent while the motor stands too
+volatile int step_index = 0;           // position of the motor in steps
+volatile byte frame_sequence = 0;      // sequence counter of binary frames
+long baud_rates[BAUD_NUMBER] = {9600, 19200, 38400, 57600, 115200, 250000, 500000, 1000000};
+volatile int baud_index = 0;           // index of the current baud rate, BAUDE_RATE after reset
+volatile int previous_baud_index = 0;  // baud rate which returns if the new one is not confirmed
+volatile bool baud_pending = false;    // the new baud rate is not confirmed yet
+volatile unsigned long baud_switch_time = 0;
+long timer_period = TIME;              // us, period of Timer1 and of the samples
+int motor_steps = STEPS;               // steps per revolution given to the Stepper library
+volatile byte channel_mask = 1;        // analog pins sampled on every tick, bit 0 is A0
+const byte channel_pins[MAX_CHANNELS] = {A0, A1, A2, A3, A4, A5};
 
 ///========================================================================================
 /// Global functions
@@ -121,8 +150,12 @@ int timerSetup(void) {
 int motorSetup(void) {
     while(velocity == ZERO_SPEED) {
       char command;
+      checkBaudRate();
       if (Serial.available() > 0) {  
         command = (char)Serial.read();
+        if (linkCommand(command) || settingCommand(command)) {
+            continue;
+        }
         switch(command) {
 
             case '0':
@@ -187,6 +220,7 @@ void setup(void) {
  * @return: void
  */
 void loop(void) {
+    checkBaudRate();
     stateStepMotor();
 }
 
@@ -195,6 +229,90 @@ void loop(void) {
 /// Static functions
 ///========================================================================================
 
+/**
+ * @brief:  identify()
+ * It answers the handshake command '?' with the firmware name, version and
+ * current baud rate, e.g. "AntennaPatternRecorder 1.1 9600".
+ *
+ * @param:  void
+ * @return: void
+ */
+static void identify(void) {
+    Serial.print(FIRMWARE_ID);
+    Serial.print(' ');
+    Serial.println(baud_rates[baud_index]);
+}
+
+/**
+ * @brief:  switchBaudRate()
+ * It answers "OK <baud rate>" at the current baud rate and continues at the
+ * new one. The host must confirm the new baud rate with '?' within
+ * BAUD_CONFIRM_TIME, otherwise checkBaudRate() returns to the old one.
+ *
+ * @param:  index - index of the new baud rate in baud_rates
+ * @return: void
+ */
+static void switchBaudRate(int index) {
+    Serial.print("OK ");
+    Serial.println(baud_rates[index]);
+    Serial.flush();     // the answer leaves at the old baud rate
+    Serial.end();
+    Serial.begin(baud_rates[index]);
+    previous_baud_index = baud_index;
+    baud_index = index;
+    baud_switch_time = millis();
+    baud_pending = true;
+}
+
+/**
+ * @brief:  checkBaudRate()
+ * It returns to the previous baud rate when the new one was not confirmed in time,
+ * so a link which does not work at the new baud rate is not lost.
+ *
+ * @param:  void
+ * @return: void
+ */
+static void checkBaudRate(void) {
+    if (baud_pending && millis() - baud_switch_time > BAUD_CONFIRM_TIME) {
+        noInterrupts();
+        baud_pending = false;
+        baud_index = previous_baud_index;
+        interrupts();
+        Serial.end();
+        Serial.begin(baud_rates[baud_index]);
+    }
+}
+
+/**
+ * @brief:  linkCommand()
+ * It handles commands of the serial link: '?' identifies the board and
+ * confirms the baud rate, 'B' followed by a digit switches the baud rate.
+ *
+ * @param:  command - received character
+ * @return: true when the character belongs to a command of the link
+ */
+static bool linkCommand(char command) {
+    static bool baud_argument = false;
+    if (baud_argument) {
+        baud_argument = false;
+        if (command >= '0' && command < '0' + BAUD_NUMBER) {
+            switchBaudRate(command - '0');
+        }
+        return true;
+    }
+    switch(command) {
+        case '?':
+        baud_pending = false;
+        identify();
+        return true;
+
+        case 'B':
+        baud_argument = true;
+        return true;
+    }
+    return false;
+}
+
 /**
  * @brief:  stateStepMotor()
  * The function defines the current state of a step motor
@@ -208,6 +326,9 @@ static void stateStepMotor(void) {
         
         case ACTIVE_L:
         stepper.step(LEFT_ROTATION);
+        noInterrupts(); // step_index is read by data_receive()
+        step_index += LEFT_ROTATION;
+        interrupts();
         if (flag == false) {
             motor_state.last_state = INACTIVE;
         }
@@ -219,6 +340,9 @@ static void stateStepMotor(void) {
         
         case ACTIVE_R:
         stepper.step(RIGHT_ROTATION);
+        noInterrupts(); // step_index is read by data_receive()
+        step_index += RIGHT_ROTATION;
+        interrupts();
         if (flag == false) {
             motor_state.last_state = INACTIVE;
         }
@@ -246,6 +370,106 @@ static void stateStepMotor(void) {
 }
 
 
+/**
+ * @brief:  samplesFit()
+ * Every analogRead() in the ISR takes ADC_TIME and Serial.write() blocks
+ * the ISR until the record fits into the transmit buffer, so all channels
+ * of a mask must be read and their longest record ("1023," per channel)
+ * sent at the current baud rate within one period of Timer1, otherwise the
+ * timer overruns and samples slip.
+ *
+ * @param:  period - period of Timer1 in us
+ * @param:  mask - mask of the analog pins
+ * @return: true when the channels are read and sent within the period
+ */
+static bool samplesFit(long period, byte mask) {
+    long channels = 0;
+    for (int i = 0; i < MAX_CHANNELS; i++) {
+        if (mask & (1 << i)) {
+            channels++;
+        }
+    }
+    long transmit = channels * LENGTH * BITS_PER_BYTE * 1000000L / baud_rates[baud_index];
+    return channels * ADC_TIME + transmit < period;
+}
+
+/**
+ * @brief:  applySetting()
+ * It sets the period of Timer1 ('T'), the steps of the Stepper library ('S')
+ * or the mask of the sampled analog pins ('C', bit 0 is A0) and confirms the
+ * value in use, e.g. "T 12000". A value out of range is not taken, so the
+ * host sees the old one in the answer. A period or a mask is not taken
+ * either when the channels cannot be read within the period (samplesFit()).
+ *
+ * @param:  command - 'T', 'S' or 'C'
+ * @param:  value - period in us, steps per revolution or mask of the pins
+ * @return: void
+ */
+static void applySetting(char command, long value) {
+    if (command == 'C') {
+        if (value >= 1 && value <= MAX_CHANNEL_MASK && samplesFit(timer_period, value)) {
+            noInterrupts(); // channel_mask is read by data_receive()
+            channel_mask = value;
+            interrupts();
+        }
+        Serial.print("C ");
+        Serial.println(channel_mask);
+    }
+    else if (command == 'T') {
+        if (value >= MIN_TIME && value <= MAX_TIME && samplesFit(value, channel_mask)) {
+            timer_period = value;
+            Timer1.setPeriod(timer_period);
+        }
+        Serial.print("T ");
+        Serial.println(timer_period);
+    }
+    else {
+        if (value >= MIN_STEPS && value <= MAX_STEPS) {
+            motor_steps = value;
+            stepper = Stepper(motor_steps, PIN_8, PIN_10, PIN_9, PIN_11);
+            if (velocity != ZERO_SPEED) {
+                stepper.setSpeed(velocity);
+            }
+        }
+        Serial.print("S ");
+        Serial.println(motor_steps);
+    }
+}
+
+/**
+ * @brief:  settingCommand()
+ * It handles commands with a decimal argument which ends with a new line:
+ * 'T' followed by the period of Timer1 in us, 'S' followed by the steps
+ * per revolution and 'C' followed by the mask of the analog pins, e.g.
+ * "T12000\n". The settings are lost at reset.
+ *
+ * @param:  command - received character
+ * @return: true when the character belongs to a setting command
+ */
+static bool settingCommand(char command) {
+    static char setting = 0;
+    static long value = 0;
+    if (setting != 0) {
+        if (command >= '0' && command <= '9') {
+            if (value <= MAX_TIME) {
+                value = value * 10 + (command - '0');
+            }
+        }
+        else {
+            applySetting(setting, value);
+            setting = 0;
+        }
+        return true;
+    }
+    if (command == 'T' || command == 'S' || command == 'C') {
+        setting = command;
+        value = 0;
+        return true;
+    }
+    return false;
+}
+
+
 ///========================================================================================
 /// Interrupt Service Routine
 ///========================================================================================
@@ -260,10 +484,13 @@ static void stateStepMotor(void) {
  */
 void serialEvent(void){
     noInterrupts(); //Disable interrupts
-    Serial.println("serialEvent");
     char command;
     if (Serial.available() > 0) {  
         command = (char)Serial.read();
+        if (linkCommand(command) || settingCommand(command)) {
+            interrupts(); //Enable interrupts
+            return;
+        }
         switch(command) {
             case '8':
             motor_state.current_state = INACTIVE;
@@ -309,6 +536,22 @@ void serialEvent(void){
             velocity = speed_motor[FIFTH_SPEED];
             stepper.setSpeed(velocity);
             break;
+
+            case 'b':
+            binary_mode = true;
+            break;
+
+            case 'a':
+            binary_mode = false;
+            break;
+
+            case 'c':
+            continuous_mode = true;
+            break;
+
+            case 's':
+            continuous_mode = false;
+            break;
         }
     }
     else {
@@ -317,26 +560,98 @@ void serialEvent(void){
     interrupts(); //Enable interrupts
 }
 
+/**
+ * @brief:  frame_pack()
+ * It packs ADC data into binary frame: sync byte, 6 bits of sequence and
+ * 10 bits of ADC data, step index of the motor and XOR checksum.
+ * All words are little endian.
+ *
+ * @param:  frame - buffer of FRAME_LENGTH bytes
+ * @param:  data - ADC data
+ * @return: void
+ */
+static void frame_pack(byte *frame, int data) {
+    unsigned int sequence_adc = ((unsigned int)(frame_sequence & SEQUENCE_MASK) << ADC_BITS) | data;
+
+    frame[0] = SYNC_BYTE;
+    frame[1] = lowByte(sequence_adc);
+    frame[2] = highByte(sequence_adc);
+    frame[3] = lowByte(step_index);
+    frame[4] = highByte(step_index);
+    frame[5] = frame[1] ^ frame[2] ^ frame[3] ^ frame[4];
+    frame_sequence++;
+}
+
+/**
+ * @brief:  multi_frame_pack()
+ * It packs ADC data of several channels into one frame: the frame of
+ * frame_pack() with MULTI_SYNC_BYTE and the first channel, then the ADC data
+ * of the other channels as little endian words and the XOR checksum of all
+ * bytes between sync byte and checksum.
+ *
+ * @param:  frame - buffer of FRAME_LENGTH + 2 * (channels - 1) bytes
+ * @param:  data - ADC data of the channels
+ * @param:  channels - number of channels
+ * @return: length of the frame
+ */
+static int multi_frame_pack(byte *frame, int *data, int channels) {
+    int length = FRAME_LENGTH + 2 * (channels - 1);
+    byte checksum;
+
+    frame_pack(frame, data[0]);
+    frame[0] = MULTI_SYNC_BYTE;
+    checksum = frame[5];    // the words of the other channels take its place
+    for (int i = 1; i < channels; i++) {
+        frame[3 + 2 * i] = lowByte(data[i]);
+        frame[4 + 2 * i] = highByte(data[i]);
+        checksum ^= frame[3 + 2 * i] ^ frame[4 + 2 * i];
+    }
+    frame[length - 1] = checksum;
+    return length;
+}
+
 /**
  * @brief:  data_receive()
  * It receives data from ADC and stores them into buffer. When data is stored 
- * the function transmits them to serial port. It is callback function.
- * It is called by timer like interrupt service routine.
+ * the function transmits them to serial port as ASCII line or as binary
+ * frame, while the motor turns or always in continuous mode. It is callback function.
+ * It is called by timer like interrupt service routine. Every pin of
+ * channel_mask is sampled on every tick and all of them go into one record,
+ * an ASCII line of comma separated values or one frame of several channels.
  *
  * @param:  void
  * @return: void
  */
 void data_receive(void) {
     int len = 0;
-    int data = 0;
-    char data_buff[LENGTH];
+    int data[MAX_CHANNELS];
+    int channels = 0;
+    char data_buff[(LENGTH) * MAX_CHANNELS + 1];  // and the NUL of the last sprintf()
+    byte frame[FRAME_LENGTH + 2 * (MAX_CHANNELS - 1)];
     
     noInterrupts(); //Disable interrupts
-    data = analogRead(ADC);
-    len += sprintf(data_buff, "%d", data);
-    len += sprintf(data_buff + len, "\n");
-    if (motor_state.last_state == ACTIVE_L || motor_state.last_state == ACTIVE_R){
-    Serial.write(data_buff, len); 
+    for (int i = 0; i < MAX_CHANNELS; i++) {
+        if (channel_mask & (1 << i)) {
+            data[channels++] = analogRead(channel_pins[i]);
+        }
+    }
+    if (continuous_mode || motor_state.last_state == ACTIVE_L || motor_state.last_state == ACTIVE_R){
+        if (binary_mode) {
+            if (channels == 1) {
+                frame_pack(frame, data[0]);
+                Serial.write(frame, FRAME_LENGTH);
+            }
+            else {
+                Serial.write(frame, multi_frame_pack(frame, data, channels));
+            }
+        }
+        else {
+            for (int i = 0; i < channels; i++) {
+                len += sprintf(data_buff + len, "%d", data[i]);
+                len += sprintf(data_buff + len, i + 1 < channels ? "," : "\n");
+            }
+            Serial.write(data_buff, len); 
+        }
     }
     interrupts(); //Enable interrupts
 }
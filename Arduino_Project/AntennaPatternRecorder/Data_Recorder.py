@@ -1,45 +1,238 @@
+""" Headless recorder of antenna patterns for automated rigs.
+
+It keeps one connection to the board, homes the turntable by waiting for
+the limit switch and records a number of sweeps (alternately to the right
+and to the left) into session files. It never imports tkinter or matplotlib.
+
+Usage:
+    python Data_Recorder.py --port COM5 --sweeps 4
+    python Data_Recorder.py --port "virtual://?rate=2000&baud=1000000" --baud 1000000
+    python Data_Recorder.py --port auto
+    python Data_Recorder.py --port "replay://sessions/capture.raw?speed=0" --no-home
+"""
+
+import argparse
+import os
+import sys
 import serial
+import threading
 import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, 'Graphic_User_Interface'))
+from Serial_Reader import ChunkReader, mask_channels, pins_mask
+from Binary_Protocol import FrameReader, COMMAND_BINARY, COMMAND_ASCII
+from Session_File import SessionWriter, new_session_path, record_dtype
+from Angle_Model import RotationModel, SPEED_MOTOR, STEPS, TIME
+from Pattern_Metrics import PatternMetrics
+from Sweep_Reader import read_sweep, session_sink, metrics_sink, LIMIT_TIMEOUT, START_TIMEOUT
+from Pattern_Library import PatternLibrary, LIBRARY_NAME
+from Pipeline_Stats import PipelineStats
+from Sampling_Profiler import SamplingProfiler
+import Metrics
+from Virtual_Recorder import VirtualSerial, URL_SCHEME
+from Port_Discovery import connect, wait_for_identity, AUTO_PORT, CACHE_NAME, BOOT_BAUD_RATE
+from Serial_Worker import write_setting, COMMAND_TIMER, COMMAND_STEPS, COMMAND_CHANNELS
+from Replay_Source import ReplaySerial, CaptureTee, REPLAY_SCHEME
+from Calibration import CalibrationProfile, lookup_table, DEFAULT_PROFILE
+
+COMMAND_LEFT = b'7'
+COMMAND_RIGHT = b'9'
+COMMAND_STOP = b'8'
+
+READ_TIMEOUT = 0.01     # s, one read of the port
+BOOT_TIMEOUT = 5.0      # s, the board restarts when the port is opened
+
+
+def save_data(data, filename='data.txt'):
+    """ Save data in file, one value per line """
+
+    with open(filename, 'w') as filehandle:
+        filehandle.writelines("%.1f\n" % place for place in data)
+
+
+def open_port(port, baud_rate):
+    """ It opens a real or a virtual ('virtual://...') port or the playback of
+    a recording ('replay://...') """
+
+    if port.startswith(URL_SCHEME):
+        ser = VirtualSerial.from_url(port, baudrate=baud_rate, timeout=READ_TIMEOUT)
+        ser.open()
+        return ser
+    if port.startswith(REPLAY_SCHEME):
+        ser = ReplaySerial.from_url(port, baudrate=baud_rate, timeout=READ_TIMEOUT)
+        ser.open()
+        return ser
+    return serial.Serial(port, baud_rate, timeout=READ_TIMEOUT)
+
+
+def wait_for_board(ser, speed):
+    """ The board restarts when the port is opened and motorSetup() waits for
+    a speed command. The handshake is repeated until the firmware answers, so
+    the recorder waits exactly as long as the board needs, then the speed is written """
+
+    if wait_for_identity(ser, BOOT_TIMEOUT) is None:
+        raise serial.SerialException("No answer of the recorder on %s" % ser.port)
+    ser.write(b'%d' % speed)
+
+
+def wait_for_limit(reader):
+    """ It reads and drops samples until they stop coming because the motor
+    stands at a limit switch. It returns the number of dropped samples """
+
+    number = 0
+    last = time.monotonic()
+    timeout = START_TIMEOUT
+    while time.monotonic() - last < timeout:
+        data = reader.read()
+        if len(data) > 0:
+            number += len(data)
+            last = time.monotonic()
+            timeout = LIMIT_TIMEOUT
+    return number
+
+
+def record_sweep(ser, reader, args, direction, metadata, stats, calibration):
+    """ It records one sweep from one limit switch to the other into a new session
+    file with read_sweep(). Voltages come from the lookup table of the calibration.
+    Every channel gets its column, the metrics are those of the first one. It
+    returns the path of the file, the samples of the first channel and the metrics """
+
+    model = RotationModel(SPEED_MOTOR[args.speed], args.steps, direction)
+    metrics = PatternMetrics()
+    path = new_session_path(args.directory)
+    chunks = []
+    malformed = reader.malformed
+    channels = mask_channels(args.channels)
+
+    ser.write(b'%d' % args.speed + (COMMAND_RIGHT if direction > 0 else COMMAND_LEFT))
+    with SessionWriter(path, metadata, record_dtype(channels)) as session:
+        sinks = [session_sink(session), metrics_sink(metrics), lambda chunk: chunks.append(chunk.adc['adc'])]
+        number = read_sweep(reader, model, sinks, calibration.convert, args.timer * 1e-6, args.binary,
+                            start_timeout=START_TIMEOUT, stats=stats)[0]
+        result = metrics.result()
+        session.close(samples=number, malformed_records=reader.malformed - malformed, metrics=result,
+                      pipeline=stats.summary())
+
+    data = np.concatenate(chunks) if chunks else np.empty(0)
+    return path, data, result
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Headless recorder of antenna patterns')
+    parser.add_argument('--port', default='COM5',
+                        help="serial port, 'virtual://...', 'replay://recording?speed=N' "
+                             "or 'auto' to look for the recorder on all ports")
+    parser.add_argument('--baud', type=int,
+                        help='baud rate of the firmware (%d), with --port auto the highest one to negotiate'
+                        % BOOT_BAUD_RATE)
+    parser.add_argument('--speed', type=int, default=5, choices=range(1, 6), help='speed command')
+    parser.add_argument('--sweeps', type=int, default=1, help='number of sweeps, directions alternate')
+    parser.add_argument('--binary', action='store_true', help='binary frames with step index')
+    parser.add_argument('--steps', type=int, default=STEPS,
+                        help='steps per revolution of the Stepper library, other than STEPS it is sent to the firmware')
+    parser.add_argument('--timer', type=int, default=TIME,
+                        help='Timer1 period in us, other than TIME it is sent to the firmware')
+    parser.add_argument('--directory', default='sessions', help='directory of the session files')
+    parser.add_argument('--no-home', dest='home', action='store_false',
+                        help='do not move to the left limit switch first')
+    parser.add_argument('--text', help='also save ADC data of the last sweep as text, like data.txt')
+    parser.add_argument('--antenna', default='', help='antenna ID for the session metadata')
+    parser.add_argument('--frequency', type=float, default=0.0, help='frequency in MHz')
+    parser.add_argument('--metrics', help='write runtime metrics at the end, .json or Prometheus text')
+    parser.add_argument('--profile', help='sample stacks during the sweeps into a folded stack file')
+    parser.add_argument('--capture', help='also write the raw serial stream into a capture file (.raw) for replay')
+    parser.add_argument('--calibration', help='calibration profile of the detector (.json), linear 0...5 V by default')
+    parser.add_argument('--channels', type=pins_mask, default='0',
+                        help="analog pins sampled on every tick like '0,1,2', other than A0 alone it is sent to the firmware")
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+    calibration = lookup_table(CalibrationProfile.from_file(args.calibration) if args.calibration else DEFAULT_PROFILE)
+    library = PatternLibrary(os.path.join(args.directory, LIBRARY_NAME))
+    if args.port == AUTO_PORT:
+        started = time.perf_counter()
+        connection = connect([AUTO_PORT], os.path.join(args.directory, CACHE_NAME), args.baud)
+        if connection is None:
+            sys.exit("No recorder answered")
+        print('Found firmware %s on %s at %d baud in %.2f s' % (connection.version, connection.port,
+                                                                connection.baud_rate, time.perf_counter() - started))
+        args.port = connection.port
+        args.baud = connection.baud_rate
+        ser = connection.ser
+        ser.timeout = READ_TIMEOUT
+    else:
+        args.baud = args.baud or BOOT_BAUD_RATE
+        ser = open_port(args.port, args.baud)
+    port = ser
+    try:
+        started = time.perf_counter()
+        wait_for_board(ser, args.speed)
+        for command, value, default in ((COMMAND_TIMER, args.timer, TIME), (COMMAND_STEPS, args.steps, STEPS),
+                                        (COMMAND_CHANNELS, args.channels, 1)):
+            if value != default and write_setting(ser, command, value) != value:
+                raise serial.SerialException("The recorder did not take %s%d" % (command.decode(), value))
+        ser.write(COMMAND_BINARY if args.binary else COMMAND_ASCII)
+        if args.capture:
+            port = CaptureTee(ser, args.capture)
+        channels = mask_channels(args.channels)
+        reader = FrameReader(port, channels) if args.binary else ChunkReader(port, channels)
+        stats = PipelineStats(reader)
+        print('Board ready in %.2f s' % (time.perf_counter() - started))
+
+        if args.home:
+            started = time.perf_counter()
+            ser.write(b'%d' % args.speed + COMMAND_LEFT)
+            wait_for_limit(reader)
+            print('Homed in %.2f s' % (time.perf_counter() - started))
+
+        metadata = {
+            'port': args.port,
+            'baud_rate': args.baud,
+            'steps': args.steps,
+            'timer': args.timer,
+            'speed': args.speed,
+            'binary_mode': args.binary,
+            'channel_mask': args.channels,
+            'channels': channels,
+            'antenna_id': args.antenna,
+            'frequency': args.frequency,
+            'sweeps': args.sweeps,
+            'calibration': calibration.name,
+        }
+        data = np.empty(0)
+        profiler = SamplingProfiler([threading.get_ident()]).start() if args.profile else None
+        for sweep in range(args.sweeps):
+            direction = 1 if sweep % 2 == 0 else -1
+            metadata.update(sweep=sweep, direction=direction)
+            path, data, result = record_sweep(ser, reader, args, direction, metadata, stats, calibration)
+            library.add(path)
+            print('Sweep %d: %d samples, peak %s at %s degrees, beamwidth %s -> %s' % (
+                sweep, len(data), result['peak'], result['peak_angle'], result['beamwidth'], path))
+        if profiler is not None:
+            profiler.stop()
+            profiler.save(args.profile)
+            profiler.report()
+        counters = stats.counters()
+        print('Malformed records: %d, lost frames: %d in %d gaps, duplicates: %d' % (
+            counters['parse_failures'], counters['lost'], counters['gaps'], counters['duplicates']))
+        print('Time per sample between reads: %s' % stats.interval.summary())
+    finally:
+        if port is not ser:
+            port.close()
+        if ser.is_open:
+            ser.write(COMMAND_STOP)
+            ser.close()
+        library.close()
+        if args.metrics:
+            Metrics.REGISTRY.dump(args.metrics)
+
+    if args.text:
+        save_data(data.astype(float), args.text)
+    return 0
+
 
-# Set motor at zero degree point
-ser = serial.Serial('COM5', 9600)
-time.sleep(2)
-ser.write(b'1')
-time.sleep(8)
-ser.close()
-
-# Rotate motor to the end
-ser = serial.Serial('COM5', 9600)
-time.sleep(2)
-ser.write(b'2')
-
-# Read and record the data
-data =[]                       # empty list to store the data
-for i in range(155):           # number of degrees
-    b = ser.readline()         # read a byte string
-    string_n = b.decode()      # decode byte string into Unicode
-    string = string_n.rstrip() # remove \n and \r
-    flt = float(string)        # convert string to float
-    print(flt)
-    data.append(flt)           # add to the end of data list
-ser.close()
-
-# Set motor at zero degree point 
-ser = serial.Serial('COM5', 9600)
-time.sleep(2)
-ser.write(b'1')
-ser.close()
-
-# Save data in file
-with open('data.txt', 'w') as filehandle:
-    filehandle.writelines("%.1f\n" % place for place in data)
-
-# show the data
-for line in data:
-    print(line)
-    import matplotlib.pyplot as plt
-plt.plot(data)
-plt.xlabel('Degrees')
-plt.ylabel('Data Reading')
-plt.title('Data Reading vs. Degrees')
-plt.show()
+if __name__ == '__main__':
+    sys.exit(main())
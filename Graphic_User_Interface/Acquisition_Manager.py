@@ -0,0 +1,225 @@
+import math
+
+import serial
+
+from Sample_Buffer import SampleBuffer
+from Serial_Reader import ChunkReader, mask_channels
+from Binary_Protocol import FrameReader, COMMAND_BINARY, COMMAND_ASCII
+from Virtual_Recorder import VirtualSerial, URL_SCHEME
+from Replay_Source import ReplaySerial, REPLAY_SCHEME
+from Session_File import SessionWriter, new_session_path, record_dtype
+from Serial_Worker import (SerialWorker, COMMAND_LEFT, COMMAND_RIGHT, COMMAND_STOP, COMMAND_SPEED, READ_TIMEOUT,
+                           COMMAND_TIMER, COMMAND_STEPS, COMMAND_CHANNELS, write_setting)
+from Angle_Model import RotationModel, SPEED_MOTOR, STEPS, TIME, TRAVEL_DEGREES, GRID_STEP
+from Pattern_Metrics import PatternMetrics
+from Sweep_Reader import read_sweep, session_sink, metrics_sink
+from Calibration import lookup_table
+
+
+MAX_DEVICES = 8
+BUFFER_CAPACITY = 1 << 16
+
+
+def make_serial(port, baud_rate):
+    """ Closed serial port, 'virtual://...' names give the software model of the
+    recorder, 'replay://...' names the playback of a recording """
+
+    if port.startswith(URL_SCHEME):
+        ser = VirtualSerial.from_url(port)
+    elif port.startswith(REPLAY_SCHEME):
+        ser = ReplaySerial.from_url(port)
+    else:
+        ser = serial.Serial()
+        ser.port = port
+    ser.baudrate = int(baud_rate)
+    ser.timeout = READ_TIMEOUT
+    ser.write_timeout = 0.1
+    return ser
+
+
+class DeviceRecorder:
+    """ One recorder board with its own serial worker, sample buffers, metrics and
+    session files. Commands and sweeps of different devices run on different
+    worker threads, so a slow device does not delay the others """
+
+    def __init__(self, port, index=0, baud_rate=115200, speed=5, steps=STEPS, timer=TIME, channel_mask=1,
+                 binary_mode=False, session_directory='sessions', library=None, metadata=None, calibration=None):
+
+        self.port = port
+        self.index = index
+        self.baud_rate = int(baud_rate)
+        self.speed = speed
+        self.steps = int(steps)
+        self.timer = int(timer)
+        self.channel_mask = int(channel_mask)  # analog pins sampled on every tick, bit 0 is A0
+        self.channels = mask_channels(self.channel_mask)
+        self.binary_mode = binary_mode
+        self.session_directory = session_directory
+        self.library = library
+        self.metadata = metadata or {}
+        self.calibration = calibration or lookup_table()   # lookup table of the detector
+
+        self.samples = SampleBuffer(BUFFER_CAPACITY)
+        self.pattern = SampleBuffer(int(TRAVEL_DEGREES / GRID_STEP) + 1)
+        self.metrics = PatternMetrics()
+        self.direction = 0          # direction of the motor after the last command
+        self.recording = False
+        self.stop_flag = False
+        self.session_path = None
+        self.malformed_records = 0
+        self.lost_frames = 0
+
+        self.ser = make_serial(port, self.baud_rate)
+        self.worker = SerialWorker(self.ser)
+        self.worker.start()
+        self.worker.submit(COMMAND_BINARY if binary_mode is True else COMMAND_ASCII)
+        if self.timer != TIME:
+            self.settings(COMMAND_TIMER, self.timer)
+        if self.steps != STEPS:
+            self.settings(COMMAND_STEPS, self.steps)
+        if self.channel_mask != 1:
+            self.settings(COMMAND_CHANNELS, self.channel_mask)
+
+    def settings(self, command, value):
+        """ It queues a setting of the firmware (COMMAND_TIMER, COMMAND_STEPS or
+        COMMAND_CHANNELS) and takes the value which the firmware confirms. It returns the future
+        of that value or of None """
+
+        def confirm():
+            confirmed = write_setting(self.ser, command, value)
+            if confirmed is not None:
+                if command == COMMAND_STEPS:
+                    self.steps = confirmed
+                elif command == COMMAND_CHANNELS:
+                    self.channel_mask = confirmed
+                    self.channels = mask_channels(confirmed)
+                else:
+                    self.timer = confirmed
+            return confirmed
+
+        return self.worker.submit(confirm)
+
+    def _command(self, cmd, direction):
+
+        def written(future):
+            if future.exception() is None:
+                self.direction = direction
+
+        future = self.worker.submit(cmd)
+        future.add_done_callback(written)
+        return future
+
+    def left(self):
+        self.stop_flag = False
+        return self._command(COMMAND_SPEED[self.speed] + COMMAND_LEFT, -1)
+
+    def right(self):
+        self.stop_flag = False
+        return self._command(COMMAND_SPEED[self.speed] + COMMAND_RIGHT, 1)
+
+    def stop(self):
+        self.stop_flag = True
+        return self._command(COMMAND_STOP, 0)
+
+    def record(self):
+        """ It queues reading of one sweep, the motor must be turning. It returns
+        the future of the sweep or None """
+
+        if self.recording is True or self.direction == 0:
+            return None
+        self.recording = True
+        self.stop_flag = False
+        self.samples.clear()
+        return self.worker.submit(self._sweep)
+
+    def _sweep(self):
+        """ Job of the worker: one sweep from limit switch to limit switch """
+
+        direction = self.direction
+        model = RotationModel(SPEED_MOTOR[max(self.speed, 1)], self.steps, direction)
+        channels = self.channels
+        reader = FrameReader(self.ser, channels) if self.binary_mode is True else ChunkReader(self.ser, channels)
+
+        self.pattern.clear()
+        self.metrics.reset()
+        self.session_path = new_session_path(self.session_directory, 'session_%d' % self.index)
+        metadata = dict(self.metadata, device=self.index, port=self.port, baud_rate=self.baud_rate, steps=self.steps,
+                        timer=self.timer, channel_mask=self.channel_mask, speed=self.speed,
+                        binary_mode=self.binary_mode, direction=direction, calibration=self.calibration.name)
+        session = SessionWriter(self.session_path, metadata, record_dtype(channels))
+
+        def buffers(chunk):
+            self.samples.append(voltage=chunk.voltage, angle=chunk.angle, timestamp=chunk.timestamp)
+            self.pattern.append(angle=chunk.grid, **chunk.values)
+            self.malformed_records = reader.malformed
+            if self.binary_mode is True:
+                self.lost_frames = reader.lost
+
+        try:
+            number = read_sweep(reader, model, [buffers, session_sink(session), metrics_sink(self.metrics)],
+                                self.calibration.convert, self.timer * 1e-6, self.binary_mode,
+                                stopped=lambda: self.stop_flag is True or self.ser.isOpen() is False,
+                                idle=self.worker.write_pending)[0]
+        finally:
+            session.close(samples=session.count, malformed_records=reader.malformed,
+                          metrics=self.metrics.result())
+            self.recording = False
+            if self.library is not None:
+                self.library.add(self.session_path)
+        return number
+
+    def close(self, timeout=1.0):
+
+        self.stop()
+        self.worker.close(timeout)
+
+
+class AcquisitionManager:
+    """ Several recorder boards in one process. Every device has its own worker
+    thread; the GUI reads their buffers from one timer """
+
+    def __init__(self, session_directory='sessions', library=None):
+
+        self.session_directory = session_directory
+        self.library = library
+        self.devices = []
+
+    def open(self, ports, **settings):
+        """ It opens the ports and returns their devices. Settings are passed to
+        every DeviceRecorder """
+
+        if len(self.devices) + len(ports) > MAX_DEVICES:
+            raise ValueError("At most %d devices are supported" % MAX_DEVICES)
+        opened = [DeviceRecorder(port, index, session_directory=self.session_directory,
+                                 library=self.library, **settings)
+                  for index, port in enumerate(ports, len(self.devices))]
+        self.devices += opened
+        return opened
+
+    def close(self):
+
+        for device in self.devices:
+            device.close()
+        self.devices = []
+
+    def left(self):
+        return [device.left() for device in self.devices]
+
+    def right(self):
+        return [device.right() for device in self.devices]
+
+    def stop(self):
+        return [device.stop() for device in self.devices]
+
+    def record(self):
+        return [device.record() for device in self.devices]
+
+    def recording(self):
+        return any(device.recording for device in self.devices)
+
+
+def subplot_grid(number):
+    """ Rows and columns of subplots for `number` devices """
+
+    columns = math.ceil(math.sqrt(number))
+    return math.ceil(number / columns), columns
@@ -0,0 +1,106 @@
+import numpy as np
+
+from Binary_Protocol import DEGREES_PER_STEP
+
+
+# Constants of the firmware (AntennaPatternRecorder.ino)
+STEPS = 30                  # steps per revolution given to the Stepper library
+TIME = 24383                # period of Timer1 in us, one ADC sample per period
+SPEED_MOTOR = (0, 100, 200, 300, 400, 500)     # speed_motor[], rpm of the Stepper library
+TRAVEL_DEGREES = 180.0      # angle between the limit switches
+GRID_STEP = 1.0             # degrees between points of the resampled pattern
+
+
+def sample_times(count, received, period=TIME * 1e-6, previous=None):
+    """ Host timestamps of `count` samples which were read together at `received`.
+
+    The firmware sends one sample per Timer1 period, so the samples of a chunk
+    are dated back from the moment of the read one period apart. Timestamps
+    never go back and never come closer than one period to `previous`, the
+    timestamp of the last sample of the previous chunk.
+    """
+
+    times = received - period * np.arange(count - 1, -1, -1)
+    if previous is not None and count > 0:
+        times = np.maximum(times, previous + period * np.arange(1, count + 1))
+    return times
+
+
+class RotationModel:
+    """ Angle of the turntable as a function of time.
+
+    The Stepper library makes one step every 60 / (steps * rpm) seconds and a
+    step turns the table by DEGREES_PER_STEP, so the table turns at a constant
+    rate from the first sample of the sweep. A sweep to the right starts at 0,
+    a sweep to the left at the other limit switch; the angle does not go
+    beyond the switches, where the firmware stops the motor.
+    """
+
+    def __init__(self, rpm, steps=STEPS, direction=1, angle=None, travel=TRAVEL_DEGREES):
+
+        self.rate = DEGREES_PER_STEP * steps * rpm / 60    # degrees per second
+        self.direction = direction
+        self.travel = travel
+        if angle is None:
+            angle = 0.0 if direction > 0 else travel
+        self.start_angle = angle
+        self.start_time = None
+
+    def angle(self, times):
+        """ Angles of samples taken at `times` (seconds, one clock for the sweep) """
+
+        times = np.asarray(times, dtype=float)
+        if self.start_time is None and len(times) > 0:
+            self.start_time = times[0]
+        if self.start_time is None:
+            return times.copy()
+        angle = self.start_angle + self.direction * self.rate * (times - self.start_time)
+        return np.clip(angle, 0.0, self.travel)
+
+    def duration(self):
+        """ Time from the start of the sweep to the limit switch in seconds """
+
+        distance = self.travel - self.start_angle if self.direction > 0 else self.start_angle
+        return distance / self.rate
+
+
+class GridResampler:
+    """ Incremental resampling of a sweep onto the uniform grid k * step.
+
+    Every chunk is interpolated together with the last sample of the previous
+    chunk, so the result does not depend on how the sweep was split into
+    chunks, and each grid point is produced exactly once. Sweeps to the left
+    give grid points in decreasing order.
+    """
+
+    def __init__(self, direction=1, step=GRID_STEP):
+
+        self.direction = 1 if direction >= 0 else -1
+        self.step = step
+        self.last = None    # last sample: position along the sweep and columns
+        self.next = None    # index of the next grid point
+
+    def add(self, angle, **columns):
+        """ It returns angles of new grid points and columns interpolated at them """
+
+        position = self.direction * np.asarray(angle, dtype=float)
+        columns = {name: np.asarray(value, dtype=float) for name, value in columns.items()}
+        if len(position) == 0:
+            return position, columns
+
+        if self.last is not None:
+            position = np.concatenate(([self.last[0]], position))
+            columns = {name: np.concatenate(([self.last[1][name]], value))
+                       for name, value in columns.items()}
+        # the table never turns back within a sweep, jitter must not either
+        position = np.maximum.accumulate(position)
+        self.last = (position[-1], {name: value[-1] for name, value in columns.items()})
+
+        if self.next is None:
+            self.next = int(np.ceil(position[0] / self.step))
+        end = int(np.floor(position[-1] / self.step)) + 1
+        grid = self.step * np.arange(self.next, max(end, self.next))
+        self.next = max(end, self.next)
+
+        values = {name: np.interp(grid, position, value) for name, value in columns.items()}
+        return self.direction * grid + 0.0, values  # no -0.0
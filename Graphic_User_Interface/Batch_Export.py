@@ -0,0 +1,249 @@
+""" Batch export of recorded sweeps: polar and Cartesian pattern images, CSV and NPZ.
+
+Sessions come from a directory or from a query of the pattern library and are
+exported in a pool of processes, one per core by default. Every worker renders
+with the Agg backend and keeps its figures, so a session only replaces the data
+of the lines. A manifest in the output directory keeps a content hash of every
+exported session together with the export settings; sessions whose hash did
+not change and whose outputs exist are skipped:
+
+    python Batch_Export.py sessions --output exports
+    python Batch_Export.py sessions/library.sqlite --antenna DUT1 --from 2020-01-01 --unit dB
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from Session_File import EXTENSION, open_session
+from Pattern_Library import PatternLibrary
+from Calibration import CalibrationProfile, lookup_table, DEFAULT_PROFILE, UNITS, UNIT_LABELS
+from Angle_Model import TRAVEL_DEGREES
+
+
+MANIFEST_NAME = 'export.json'
+OUTPUTS = ('_polar.png', '_cartesian.png', '.csv', '.npz')  # suffixes of the files of one session
+CSV_COLUMNS = ('timestamp', 'angle', 'adc', 'voltage', 'value')
+HASH_BLOCK = 1 << 20        # bytes read at once for the content hash
+DPI = 100
+FIGURE_SIZE = (6.4, 4.8)    # inches
+
+_template = None    # figures of this worker process, see init_worker()
+
+
+def content_hash(path, settings):
+    """ SHA-256 of a session file and of the export settings """
+
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    with open(path, 'rb') as session:
+        for block in iter(lambda: session.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def output_paths(path, directory):
+    """ Files exported from a session, by suffix """
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    return {suffix: os.path.join(directory, name + suffix) for suffix in OUTPUTS}
+
+
+class FigureTemplate:
+    """ Polar and Cartesian figures of one worker. Axes, labels, limits and
+    grids are created once, a session replaces the data of the lines and the
+    titles only """
+
+    def __init__(self, unit, limits, dpi=DPI):
+
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.dpi = dpi
+        self.cartesian = Figure(figsize=FIGURE_SIZE)
+        FigureCanvasAgg(self.cartesian)
+        self.ax = self.cartesian.add_subplot()
+        self.ax.set(xlabel='Degree', ylabel=UNIT_LABELS[unit])
+        self.ax.set_xlim(left = 0, right = TRAVEL_DEGREES)
+        self.ax.set_ylim(*limits)
+        self.ax.grid()
+        self.line, = self.ax.plot([], [], color='C0', linewidth=0.8)
+
+        self.polar = Figure(figsize=FIGURE_SIZE)
+        FigureCanvasAgg(self.polar)
+        self.polar_ax = self.polar.add_subplot(projection='polar')
+        self.polar_ax.set_thetamin(0)
+        self.polar_ax.set_thetamax(TRAVEL_DEGREES)
+        self.polar_ax.set_rlim(*limits)
+        self.polar_ax.set_xlabel(UNIT_LABELS[unit])
+        self.polar_line, = self.polar_ax.plot([], [], color='C0', linewidth=0.8)
+
+    def render(self, angle, value, title, paths):
+
+        self.line.set_data(angle, value)
+        self.ax.set_title(title, fontsize='small')
+        self.cartesian.savefig(paths['_cartesian.png'], dpi=self.dpi)
+        self.polar_line.set_data(np.radians(angle), value)
+        self.polar_ax.set_title(title, fontsize='small')
+        self.polar.savefig(paths['_polar.png'], dpi=self.dpi)
+
+
+def init_worker(profile, unit, dpi):
+    """ It prepares a worker process: the Agg backend, the lookup table of the
+    calibration and the figure template """
+
+    global _template
+
+    import matplotlib
+    matplotlib.use('Agg')
+    table = lookup_table(profile)
+    _template = (table, unit, FigureTemplate(unit, table.limits(unit), dpi))
+
+
+def session_title(header, path):
+    """ Title of the images of a session """
+
+    metadata = header.get('metadata', {})
+    start = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(header.get('start_time') or 0))
+    text = '%s  %s' % (metadata.get('antenna_id') or os.path.basename(path), start)
+    if metadata.get('frequency'):
+        text += '  %g MHz' % metadata['frequency']
+    return text
+
+
+def export_session(task):
+    """ It exports one session in a worker. task is (path, output directory,
+    settings, hash of the last export or None). It returns (path, hash,
+    'written', 'skipped' or the error) """
+
+    path, directory, settings, previous = task
+    try:
+        digest = content_hash(path, settings)
+        paths = output_paths(path, directory)
+        if digest == previous and all(os.path.exists(output) for output in paths.values()):
+            return path, digest, 'skipped'
+
+        table, unit, template = _template
+        header, records = open_session(path)
+        adc = np.asarray(records['adc'])
+        if unit == 'dB':
+            value = table.convert(adc, 'dBm')
+            value = value - value.max() if len(value) > 0 else value
+        else:
+            value = table.convert(adc, unit)
+        columns = {name: np.asarray(records[name]) for name in CSV_COLUMNS if name != 'value'}
+        columns['value'] = value
+        del records
+
+        template.render(columns['angle'], value, session_title(header, path), paths)
+        np.savetxt(paths['.csv'], np.column_stack([columns[name] for name in CSV_COLUMNS]),
+                   fmt=['%.6f', '%.3f', '%d', '%.4f', '%.4f'], delimiter=',',
+                   header=','.join(CSV_COLUMNS[:-1] + (unit,)), comments='')
+        np.savez(paths['.npz'], header=json.dumps(header), unit=unit, **columns)
+        return path, digest, 'written'
+    except (OSError, ValueError, KeyError, struct.error) as error:
+        return path, None, str(error)   # unreadable or truncated, the other sessions go on
+
+
+def find_sessions(source, start=None, end=None, antenna_id=None, frequency=None, tolerance=0.0):
+    """ Session files of a directory, or of the rows of a pattern library which
+    match the query """
+
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, '*' + EXTENSION)))
+    library = PatternLibrary(source)
+    try:
+        rows = library.query(start, end, antenna_id, frequency, tolerance)
+    finally:
+        library.close()
+    return [row['path'] for row in rows if os.path.exists(row['path'])]
+
+
+class Manifest:
+    """ Content hashes of the exported sessions by path, in a JSON file """
+
+    def __init__(self, path):
+
+        self.path = path
+        try:
+            with open(path) as file:
+                self.hashes = json.load(file)
+        except (OSError, ValueError):
+            self.hashes = {}
+
+    def save(self):
+
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.hashes, file, indent=2)
+        os.replace(temporary, self.path)
+
+
+def export(paths, directory, profile=DEFAULT_PROFILE, unit='V', workers=None, dpi=DPI):
+    """ It exports sessions in a pool of processes and returns the number of
+    written, skipped and failed sessions """
+
+    os.makedirs(directory, exist_ok=True)
+    manifest = Manifest(os.path.join(directory, MANIFEST_NAME))
+    settings = {'calibration': list(profile.key()), 'unit': unit, 'dpi': dpi, 'outputs': OUTPUTS}
+    tasks = [(os.path.abspath(path), directory, settings, manifest.hashes.get(os.path.abspath(path)))
+             for path in paths]
+    workers = workers or os.cpu_count() or 1
+    counts = {'written': 0, 'skipped': 0, 'failed': 0}
+    if not tasks:
+        return counts
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=init_worker,
+                             initargs=(profile, unit, dpi)) as executor:
+        chunksize = max(len(tasks) // (workers * 4), 1)
+        for path, digest, status in executor.map(export_session, tasks, chunksize=chunksize):
+            if status in ('written', 'skipped'):
+                counts[status] += 1
+                manifest.hashes[path] = digest
+            else:
+                counts['failed'] += 1
+                manifest.hashes.pop(path, None)
+                print('%s is not exported: %s' % (path, status))
+    manifest.save()
+    return counts
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Batch export of recorded antenna patterns')
+    parser.add_argument('source', help='directory of session files or pattern library (.sqlite)')
+    parser.add_argument('--output', default='exports', help='directory of the exported files')
+    parser.add_argument('--workers', type=int, help='processes, one per core by default')
+    parser.add_argument('--unit', default='V', choices=UNITS, help='unit of the images and of the value column')
+    parser.add_argument('--calibration', help='calibration profile of the detector (.json)')
+    parser.add_argument('--dpi', type=int, default=DPI, help='resolution of the images')
+    parser.add_argument('--antenna', help='library query: antenna ID')
+    parser.add_argument('--frequency', type=float, help='library query: frequency in MHz')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='library query: frequency tolerance in MHz')
+    parser.add_argument('--from', dest='first_day', help='library query: first day, YYYY-MM-DD')
+    parser.add_argument('--to', dest='last_day', help='library query: last day, YYYY-MM-DD')
+    args = parser.parse_args()
+
+    start = time.mktime(time.strptime(args.first_day, '%Y-%m-%d')) if args.first_day else None
+    end = time.mktime(time.strptime(args.last_day, '%Y-%m-%d')) + 24 * 3600 if args.last_day else None
+    profile = CalibrationProfile.from_file(args.calibration) if args.calibration else DEFAULT_PROFILE
+
+    started = time.perf_counter()
+    paths = find_sessions(args.source, start, end, args.antenna, args.frequency, args.tolerance)
+    counts = export(paths, args.output, profile, args.unit, args.workers, args.dpi)
+    elapsed = time.perf_counter() - started
+    print('%d sessions written, %d up to date, %d failed in %.1f s (%.1f sessions/s)' % (
+        counts['written'], counts['skipped'], counts['failed'], elapsed,
+        (counts['written'] + counts['skipped']) / elapsed if elapsed > 0 else 0.0))
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,387 @@
+""" Benchmarks of the acquisition and rendering path.
+
+Every sweep size runs in its own process, so peak RSS belongs to one size only.
+Results are written as JSON and can be compared with a baseline:
+
+    python Benchmark.py --output bench.json
+    python Benchmark.py --baseline bench.json --tolerance 0.2
+    python Benchmark.py --replay sessions/capture.raw --sizes 10000
+
+Cold start of the GUI is measured in new interpreters and reported as 'startup'.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, os.pardir, 'Arduino_Project', 'AntennaPatternRecorder'))
+
+SIZES = (180, 10000, 1000000)
+CHUNK = 4096                # bytes returned by one read of the recorded stream
+FRAME_PERIOD = 0.01         # the plot is refreshed every 10 ms like WorkSpace.plot
+STARTUP_RUNS = 5
+MULTI_CHANNELS = 3          # co-polar, cross-polar and reference detector
+
+# Direction of every metric: True if higher is better
+HIGHER_IS_BETTER = {
+    'parse_samples_per_sec': True,
+    'binary_samples_per_sec': True,
+    'multi_parse_records_per_sec': True,
+    'multi_binary_records_per_sec': True,
+    'binary_corrupt_received': True,
+    'convert_samples_per_sec': True,
+    'acquisition_samples_per_sec': True,
+    'dropped_samples': False,
+    'parse_failures': False,
+    'latency_p50_ms': False,
+    'latency_p95_ms': False,
+    'latency_p99_ms': False,
+    'plot_frames_per_sec': True,
+    'plot_frame_ms': False,
+    'file_samples_per_sec': True,
+    'peak_rss_mb': False,
+    'startup_first_ms': False,
+    'startup_ms': False,
+    'plot_import_ms': False,
+}
+
+
+class StreamPort:
+    """ Recorded serial stream which is returned as fast as it is read.
+    The port closes itself at the end of the stream """
+
+    def __init__(self, data, chunk=CHUNK):
+        self.data = data
+        self.chunk = chunk
+        self.offset = 0
+
+    @property
+    def in_waiting(self):
+        return min(self.chunk, len(self.data) - self.offset)
+
+    def read(self, size=1):
+        data = self.data[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+    def readline(self):
+        """ A line or, like a readline() which timed out, the part of it within one chunk """
+
+        end = self.data.find(b'\n', self.offset, self.offset + self.chunk)
+        return self.read(self.chunk if end < 0 else end + 1 - self.offset)
+
+    def write(self, data):
+        return len(data)
+
+    def reset_input_buffer(self):
+        pass    # the stream is the answer to the next command
+
+    def isOpen(self):
+        return self.offset < len(self.data)
+
+
+def synthetic_adc(size, seed=0):
+    """ ADC counts of a synthetic pattern with noise """
+
+    from Virtual_Recorder import default_pattern
+
+    angle = np.linspace(0, 180, size)
+    noise = np.random.default_rng(seed).normal(0, 2, size)
+    return np.clip(np.rint(default_pattern(angle) + noise), 0, 1023).astype(np.int64)
+
+
+def peak_rss_mb():
+    """ Peak resident set size of this process or None where it is unknown """
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+def bench_parse(size, stream=None):
+    """ Parsing of a synthetic ASCII stream or of a recorded one, and decoding of
+    the same samples as binary frames """
+
+    from Serial_Reader import ChunkReader
+    from Binary_Protocol import FrameReader, encode_frames
+    from Serial_Worker import write_setting, COMMAND_TIMER
+    from Virtual_Recorder import encode_ascii
+
+    adc = synthetic_adc(size)
+    result = {}
+
+    if stream is not None:
+        with open(stream, 'rb') as capture:
+            data = capture.read()
+    else:
+        data = encode_ascii(adc)
+
+    reader = ChunkReader(StreamPort(data))
+    start = time.perf_counter()
+    received = 0
+    while reader.ser.isOpen():
+        received += len(reader.read())
+    result['parse_samples_per_sec'] = received / (time.perf_counter() - start)
+    result['parse_malformed'] = reader.malformed
+
+    frames = encode_frames(np.arange(size), np.arange(size), adc)
+    reader = FrameReader(StreamPort(frames))
+    start = time.perf_counter()
+    while reader.ser.isOpen():
+        reader.read()
+    result['binary_samples_per_sec'] = reader.received / (time.perf_counter() - start)
+    result['binary_lost'] = reader.lost
+
+    # every 50th frame with a wrong checksum, one frame per read, so some reads hold a corrupted frame only
+    corrupted = np.frombuffer(frames, dtype=np.uint8).reshape(size, -1).copy()
+    corrupted[::50, -1] ^= 0xFF
+    reader = FrameReader(StreamPort(corrupted.tobytes(), corrupted.shape[1]))
+    while reader.ser.isOpen():
+        reader.read()
+    result['binary_corrupt_bad_frames'] = reader.malformed
+    result['binary_corrupt_received'] = reader.received
+
+    # records of three channels, the same samples with the cross-polar and reference levels
+    multi = np.column_stack((adc, adc // 10, np.full(size, 600)))
+    reader = ChunkReader(StreamPort(encode_ascii(multi)), MULTI_CHANNELS)
+    start = time.perf_counter()
+    while reader.ser.isOpen():
+        reader.read()
+    result['multi_parse_records_per_sec'] = reader.received / (time.perf_counter() - start)
+    reader = FrameReader(StreamPort(encode_frames(np.arange(size), np.arange(size), multi)), MULTI_CHANNELS)
+    start = time.perf_counter()
+    while reader.ser.isOpen():
+        reader.read()
+    result['multi_binary_records_per_sec'] = reader.received / (time.perf_counter() - start)
+
+    # the answer of a setting command in parts of 3 bytes, after a sample which was on its way
+    answer = write_setting(StreamPort(b'512\r\nT 12000\r\n', 3), COMMAND_TIMER, 12000)
+    result['setting_fragmented_reply'] = answer == 12000
+    return result
+
+
+def bench_convert(gui, size):
+
+    adc = synthetic_adc(size)
+    start = time.perf_counter()
+    for first in range(0, size, CHUNK):
+        gui.convertToVoltage(adc[first:first + CHUNK])
+    return {'convert_samples_per_sec': size / (time.perf_counter() - start)}
+
+
+def bench_acquisition(gui, size, replay=None):
+    """ treadDataProcessing() on a paced virtual recorder, or on a recording
+    played back as fast as it is read, with the plot refreshed every
+    FRAME_PERIOD like WorkSpace.plot does """
+
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from Plot_Renderer import BlitRenderer
+    from Sample_Buffer import SampleBuffer
+    from Serial_Worker import SerialWorker
+    from Virtual_Recorder import VirtualSerial
+    from Replay_Source import ReplaySerial, REPLAY_SCHEME
+
+    if replay is None:
+        rate = max(size / 2.0, 1000.0)
+        baud = int(rate * 60)
+        ser = VirtualSerial.from_url('virtual://?rate=%f&baud=%d&travel=1000000000&seed=1' % (rate, baud),
+                                     timeout=0.1)
+    else:
+        ser = ReplaySerial.from_url(REPLAY_SCHEME + replay + '?speed=0', timeout=0.1)
+    ser.open()
+    ser.write(b'5')     # the firmware waits for a speed command
+    ser.write(b'9')     # right rotation starts the stream
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.set_xlim(0, size)
+    ax.set_ylim(0, 5.5)
+    ax.grid()
+    renderer = BlitRenderer(ax, fig.canvas)
+    fig.canvas.draw()
+
+    gui.ser = ser
+    gui.worker = SerialWorker(ser)
+    gui.samples = SampleBuffer(size + 1, gui.SAMPLE_COLUMNS, np.float64)
+    gui.max_samples = size - 1
+    gui.stop = False
+    gui.binary_mode = False
+    gui.thread_flag = True
+
+    origin = time.perf_counter()
+    gui.worker.start()
+    job = gui.worker.submit(gui.treadDataProcessing)
+
+    version = 0
+    frames = 0
+    latencies = []
+    while not job.done() or version < gui.samples.version:
+        time.sleep(FRAME_PERIOD)
+        current, sweep = gui.samples.snapshot()
+        fresh = min(current - version, len(sweep['timestamp']))
+        renderer.update(sweep['angle'], sweep['value'], fresh)
+        shown = time.perf_counter()
+        latencies.append(shown - sweep['received'][len(sweep['received']) - fresh:])
+        version = current
+        frames += 1
+    elapsed = time.perf_counter() - origin
+    job.result()
+    gui.worker.close()
+
+    latencies = np.concatenate(latencies) * 1000
+    received = gui.samples.version
+    recorder = getattr(ser, 'recorder', None)   # the virtual recorder counts what the link dropped
+    p50, p95, p99 = np.percentile(latencies, (50, 95, 99)) if len(latencies) else (0, 0, 0)
+    return {
+        'acquisition_samples_per_sec': received / elapsed,
+        'dropped_samples': int(recorder.overruns) if recorder is not None else 0,
+        'parse_failures': gui.pipeline.counters()['parse_failures'],
+        'overflow_bytes': int(recorder.rx_overflow) if recorder is not None else 0,
+        'latency_p50_ms': float(p50),
+        'latency_p95_ms': float(p95),
+        'latency_p99_ms': float(p99),
+        'plot_frames_per_sec': frames / elapsed,
+        'plot_frame_ms': renderer.mean_frame_time() * 1000,
+    }
+
+
+def bench_file(size):
+
+    import Data_Recorder
+
+    data = synthetic_adc(size).astype(float)
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        Data_Recorder.save_data(data, os.path.join(directory, 'data.txt'))
+        elapsed = time.perf_counter() - start
+    return {'file_samples_per_sec': size / elapsed}
+
+
+def bench_startup(runs=STARTUP_RUNS):
+    """ Start of new interpreters which import the GUI, i.e. everything needed
+    before the window is shown, and then the plotting stack which WorkSpace
+    loads when the window is visible. The first run is the coldest one """
+
+    window = "import GUI_AntennaPatternRecorder"
+    plot = (window + "; import time; start = time.perf_counter(); "
+            "import matplotlib.figure, matplotlib.backends.backend_tkagg, Plot_Renderer; "
+            "print(time.perf_counter() - start)")
+    starts = []
+    plots = []
+    for run in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', window], cwd=HERE, check=True)
+        starts.append(time.perf_counter() - start)
+        output = subprocess.run([sys.executable, '-c', plot], cwd=HERE, check=True,
+                                capture_output=True, text=True).stdout
+        plots.append(float(output))
+    return {
+        'startup_first_ms': starts[0] * 1000,
+        'startup_ms': float(np.median(starts)) * 1000,
+        'plot_import_ms': float(np.median(plots)) * 1000,
+    }
+
+
+def run_size(size, stream=None, replay=None):
+    """ All benchmarks of one sweep size in the current process """
+
+    import GUI_AntennaPatternRecorder as gui
+
+    result = {}
+    result.update(bench_parse(size, stream))
+    result.update(bench_convert(gui, size))
+    result.update(bench_acquisition(gui, size, replay))
+    result.update(bench_file(size))
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run_all(sizes, stream=None, replay=None):
+
+    results = {}
+    for size in sizes:
+        command = [sys.executable, os.path.abspath(__file__), '--single', str(size)]
+        if stream is not None:
+            command += ['--stream', os.path.abspath(stream)]
+        if replay is not None:
+            command += ['--replay', os.path.abspath(replay)]
+        output = subprocess.run(command, cwd=HERE, check=True, capture_output=True, text=True).stdout
+        results[str(size)] = json.loads(output)
+        print('%8d samples done' % size, file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """ It returns a list of metrics which are worse than the baseline by more than
+    `tolerance` (relative) """
+
+    regressions = []
+    for size, metrics in results.items():
+        for name, value in metrics.items():
+            old = baseline.get(size, {}).get(name)
+            if name not in HIGHER_IS_BETTER or value is None or not old:
+                continue
+            change = (value - old) / abs(old)
+            if HIGHER_IS_BETTER[name]:
+                change = -change
+            if change > tolerance:
+                regressions.append((size, name, old, value))
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmarks of the Antenna Pattern Recorder pipeline')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='sweep sizes in samples')
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--baseline', help='JSON file of previous results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    parser.add_argument('--stream', help='recorded raw ASCII serial stream for the parse benchmark')
+    parser.add_argument('--replay', help='recording (raw capture, session or data.txt) for the acquisition '
+                                         'benchmark instead of the virtual recorder')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        json.dump(run_size(args.single, args.stream, args.replay), sys.stdout)
+        return 0
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'results': run_all(args.sizes, args.stream, args.replay),
+    }
+    report['results']['startup'] = bench_startup()
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(report['results'], json.load(baseline)['results'], args.tolerance)
+        for size, name, old, value in regressions:
+            print('REGRESSION %s samples: %s %.4g -> %.4g' % (size, name, old, value), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
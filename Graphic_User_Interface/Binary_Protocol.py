@@ -0,0 +1,225 @@
+import struct
+import time
+
+import numpy as np
+
+from Serial_Reader import READ_TIME, READ_BYTES, PARSE_TIME, PARSED, PARSE_FAILURES, channel_names
+
+
+# Frame sent by the firmware in binary mode, little endian, 6 bytes:
+#   sync byte 0xA5
+#   uint16 sequence (upper 6 bits) and ADC value (lower 10 bits)
+#   int16 step index of the stepper motor
+#   checksum, XOR of the 4 bytes between sync byte and checksum
+# A frame of several channels starts with MULTI_SYNC_BYTE, it has the ADC
+# values of the other channels as uint16 words before the checksum, which is
+# the XOR of all bytes between sync byte and checksum
+SYNC_BYTE = 0xA5
+MULTI_SYNC_BYTE = 0xA6
+FRAME = np.dtype([('sync', 'u1'), ('sequence_adc', '<u2'), ('step', '<i2'), ('checksum', 'u1')])
+FRAME_LENGTH = FRAME.itemsize
+FRAME_FORMAT = '<BHhB'
+SEQUENCE_BITS = 6
+SEQUENCE_MODULO = 1 << SEQUENCE_BITS
+ADC_BITS = 10
+ADC_MASK = (1 << ADC_BITS) - 1
+
+COMMAND_BINARY = b'b'   # switches the firmware to binary frames
+COMMAND_ASCII = b'a'    # switches the firmware back to ASCII lines
+
+STEPS_PER_REVOLUTION = 2048     # 28BYJ-48 with its gearbox
+DEGREES_PER_STEP = 360 / STEPS_PER_REVOLUTION
+
+SAMPLE = np.dtype([('sequence', 'u1'), ('step', '<i2'), ('adc', '<u2')])
+
+
+def frame_dtype(channels=1):
+    """ Frame of the given number of channels, FRAME for one """
+
+    if channels == 1:
+        return FRAME
+    return np.dtype(FRAME.descr[:3] + [(name, '<u2') for name in channel_names(channels)[1:]] +
+                    FRAME.descr[3:])
+
+
+def sample_dtype(channels=1):
+    """ Decoded frame of the given number of channels, SAMPLE for one """
+
+    return np.dtype(SAMPLE.descr + [(name, '<u2') for name in channel_names(channels)[1:]])
+
+
+def encode_frame(sequence, step, adc):
+    """ It packs one sample into a frame exactly like the firmware does """
+
+    sequence_adc = ((sequence % SEQUENCE_MODULO) << ADC_BITS) | (adc & ADC_MASK)
+    body = struct.pack('<Hh', sequence_adc, step)
+    checksum = body[0] ^ body[1] ^ body[2] ^ body[3]
+    return struct.pack(FRAME_FORMAT, SYNC_BYTE, sequence_adc, step, checksum)
+
+
+def encode_frames(sequence, step, adc):
+    """ Vectorized encode_frame() for arrays of samples. adc of shape
+    (samples, channels) gives frames of several channels. It returns bytes """
+
+    adc = np.asarray(adc)
+    channels = adc.shape[1] if adc.ndim > 1 else 1
+    adc = adc.reshape(len(adc), channels)
+    dtype = frame_dtype(channels)
+    frames = np.empty(len(adc), dtype=dtype)
+    frames['sync'] = SYNC_BYTE if channels == 1 else MULTI_SYNC_BYTE
+    frames['sequence_adc'] = ((np.asarray(sequence) % SEQUENCE_MODULO) << ADC_BITS) | \
+                             (adc[:, 0] & ADC_MASK)
+    frames['step'] = step
+    for channel, name in enumerate(channel_names(channels)[1:], 1):
+        frames[name] = adc[:, channel] & ADC_MASK
+    raw = frames.view(np.uint8).reshape(-1, dtype.itemsize)
+    frames['checksum'] = np.bitwise_xor.reduce(raw[:, 1:-1], axis=1)
+    return frames.tobytes()
+
+
+class FrameDecoder:
+    """ It decodes a stream of binary frames in bulk. A clean stream is decoded
+    with one vectorized pass per call. After a corrupted frame the decoder
+    drops bytes up to the next sync byte and continues. Frames of several
+    channels are demultiplexed by the view of the frame dtype, the channels
+    are fields of the samples ('adc', 'adc1' ...) """
+
+    def __init__(self, channels=1):
+
+        self.channels = channels
+        self.frame = frame_dtype(channels)
+        self.sample = sample_dtype(channels)
+        self.length = self.frame.itemsize
+        self.sync = SYNC_BYTE if channels == 1 else MULTI_SYNC_BYTE
+        self.carry = bytearray()
+        self.frames = 0         # number of decoded frames
+        self.bad_frames = 0     # frames with a wrong checksum
+        self.skipped_bytes = 0  # bytes dropped while looking for a sync byte
+        self.lost = 0           # frames missing according to the sequence counter
+        self.gaps = 0           # breaks of the sequence, each one loses one or more frames
+        self.duplicates = 0     # frames received twice, they are dropped
+        self.sequence = None    # sequence of the last decoded frame
+
+    def feed(self, data):
+        """ It returns the samples of every complete frame received so far """
+
+        self.carry += data
+        parts = []
+
+        length = self.length
+        while len(self.carry) >= length:
+            if self.carry[0] != self.sync:
+                skip = self.carry.find(self.sync)
+                if skip < 0:
+                    skip = len(self.carry)
+                del self.carry[:skip]
+                self.skipped_bytes += skip
+                continue
+
+            count = len(self.carry) // length
+            with memoryview(self.carry) as view:
+                raw = np.frombuffer(view, dtype=np.uint8, count=count * length)
+                raw = raw.reshape(count, length)
+                valid = (raw[:, 0] == self.sync) & \
+                        (np.bitwise_xor.reduce(raw[:, 1:-1], axis=1) == raw[:, -1])
+                good = count if valid.all() else int(np.argmin(valid))
+                if good > 0:
+                    parts.append(raw[:good].copy().view(self.frame).ravel())
+                del raw
+            del self.carry[:good * length]
+
+            if good < count:
+                # The frame at the start of the buffer is corrupted
+                if self.carry[0] == self.sync:
+                    self.bad_frames += 1
+                del self.carry[:1]
+                self.skipped_bytes += 1
+
+        if not parts:
+            return np.empty(0, dtype=self.sample)
+        frames = np.concatenate(parts)
+
+        samples = np.empty(len(frames), dtype=self.sample)
+        samples['sequence'] = frames['sequence_adc'] >> ADC_BITS
+        samples['adc'] = frames['sequence_adc'] & ADC_MASK
+        samples['step'] = frames['step']
+        for name in channel_names(self.channels)[1:]:
+            samples[name] = frames[name] & ADC_MASK
+        samples = self._check_sequence(samples)
+        self.frames += len(samples)
+        return samples
+
+    def _check_sequence(self, samples):
+        """ It counts gaps and lost frames and drops repeated frames. A repeated
+        sequence number is taken as a duplicate, so a gap of exactly
+        SEQUENCE_MODULO frames is not detected """
+
+        sequence = samples['sequence'].astype(np.int64)
+        if len(sequence) == 0:
+            return samples
+        previous = self.sequence if self.sequence is not None else sequence[0] - 1
+        step = np.diff(sequence, prepend=previous) % SEQUENCE_MODULO
+        duplicate = step == 0
+        missing = step[~duplicate] - 1
+        self.lost += int(missing.sum())
+        self.gaps += int(np.count_nonzero(missing))
+        self.sequence = int(sequence[-1])
+        if duplicate.any():
+            self.duplicates += int(np.count_nonzero(duplicate))
+            samples = samples[~duplicate]
+        return samples
+
+
+class FrameReader:
+    """ The same as Serial_Reader.ChunkReader, but for binary frames. read()
+    returns a structured array with sequence, step and adc fields, and
+    adc1, adc2 ... for frames of several channels """
+
+    def __init__(self, ser, channels=1):
+
+        self.ser = ser
+        self.decoder = FrameDecoder(channels)
+
+    @property
+    def received(self):
+        return self.decoder.frames
+
+    @property
+    def malformed(self):
+        return self.decoder.bad_frames
+
+    @property
+    def lost(self):
+        return self.decoder.lost
+
+    @property
+    def gaps(self):
+        return self.decoder.gaps
+
+    @property
+    def duplicates(self):
+        return self.decoder.duplicates
+
+    @property
+    def skipped_bytes(self):
+        return self.decoder.skipped_bytes
+
+    def read(self):
+        """ It returns the samples received since the previous call. It waits up
+        to the timeout of the port when nothing is waiting """
+
+        start = time.perf_counter()
+        data = self.ser.read(max(self.ser.in_waiting, 1))
+        parsed = time.perf_counter()
+        READ_TIME.observe(parsed - start)
+        if not data:
+            return np.empty(0, dtype=self.decoder.sample)
+        READ_BYTES.inc(len(data))
+
+        bad_frames = self.decoder.bad_frames
+        samples = self.decoder.feed(data)
+        PARSED.inc(len(samples))
+        if self.decoder.bad_frames != bad_frames:
+            PARSE_FAILURES.inc(self.decoder.bad_frames - bad_frames)
+        PARSE_TIME.observe(time.perf_counter() - parsed)
+        return samples
@@ -0,0 +1,160 @@
+""" Calibration of the detector: ADC counts to volts, dBm or dB relative to the peak.
+
+A profile describes the detector and the reference voltage of the ADC. The
+output of the detector is either given as points of its transfer curve
+(volts, dBm), which are interpolated linearly, or it follows a power law:
+
+    dBm = intercept + slope * log10(volts)
+
+slope 10 is a square-law diode (output proportional to power), slope 20 a
+linear (envelope) detector. Profiles are JSON files in a directory, e.g.
+
+    {"name": "AD8307", "reference": 5.0, "curve": [[0.25, -74], [2.5, 16]]}
+
+Every profile is compiled once into a LookupTable with one entry per ADC
+count, so a chunk of counts is converted by one indexing step. The counts
+are kept, a chunk can be converted again with another table at any time.
+"""
+
+import json
+import os
+
+import numpy as np
+
+
+ADC_LEVELS = 1024           # 10-bit ADC of the Uno
+MAX_ADC_DATA = ADC_LEVELS - 1
+MAX_VOLTAGE = 5
+UNITS = ('V', 'dBm', 'dB')  # dB is relative to the peak of the sweep
+UNIT_LABELS = {'V': 'Voltage, V', 'dBm': 'Power, dBm', 'dB': 'Normalized power, dB'}
+CALIBRATION_DIRECTORY = 'calibrations'
+PROFILE_EXTENSION = '.json'
+FLOOR_VOLTAGE = MAX_VOLTAGE / ADC_LEVELS / 2    # count 0 of a power law is half a count, not -inf
+DYNAMIC_RANGE = 40.0        # dB below the peak on the plot of normalized power
+
+
+class CalibrationProfile:
+    """ Transfer curve of a detector and reference voltage of the ADC """
+
+    def __init__(self, name, reference=MAX_VOLTAGE, curve=None, slope=10.0, intercept=0.0):
+
+        self.name = name
+        self.reference = float(reference)
+        self.curve = None if curve is None else [(float(volts), float(dbm)) for volts, dbm in curve]
+        self.slope = float(slope)
+        self.intercept = float(intercept)
+
+    def key(self):
+        """ Everything which the lookup table depends on """
+
+        return (self.reference, None if self.curve is None else tuple(self.curve), self.slope, self.intercept)
+
+    @classmethod
+    def from_file(cls, path):
+
+        with open(path) as file:
+            settings = json.load(file)
+        settings.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+        return cls(**settings)
+
+    def compile(self):
+        """ Lookup table of the profile, see lookup_table() for the cached one """
+
+        volts = np.arange(ADC_LEVELS) * (self.reference / MAX_ADC_DATA)
+        if self.curve is not None:
+            points = np.array(sorted(self.curve))
+            dbm = np.interp(volts, points[:, 0], points[:, 1])
+        else:
+            dbm = self.intercept + self.slope * np.log10(np.maximum(volts, FLOOR_VOLTAGE))
+        return LookupTable(self.name, volts, dbm)
+
+
+DEFAULT_PROFILE = CalibrationProfile('default')    # 0...5 V, square law with 0 dBm at 1 V
+
+
+class LookupTable:
+    """ Volts and dBm of every ADC count. Counts out of range are clipped """
+
+    def __init__(self, name, volts, dbm):
+
+        self.name = name
+        self.volts = np.asarray(volts, dtype=np.float64)
+        self.dbm = np.asarray(dbm, dtype=np.float64)
+        self.volts.flags.writeable = False  # tables are shared by all users of a profile
+        self.dbm.flags.writeable = False
+
+    def table(self, unit='V', peak=None):
+        """ Values of every count in the unit. dB are relative to `peak` dBm,
+        by default to the highest level of the detector """
+
+        if unit == 'V':
+            return self.volts
+        if unit == 'dBm':
+            return self.dbm
+        if unit == 'dB':
+            return self.dbm - (self.dbm.max() if peak is None else peak)
+        raise ValueError("Unknown unit %r, it must be one of %s" % (unit, ', '.join(UNITS)))
+
+    def convert(self, adc, unit='V', peak=None):
+        """ Values of ADC counts (scalar or array) in the unit """
+
+        return self.table(unit, peak).take(adc, mode='clip')
+
+    def from_volts(self, volts, unit='V', peak=None):
+        """ Values of voltages of this table (e.g. means of sweeps) in the unit.
+        Counts are interpolated, so fractions of a count are kept """
+
+        return np.interp(volts, self.volts, self.table(unit, peak))
+
+    def to_volts(self, dbm):
+        """ Voltages of levels in dBm (e.g. limits of a mask), the inverse of
+        the table. Levels out of the range of the detector are clipped """
+
+        if self.dbm[-1] < self.dbm[0]:
+            return np.interp(dbm, self.dbm[::-1], self.volts[::-1])    # detector with a negative slope
+        return np.interp(dbm, self.dbm, self.volts)
+
+    def limits(self, unit='V'):
+        """ Range of the axis of the unit """
+
+        if unit == 'V':
+            return 0.0, self.volts[-1] * 1.1
+        if unit == 'dB':
+            return -DYNAMIC_RANGE, 1.0
+        low, high = self.dbm.min(), self.dbm.max()
+        margin = max((high - low) * 0.05, 1.0)
+        return low - margin, high + margin
+
+
+_tables = {}    # compiled lookup tables by profile key
+
+
+def lookup_table(profile=DEFAULT_PROFILE):
+    """ Compiled lookup table of a profile, every profile is compiled once """
+
+    key = profile.key()
+    if key not in _tables:
+        _tables[key] = profile.compile()
+    table = _tables[key]
+    if table.name != profile.name:
+        table = LookupTable(profile.name, table.volts, table.dbm)
+    return table
+
+
+def load_profiles(directory=CALIBRATION_DIRECTORY):
+    """ Profiles of a directory by name, DEFAULT_PROFILE included. Files which
+    cannot be read are reported and skipped """
+
+    profiles = {DEFAULT_PROFILE.name: DEFAULT_PROFILE}
+    if not os.path.isdir(directory):
+        return profiles
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(PROFILE_EXTENSION):
+            continue
+        try:
+            profile = CalibrationProfile.from_file(os.path.join(directory, name))
+        except (OSError, ValueError, TypeError) as error:
+            print('Calibration profile %s is skipped: %s' % (name, error))
+            continue
+        profiles[profile.name] = profile
+    return profiles
@@ -0,0 +1,200 @@
+import numpy as np
+
+from Sample_Buffer import SampleBuffer
+from Session_File import SessionWriter, open_session, RECORD
+
+
+BLOCK = 16          # samples of a block of the finest level
+FACTOR = 4          # blocks of a level which make one block of the next level
+LEVELS = 10         # a block of the coarsest level holds BLOCK * FACTOR ** 9 (about 4 million) samples
+RECENT_CAPACITY = 1 << 16
+
+
+class _Level:
+    """ Growing arrays of start time, minimum and maximum of the blocks of one
+    level. The writer fills the arrays beyond `count` and increases `count`
+    afterwards. Full arrays are replaced by bigger copies, the old ones stay
+    valid up to the old count, so a reader must take `count` before `arrays` """
+
+    def __init__(self, size=1024):
+
+        self.arrays = (np.empty(size), np.empty(size, dtype=np.float32), np.empty(size, dtype=np.float32))
+        self.count = 0
+
+    def extend(self, time, low, high):
+
+        count = self.count
+        end = count + len(time)
+        if end > len(self.arrays[0]):
+            size = max(2 * len(self.arrays[0]), end)
+            arrays = tuple(np.empty(size, dtype=array.dtype) for array in self.arrays)
+            for new, old in zip(arrays, self.arrays):
+                new[:count] = old[:count]
+            self.arrays = arrays
+        for array, data in zip(self.arrays, (time, low, high)):
+            array[count:end] = data
+        self.count = end
+
+
+class MinMaxPyramid:
+    """ Minimum and maximum of a growing series of samples at several
+    resolutions. A block of level k covers BLOCK * FACTOR ** k samples, so
+    any time range can be drawn with about the same number of points by the
+    level whose blocks are just fine enough. There is one writer (add) and
+    any number of readers (fetch) on other threads """
+
+    def __init__(self, block=BLOCK, factor=FACTOR, levels=LEVELS):
+
+        self.block = block
+        self.factor = factor
+        self.levels = [_Level() for _ in range(levels)]
+        self.pending = (np.empty(0), np.empty(0, dtype=np.float32))  # samples of the unfinished block
+        self.count = 0      # number of samples
+
+    def size(self, level):
+        """ Number of samples of a block of the level """
+
+        return self.block * self.factor ** level
+
+    def add(self, time, value):
+        """ It adds a chunk of samples, times must not decrease """
+
+        number = len(time)
+        time = np.concatenate((self.pending[0], time))
+        value = np.concatenate((self.pending[1], np.asarray(value, dtype=np.float32)))
+        full = len(time) // self.block * self.block
+        if full > 0:
+            blocks = value[:full].reshape(-1, self.block)
+            self.levels[0].extend(time[:full:self.block], blocks.min(axis=1), blocks.max(axis=1))
+        self.pending = (time[full:], value[full:])
+
+        # every level takes the groups of the level below which are complete now
+        for lower, upper in zip(self.levels, self.levels[1:]):
+            first = upper.count * self.factor
+            last = lower.count // self.factor * self.factor
+            if last <= first:
+                break
+            times, low, high = lower.arrays
+            upper.extend(times[first:last:self.factor],
+                         low[first:last].reshape(-1, self.factor).min(axis=1),
+                         high[first:last].reshape(-1, self.factor).max(axis=1))
+
+        self.count += number
+
+    def fetch(self, start, end, points, raw):
+        """ It returns times and values which show the samples between times
+        `start` and `end` with about `points` points at most: two points (min
+        and max) per block of the coarsest sufficient level, or the raw samples
+        if there are few enough of them. The newest samples which are not in
+        a complete block of that level yet are taken from finer levels and,
+        finally, from raw(first, last), which returns times and values of
+        samples first ... last - 1 """
+
+        count = self.count
+        counts = [level.count for level in self.levels]
+        arrays = [level.arrays for level in self.levels]
+
+        # number of samples in the range, from the blocks of the finest level
+        times = arrays[0][0][:counts[0]]
+        first_block = max(np.searchsorted(times, start, side='right') - 1, 0)
+        last_block = np.searchsorted(times, end, side='right')
+        number = (last_block - first_block) * self.block
+
+        top = -1    # raw samples
+        if number > points:
+            top = len(self.levels) - 1
+            for level in range(len(self.levels)):
+                if number / self.size(level) * 2 <= points:
+                    top = level
+                    break
+
+        pieces_time = []
+        pieces_value = []
+        covered = 0     # samples covered by the coarser levels
+        for level in range(top, -1, -1):
+            times, low, high = arrays[level]
+            first = covered // self.size(level)
+            times = times[first:counts[level]]
+            i = max(np.searchsorted(times, start, side='right') - 1, 0)
+            j = np.searchsorted(times, end, side='right')
+            pieces_time.append(np.repeat(times[i:j], 2))
+            pieces_value.append(np.column_stack((low[first + i:first + j], high[first + i:first + j])).ravel())
+            covered = counts[level] * self.size(level)
+
+        if top < 0:
+            first_sample, last_sample = first_block * self.block, min((last_block + 1) * self.block, count)
+        else:
+            first_sample, last_sample = covered, count
+        if last_sample > first_sample:
+            times, values = raw(first_sample, last_sample)
+            i = max(np.searchsorted(times, start, side='right') - 1, 0)
+            j = min(np.searchsorted(times, end, side='right') + 1, len(times))
+            pieces_time.append(times[i:j])
+            pieces_value.append(values[i:j])
+
+        if not pieces_time:
+            return np.empty(0), np.empty(0, dtype=np.float32)
+        return np.concatenate(pieces_time), np.concatenate(pieces_value)
+
+
+class ContinuousCapture:
+    """ Capture without a limit of samples, e.g. a stability run of hours.
+    Every sample goes into a session file, the newest ones also into a ring
+    buffer and all of them into the min/max pyramid. The plot fetches only
+    what fits on the screen: blocks of the pyramid and, when it is zoomed in,
+    raw samples from the ring buffer or from the memory map of the file """
+
+    def __init__(self, path, metadata, capacity=RECENT_CAPACITY, dtype=RECORD):
+
+        self.path = path
+        self.session = SessionWriter(path, metadata, dtype)
+        self.recent = SampleBuffer(capacity, dtype=np.float64)
+        self.pyramid = MinMaxPyramid()
+        self.records = None     # memory map of the file, it is opened when needed
+
+    def __len__(self):
+        return self.recent.version
+
+    def append(self, timestamp, angle, adc, voltage, **columns):
+        """ It is called by the writer thread only. Other columns go to the file only """
+
+        self.session.append(timestamp=timestamp, angle=angle, adc=adc, voltage=voltage, **columns)
+        self.recent.append(voltage=voltage, angle=angle, timestamp=timestamp)
+        self.pyramid.add(timestamp, voltage)
+
+    def raw(self, first, last):
+        """ Times and voltages of samples first ... last - 1. Old samples are
+        read from the file, which is flushed once a second """
+
+        version, window = self.recent.snapshot()
+        oldest = version - len(window['timestamp'])
+        times = []
+        values = []
+        if first < oldest:
+            stop = min(last, oldest)
+            if self.records is None or len(self.records) < stop:
+                self.records = open_session(self.path)[1]
+            records = self.records[first:stop]
+            times.append(records['timestamp'])
+            values.append(records['voltage'])
+            first = stop
+        if last > first:
+            times.append(window['timestamp'][first - oldest:last - oldest])
+            values.append(window['voltage'][first - oldest:last - oldest])
+        return np.concatenate(times), np.concatenate(values)
+
+    def fetch(self, start, end, points):
+        """ Times and voltages of about `points` points at most which show the
+        samples between times `start` and `end` """
+
+        return self.pyramid.fetch(start, end, points, self.raw)
+
+    def end_time(self):
+        """ Timestamp of the newest sample or 0 """
+
+        version, window = self.recent.snapshot()
+        return float(window['timestamp'][-1]) if version > 0 else 0.0
+
+    def close(self, **metadata):
+
+        self.session.close(samples=len(self), **metadata)
@@ -1,139 +1,686 @@
 import tkinter
+import tkinter.filedialog
 import serial
+import os
 import threading
 import time
-from matplotlib.backends.backend_tkagg import (
-    FigureCanvasTkAgg, NavigationToolbar2Tk)
-from matplotlib.backend_bases import key_press_handler
-import matplotlib.pyplot as plt
-
+from concurrent.futures import Future
+import numpy as np
+import Metrics
+from Sample_Buffer import SampleBuffer
+from Serial_Reader import ChunkReader, channel_names, mask_channels, mask_pins, pins_mask
+from Binary_Protocol import FrameReader, COMMAND_BINARY, COMMAND_ASCII, DEGREES_PER_STEP
+from Virtual_Recorder import VirtualSerial, URL_SCHEME
+from Session_File import SessionWriter, new_session_path, record_dtype, EXTENSION
+from Pattern_Library import PatternLibrary, LIBRARY_NAME
+from Sweep_Statistics import SweepStatistics
+from Angle_Model import (RotationModel, sample_times, SPEED_MOTOR, STEPS, TIME,
+                         TRAVEL_DEGREES, GRID_STEP)
+from Pattern_Metrics import PatternMetrics
+from Sweep_Reader import read_sweep, session_sink, metrics_sink, channel_columns
+from Serial_Worker import (SerialWorker, COMMAND_LEFT, COMMAND_RIGHT, COMMAND_STOP, COMMAND_SPEED,
+                           COMMAND_CONTINUOUS, COMMAND_SWEEP, COMMAND_TIMER, COMMAND_STEPS, COMMAND_CHANNELS,
+                           READ_TIMEOUT, write_setting, samples_fit)
+from Continuous_Capture import ContinuousCapture
+from Pipeline_Stats import PipelineStats
+from Sampling_Profiler import SamplingProfiler
+from Acquisition_Manager import AcquisitionManager, subplot_grid, MAX_DEVICES
+from Port_Discovery import connect, AUTO_PORT, CACHE_NAME
+from Replay_Source import ReplaySerial, CaptureTee, REPLAY_SCHEME, CAPTURE_EXTENSION
+from Calibration import (lookup_table, load_profiles, DEFAULT_PROFILE, UNITS, UNIT_LABELS, CALIBRATION_DIRECTORY,
+                         DYNAMIC_RANGE)
+from Golden_Reference import GoldenCheck, QALog, load_reference, REFERENCE_EXTENSION, QA_LOG_NAME
 
    
 ser = serial.Serial()
-com_port = 'com3'
+worker = None       # the only thread which uses ser
+com_port = AUTO_PORT    # 'auto' looks for the recorder on all ports
 baud_rate = 115200
+baud_limit = None   # highest baud rate of the negotiation, None for any
+firmware_version = None # version of the firmware which answered the handshake
 steps = 30
 timer = 24383
-data_ADC = list()
-degree = list()
+speed = 5           # speed command sent before every rotation
+channel_mask = 1    # analog pins sampled on every tick, bit 0 is A0
+channels = 1        # pins of channel_mask, they are columns 'adc', 'adc1' ... of samples buffer
+plot_mode = 'overlay'   # channels as overlaid traces, or 'ratio' of the other channels to the first one in dB
+BUFFER_CAPACITY = 1 << 16
+MAX_BUFFER_CAPACITY = 1 << 20   # the buffer grows for slow fine sweeps up to this capacity
+SAMPLE_COLUMNS = ('voltage', 'value', 'adc', 'angle', 'timestamp', 'received') # of the first channel, see sampleColumns()
+samples = SampleBuffer(BUFFER_CAPACITY, SAMPLE_COLUMNS, np.float64) # samples of the current sweep, received is time.perf_counter() of their read
+calibration = lookup_table()    # lookup table of the detector profile, the GUI swaps it at any time
+display_unit = 'V'          # unit of the plot, one of UNITS, the value columns of samples hold storedUnit() of it
+profiles = {DEFAULT_PROFILE.name: DEFAULT_PROFILE}  # calibration profiles by name, main() loads them
+converted = (calibration, display_unit)    # lookup table and unit of the value column
+peak_level = None           # dBm of the highest sample of the sweep, dB are relative to it
+conversion = 0              # conversions of the value columns and new peaks in dB, the plot is redrawn after one
+pipeline = PipelineStats()  # losses and latency of the current run
+profile_sweeps = False      # the sampling profiler records every batch of sweeps
+capture_raw = False         # the raw serial stream of every batch goes into a capture file too
+DIAGNOSTICS_PERIOD = 500    # ms between refreshes of the diagnostics panel
+pattern = SampleBuffer(int(TRAVEL_DEGREES / GRID_STEP) + 1)  # current sweep on the uniform angle grid
+metrics = PatternMetrics()  # metrics of the current sweep
+max_samples = 185   # least limit of samples of a sweep, see adaptToSettings()
+SWEEP_MARGIN = 1.1  # max_samples is this much above the samples of one sweep
+malformed_records = 0
+binary_mode = False # binary frames with step index instead of ASCII lines
+lost_frames = 0
+session_directory = 'sessions'
+session_path = None # file of the last sweep
+library = None      # catalog of the sessions, it is opened by main()
+manager = None      # recorders of the devices window, it is created by main()
+antenna_id = ''
+frequency = 0.0     # MHz
+FREQUENCY_TOLERANCE = 0.5   # MHz, for the search in the library
+LIBRARY_ROWS = 1000 # the longest list of the library window
+sweep_count = 1     # sweeps of a batch, the motor is reversed after every one
+sweep_number = 0    # finished sweeps of the current batch
+statistics = None   # statistics of all sweeps of the current batch
+BIN_WIDTH = 1.0     # degrees
+capture = None      # continuous capture of the last run, see treadContinuousCapture()
+CONTINUOUS_WINDOW = 60.0    # s on the screen while the plot follows the capture
+CONTINUOUS_PERIOD = 100     # ms between refreshes of the continuous plot
+golden = None       # golden reference of the QA mode, None without QA
+golden_check = None # pass/fail check of the unit of the current sweep
+qa_log = None       # results of the units, it is opened with the first reference
+stop_failed = True  # QA stops the motor as soon as a unit fails
 thread_flag = False
 motorState = {"INACTIVE": 0, "ACTIVE_R": 1, "ACTIVE_L": 2}
 currentMotorState = motorState["INACTIVE"]
 stop = False
 
+# gauges are read from the state of the recorder when the metrics are shown or saved
+Metrics.gauge('sweep_samples', 'Samples of the current sweep', lambda: len(samples))
+Metrics.gauge('sweep_number', 'Finished sweeps of the current batch', lambda: sweep_number)
+Metrics.gauge('qa_units_per_hour', 'Units checked per hour in QA mode', lambda: qa_log.units_per_hour())
+Metrics.gauge('pipeline_lost_frames', 'Frames lost in the current run', lambda: pipeline.counters()['lost'])
+Metrics.gauge('pipeline_duplicate_frames', 'Repeated frames of the current run',
+              lambda: pipeline.counters()['duplicates'])
+Metrics.gauge('pipeline_overruns', 'Samples overwritten before they were drawn', lambda: pipeline.overruns)
+
 
-def serial_port_init():
+def serial_port_init(connection=None):
     """
-    Initialization of serial port
+    Initialization of serial port. Port names like 'virtual://?rate=2000&baud=1000000'
+    select the software model of the recorder instead of a real port, names like
+    'replay://sessions/capture.raw?speed=4' play back a recording. A connection
+    of Port_Discovery brings its port open at the negotiated baud rate
     """
 
-    ser.port = com_port
-    ser.baudrate = baud_rate
-    ser.timeout = 0.8
+    global ser
+    global worker
+    global com_port
+    global baud_rate
+    global firmware_version
+
+    if worker is not None:
+        worker.close()
+
+    if connection is not None:
+        ser = connection.ser
+        com_port = connection.port
+        baud_rate = connection.baud_rate
+        firmware_version = connection.version
+    elif com_port.startswith(URL_SCHEME):
+        ser = VirtualSerial.from_url(com_port)
+    elif com_port.startswith(REPLAY_SCHEME):
+        ser = ReplaySerial.from_url(com_port)
+    elif isinstance(ser, (VirtualSerial, ReplaySerial)):
+        ser = serial.Serial()
+
+    if connection is None:
+        # 'auto' or a list of ports without an answer keeps the last port, None before the first one
+        if com_port != AUTO_PORT and ',' not in com_port:
+            ser.port = com_port
+        ser.baudrate = int(baud_rate)
+        firmware_version = None
+    ser.timeout = READ_TIMEOUT
     ser.write_timeout=0.1
 
+    worker = SerialWorker(ser)
+    worker.start()
+    if connection is not None:
+        # the board was reset when the port was opened, motorSetup() waits for the speed
+        worker.submit(COMMAND_SPEED[speed])
+        commandFrameFormat()
+        if int(timer) != TIME:
+            commandSetting(COMMAND_TIMER, int(timer))
+        if int(steps) != STEPS:
+            commandSetting(COMMAND_STEPS, int(steps))
+        if channel_mask != 1:
+            commandSetting(COMMAND_CHANNELS, channel_mask)
+
     print('Baud Rate =',baud_rate)
-    print('Com Port =',com_port)
+    print('Com Port =',ser.port or 'not connected')
+
+
+def connectRecorder():
+    """ It closes the port and looks for the recorder on com_port ('auto' for
+    all ports) on a new thread, so the window is not blocked while the boards
+    boot. It returns a Future of the Connection, which is None if no board
+    answered the handshake. Commands until serial_port_init() are dropped """
+
+    if worker is not None:
+        worker.close()  # discovery opens the port again
+
+    future = Future()
+    if com_port.startswith(REPLAY_SCHEME):
+        future.set_result(None)     # a recording does not answer the handshake
+        return future
 
+    def run():
+        try:
+            ports = [port.strip() for port in com_port.split(',') if port.strip()] or [AUTO_PORT]
+            future.set_result(connect(ports, os.path.join(session_directory, CACHE_NAME), baud_limit))
+        except Exception as error:
+            future.set_exception(error)
+
+    threading.Thread(target=run, name='PortDiscovery', daemon=True).start()
+    return future
 
+
+@Metrics.timed('convert_seconds', 'Conversion of ADC data of one read to voltage')
 def convertToVoltage(data):
-    """ Convertation ADC data to voltage """
-    
-    MAX_ADC_DATA = 1023
-    MAX_VOLTAGE = 5
+    """ Convertation ADC data to voltage with the lookup table of the calibration """
 
-    convertData = float((data / MAX_ADC_DATA) * MAX_VOLTAGE )
-    
-    return convertData
-    
+    return calibration.convert(data) # works for scalars and arrays
 
-def threadRightRotation():
-    """ It is called by thread. Starting of the step motor rotation to the
-    right. It writes '1' to the com port """
 
-    global currentMotorState
-    global motorState
-    cmd = b'1'
-    
-    if ser.isOpen() is False:
-        ser.open()
+def sampleColumns(count):
+    """ Columns of samples buffer for `count` channels: SAMPLE_COLUMNS and the
+    ADC data and values of the other channels with their ratio to the first one """
 
-    ser.readline()
-    ser.write(cmd)
-    currentMotorState = motorState["ACTIVE_R"]
+    return (SAMPLE_COLUMNS + channel_names(count)[1:] + channel_names(count, 'value')[1:] +
+            channel_names(count, 'ratio')[1:])
 
 
-def threadStop():
-    """ It is called by thread. Stop of the step motor. It writes '0' to the
-    com port """
+def storedUnit(unit):
+    """ Unit of the value columns of samples buffer for a unit of the plot. dB
+    are stored as dBm, plotTraces() subtracts peak_level """
 
-    global currentMotorState
-    global motorState
-    cmd = b'0'
+    return 'dBm' if unit == 'dB' else unit
 
-    if ser.isOpen() is False:
-        ser.open()
 
-    ser.readline()
-    ser.write(cmd)
-    currentMotorState = motorState["INACTIVE"]   
-    
+def convertToDisplay(adc):
+    """ Convertation ADC data of every channel to display_unit and of the other
+    channels to their ratio to the first one in dB. It returns the columns
+    'value', 'value1' ... and 'ratio1' ... of the chunk. dB are relative to the
+    highest sample of the first channel in the sweep, a new peak only changes
+    peak_level and the sweep is drawn again. It is called by the writer of
+    samples buffer only """
+
+    global peak_level
+    global conversion
+
+    if converted != (calibration, display_unit):
+        recalibrate()
+    table, unit = converted
+    names = channel_names(len(adc))
+    targets = channel_names(len(adc), 'value')
+    level = table.convert(adc['adc'], 'dBm') if unit == 'dB' or len(adc) > 1 else None
+    if unit == 'dB' and len(level) > 0 and (peak_level is None or level.max() > peak_level):
+        peak_level = level.max()
+        conversion += 1
+    values = {target: table.convert(adc[name], storedUnit(unit)) for target, name in zip(targets, names)}
+    for target, name in zip(channel_names(len(adc), 'ratio')[1:], names[1:]):
+        values[target] = table.convert(adc[name], 'dBm') - level
+    return values
+
+
+def recalibrate():
+    """ It converts the value column of samples buffer again from the ADC data
+    with the current calibration and display_unit. It runs on the serial worker,
+    the writer of the buffer, as a job or from convertToDisplay() """
+
+    global converted
+    global peak_level
+    global conversion
+
+    table, unit = converted = (calibration, display_unit)
+    peak_level = None
+    version, sweep = samples.snapshot()
+    if unit == 'dB' and len(sweep['adc']) > 0:
+        peak_level = table.convert(sweep['adc'].astype(np.intp), 'dBm').max()
+    names = channel_names(channels)
+    for target, name in zip(channel_names(channels, 'value'), names):
+        samples.remap(target, name, table.table(storedUnit(unit)))
+    for target, name in zip(channel_names(channels, 'ratio')[1:], names[1:]):
+        samples.remap(target, name, table.dbm, 'adc')
+    conversion += 1
+
+
+def setCalibration(table, unit):
+    """ It swaps the lookup table and the unit of the plot, also during a sweep.
+    Raw ADC data are kept, so nothing is read again. It returns the future of
+    the conversion of the current sweep """
+
+    global calibration
+    global display_unit
+
+    calibration = table
+    display_unit = unit
+    return worker.submit(recalibrate)
+
+
+def displayVolts(volts):
+    """ Voltages of the calibration (means of sweeps, sweeps of the library) in
+    display_unit, dB are relative to their own peak """
+
+    if display_unit == 'dB':
+        level = calibration.from_volts(volts, 'dBm')
+        return level - np.nanmax(level) if len(level) > 0 else level
+    return calibration.from_volts(volts, display_unit)
+
+
+def displayLevel(dbm):
+    """ Levels in dBm (the golden reference and its mask) in display_unit, dB
+    are relative to the peak of the reference """
+
+    if display_unit == 'dBm':
+        return dbm
+    if display_unit == 'dB':
+        return dbm - golden.level.max()
+    return calibration.to_volts(dbm)
+
+
+def qaFailed():
+    """ True when the unit of the current sweep failed and QA stops it """
+
+    return golden_check is not None and stop_failed is True and golden_check.failed
+
+
+def qaText():
+    """ Verdict of the current unit and throughput of the QA mode for the label
+    next to the plot """
+
+    if golden is None:
+        return 'QA: off'
+    text = 'QA: -'
+    if golden_check is not None:
+        result = golden_check.result()
+        text = 'QA: %s' % result['result']
+        if result['offset'] is not None:
+            text += '  offset %.0f\u00b0' % result['offset']
+        if result['result'] == 'FAIL':
+            text += '  at %.0f\u00b0' % result['worst_angle']
+    return text + '  ' + qa_log.text()
+
+
+def plotTraces(sweep):
+    """ Columns of a sweep which are drawn: the value of every channel, or the
+    ratio of every other channel to the first one. dB are the stored dBm
+    relative to peak_level """
+
+    if plot_mode == 'ratio' and channels > 1:
+        return [sweep[name] for name in channel_names(channels, 'ratio')[1:]]
+    traces = [sweep[name] for name in channel_names(channels, 'value')]
+    peak = peak_level
+    if converted[1] == 'dB' and peak is not None:
+        return [trace - peak for trace in traces]
+    return traces
+
+
+def plotLabels():
+    """ Legend entries of the traces of plotTraces(), none for one channel """
+
+    pins = mask_pins(channel_mask)
+    if channels == 1:
+        return ()
+    if plot_mode == 'ratio':
+        return tuple('A%d/A%d' % (pin, pins[0]) for pin in pins[1:])
+    return tuple('A%d' % pin for pin in pins)
+
+
+def plotAxis():
+    """ Label and limits of the y axis of plotTraces() """
+
+    if plot_mode == 'ratio' and channels > 1:
+        return 'Ratio to A%d, dB' % mask_pins(channel_mask)[0], (-DYNAMIC_RANGE, DYNAMIC_RANGE)
+    return UNIT_LABELS[display_unit], calibration.limits(display_unit)
+
+
+def storedAxis():
+    """ Label and limits of the y axis of the continuous capture and of the
+    devices. They show storedUnit() of display_unit, their samples have no
+    peak for dB """
+
+    unit = storedUnit(display_unit)
+    return UNIT_LABELS[unit], calibration.limits(unit)
+
+
+def motorCommand(cmd, state):
+    """ It queues a command of the motor for the serial worker and returns the
+    future of the write. currentMotorState is changed when cmd is written """
+
+    def written(future):
+        global currentMotorState
+        if future.exception() is None:
+            currentMotorState = state
 
-def threadLeftRotation():
-    """ It is called by thread. Starting of the step motor rotation to the
-    left. It writes '2' to the com port """
+    future = worker.submit(cmd)
+    future.add_done_callback(written)
+    return future
+
+
+def commandRightRotation():
+    """ Starting of the step motor rotation to the right. It writes the speed
+    and '9' to the com port """
+
+    return motorCommand(COMMAND_SPEED[speed] + COMMAND_RIGHT, motorState["ACTIVE_R"])
+
+
+def commandStop():
+    """ Stop of the step motor. It writes '8' to the com port """
+
+    return motorCommand(COMMAND_STOP, motorState["INACTIVE"])
+
+
+def commandLeftRotation():
+    """ Starting of the step motor rotation to the left. It writes the speed
+    and '7' to the com port """
+
+    return motorCommand(COMMAND_SPEED[speed] + COMMAND_LEFT, motorState["ACTIVE_L"])
+
+
+def commandFrameFormat():
+    """ It switches the firmware to binary frames or back to ASCII lines according
+    to binary_mode. It writes 'b' or 'a' to the com port """
+
+    return worker.submit(COMMAND_BINARY if binary_mode is True else COMMAND_ASCII)
+
+
+def commandSetting(command, value):
+    """ It queues a setting of the firmware, COMMAND_TIMER with the period of
+    Timer1 in us, COMMAND_STEPS with the steps per revolution or COMMAND_CHANNELS
+    with the mask of the analog pins. It returns the future of the value which
+    the firmware confirms, or of None """
+
+    return worker.submit(lambda: write_setting(ser, command, value))
+
+
+def sweepSamples():
+    """ Number of samples of a sweep from limit switch to limit switch with the
+    current speed, steps and Timer1 period """
+
+    model = RotationModel(SPEED_MOTOR[max(speed, 1)], int(steps))
+    return int(model.duration() / (int(timer) * 1e-6)) + 1
+
+
+def adaptToSettings(command, value):
+    """ It takes a setting confirmed by the firmware and adapts the host to
+    it: the least limit of samples of a sweep, the capacity of the sample
+    buffer and its columns of the channels. It must not be called during a sweep """
+
+    global steps
+    global timer
+    global channel_mask
+    global channels
+    global max_samples
+
+    if command == COMMAND_STEPS:
+        steps = value
+    elif command == COMMAND_CHANNELS:
+        channel_mask = value
+        channels = mask_channels(value)
+    else:
+        timer = value
+    max_samples = int(sweepSamples() * SWEEP_MARGIN)
+    capacity = BUFFER_CAPACITY
+    while capacity < max_samples and capacity < MAX_BUFFER_CAPACITY:
+        capacity *= 2
+    columns = sampleColumns(channels)
+    if capacity != samples.capacity or tuple(samples.columns) != columns:
+        samples.resize(capacity, columns)
+    print('Steps =', steps, ' Time =', timer, ' Channels =', channels, ' Samples of a sweep =', max_samples)
+
+
+def settingText(command):
+    """ Current value of a setting for its entry """
+
+    if command == COMMAND_STEPS:
+        return steps
+    if command == COMMAND_CHANNELS:
+        return ','.join(str(pin) for pin in mask_pins(channel_mask))
+    return timer
+
+
+def metricsText(result):
+    """ Metrics of a sweep for the label next to the plot """
+
+    def number(value, form):
+        return '-' if value is None else form % value
+
+    if result['peak'] is None:
+        return 'Peak: -'
+    return 'Peak: %.2f V at %.1f\u00b0  HPBW: %s  SLL: %s  F/B: %s' % (
+        result['peak'], result['peak_angle'], number(result['beamwidth'], '%.1f\u00b0'),
+        number(result['sidelobe_level'], '%.1f dB'), number(result['front_to_back'], '%.1f dB'))
+
+
+def sessionMetadata():
+    """ Settings of the recorder which are stored with every session """
+
+    return {
+        'port': com_port,
+        'baud_rate': int(baud_rate),
+        'steps': int(steps),
+        'timer': int(timer),
+        'speed': speed,
+        'binary_mode': binary_mode,
+        'channel_mask': channel_mask,
+        'channels': channels,
+        'max_samples': max_samples,
+        'antenna_id': antenna_id,
+        'frequency': frequency,
+        'calibration': calibration.name,
+    }
+
+
+def reverseRotation():
+    """ It reverses the motor between sweeps of a batch. It is called on the
+    serial worker thread, so it writes to the port directly """
 
     global currentMotorState
-    global motorState
-    cmd = b'2'
-    
-    if ser.isOpen() is False:
-        ser.open()
 
-    ser.readline()
-    ser.write(cmd)
-    currentMotorState = motorState["ACTIVE_L"]
+    if currentMotorState == motorState["ACTIVE_R"]:
+        ser.write(COMMAND_SPEED[speed] + COMMAND_LEFT)
+        currentMotorState = motorState["ACTIVE_L"]
+    else:
+        ser.write(COMMAND_SPEED[speed] + COMMAND_RIGHT)
+        currentMotorState = motorState["ACTIVE_R"]
+
 
 def treadDataProcessing():
-    """ It is called by thread. It reads data from com port and writes them into data_ADC buffer"""
-        
-    global data_ADC
-    global degree
-    global stop
+    """ It is called by the serial worker as a job. It reads sweep_count sweeps
+    and reverses the motor after every one but the last. Queued commands are
+    written between reads """
+
     global thread_flag
+    global statistics
+    global sweep_number
+
+    statistics = SweepStatistics(0, TRAVEL_DEGREES + BIN_WIDTH, BIN_WIDTH)
+    sweep_number = 0
+    # binary frames: angle of the limit switch where the batch starts
+    start_angle = TRAVEL_DEGREES if currentMotorState == motorState["ACTIVE_L"] else 0.0
+    origin = None
+    port = ser
+    if capture_raw is True:
+        path = os.path.splitext(new_session_path(session_directory, 'capture'))[0] + CAPTURE_EXTENSION
+        port = CaptureTee(ser, path)
+    reader = FrameReader(port, channels) if binary_mode is True else ChunkReader(port, channels)
+    pipeline.reset(reader)
+    profiler = None
+    if profile_sweeps is True:
+        # this thread reads, the main thread plots
+        profiler = SamplingProfiler([threading.get_ident(), threading.main_thread().ident]).start()
+
+    try:
+        for sweep in range(sweep_count):
+            origin = readSweep(reader, sweep, start_angle, origin)
+            if stop is True or ser.isOpen() is False or qaFailed():
+                break
+            statistics.end_sweep()
+            if sweep + 1 < sweep_count:
+                samples.clear()
+                reverseRotation()
+            sweep_number += 1
+    finally:
+        thread_flag = False
+        if port is not ser:
+            port.close()
+            print('Raw capture:', port.path)
+        if profiler is not None:
+            profiler.stop()
+            path = os.path.join(session_directory, time.strftime('profile_%Y%m%d_%H%M%S.txt'))
+            profiler.save(path)
+            profiler.report()
+            print('Folded stacks:', path)
+
+
+def readSweep(reader, sweep, start_angle, origin):
+    """ It reads one sweep from com port with read_sweep(). Raw samples go into
+    samples buffer and into a new session file, the sweep resampled onto the
+    uniform angle grid goes into pattern buffer and into the statistics. It
+    is the only writer of the buffers.
+
+    In binary mode the angle is exact, it comes from the step index counted
+    from `origin`, the first step of the batch which starts at `start_angle`.
+    Every channel of channel_mask gets its own columns, the voltage, the
+    pattern and the metrics are those of the first one. In QA mode the
+    pattern is checked against the golden reference and a failed unit is
+    stopped at once. It returns the origin """
+
+    global session_path
+    global peak_level
+    global golden_check
+
+    direction = -1 if currentMotorState == motorState["ACTIVE_L"] else 1
+    model = RotationModel(SPEED_MOTOR[max(speed, 1)], int(steps), direction)
+    period = int(timer) * 1e-6
+    # max_samples is the least limit, slow sweeps need more samples
+    last_sample = max(max_samples, int(model.duration() / period) + 1)
+
+    start = time.perf_counter()
+    malformed = reader.malformed
+    pattern.clear()
+    metrics.reset()
+    golden_check = GoldenCheck(golden) if golden is not None else None
+    peak_level = None   # dB are relative to the peak of this sweep
+    session_path = new_session_path(session_directory)
+    metadata = sessionMetadata()
+    metadata.update(sweep=sweep, sweeps=sweep_count, direction=direction,
+                    angle_source='step index' if binary_mode is True else 'rotation model')
+    session = SessionWriter(session_path, metadata, record_dtype(channels))
+
+    def buffers(chunk):
+        global malformed_records
+        global lost_frames
+
+        samples.append(voltage=chunk.voltage, angle=chunk.angle, timestamp=chunk.timestamp,
+                       received=chunk.read_time, **chunk.adc, **convertToDisplay(chunk.adc))
+        pattern.append(angle=chunk.grid, **chunk.values)
+        malformed_records = reader.malformed
+        if binary_mode is True:
+            lost_frames = reader.lost
+
+    def qa(chunk):
+        global currentMotorState
+
+        golden_check.add(chunk.grid, calibration.from_volts(chunk.values['voltage'], 'dBm'))
+        if qaFailed():
+            # the rest of the sweep of a failed unit is not needed
+            ser.write(COMMAND_STOP)
+            currentMotorState = motorState["INACTIVE"]
+            return True
+        return False
+
+    sinks = [buffers, session_sink(session), metrics_sink(metrics), metrics_sink(statistics)]
+    if golden_check is not None:
+        sinks.append(qa)
+    try:
+        origin = read_sweep(reader, model, sinks, convertToVoltage, period, binary_mode, start_angle,
+                            origin, last_sample, stopped=lambda: stop is True or ser.isOpen() is False,
+                            idle=worker.write_pending, stats=pipeline)[1]
+    finally:
+        # a sweep which ended early (stop, timeout of the link) is INCOMPLETE
+        result = golden_check.result() if golden_check is not None else None
+        session.close(samples=session.count, malformed_records=reader.malformed - malformed,
+                      metrics=metrics.result(), pipeline=pipeline.summary(), qa=result)
+        if result is not None:
+            qa_log.add(antenna_id, golden_check.reference.name, result, time.perf_counter() - start, session_path)
+        if library is not None:
+            library.add(session_path)
+    return origin
+
+def treadContinuousCapture():
+    """ It is called by the serial worker as a job. It reads samples until stop
+    without a limit of their number, the antenna stands still or turns. The
+    firmware is switched to continuous mode, so samples come while the motor
+    stands too. Samples go to the disk and to the min/max pyramid of the capture """
+
+    global thread_flag
+    global capture
+    global session_path
+    global malformed_records
+    global lost_frames
+
+    direction = {motorState["ACTIVE_R"]: 1, motorState["ACTIVE_L"]: -1}.get(currentMotorState, 0)
+    model = RotationModel(SPEED_MOTOR[max(speed, 1)], int(steps), direction or 1)
+    period = int(timer) * 1e-6
+    reader = FrameReader(ser, channels) if binary_mode is True else ChunkReader(ser, channels)
+    pipeline.reset(reader)
+
+    start = time.perf_counter()
+    previous = None     # timestamp of the last sample
+    origin = None
+    malformed = reader.malformed
+    session_path = new_session_path(session_directory, 'capture')
+    metadata = sessionMetadata()
+    metadata.update(continuous=True, direction=direction,
+                    angle_source='step index' if binary_mode is True else 'rotation model')
+    capture = ContinuousCapture(session_path, metadata, dtype=record_dtype(channels))
+    ser.write(COMMAND_CONTINUOUS)
+
+    try:
+        while stop is False and ser.isOpen() is True:
+            worker.write_pending()
+            try:
+                data = reader.read()
+            except serial.SerialException:
+                pipeline.serial_errors += 1
+                print("Serial port is not open")
+                continue
+            read_time = time.perf_counter()
+            pipeline.add_read(len(data), read_time)
+            if len(data) == 0:
+                continue
+            received = read_time - start
+            timestamp = sample_times(len(data), received, period, previous)
+            previous = timestamp[-1]
+            sequence = -1
+            if binary_mode is True:
+                if origin is None:
+                    origin = int(data['step'][0])
+                angle = model.start_angle + (data['step'] - origin) * DEGREES_PER_STEP
+                sequence = data['sequence']
+                lost_frames = reader.lost
+            elif direction != 0:
+                angle = model.angle(timestamp)
+            else:
+                angle = np.nan  # the table stands, its angle is not known
+            adc = channel_columns(data)
+            capture.append(timestamp=timestamp, angle=angle, voltage=convertToVoltage(adc['adc']),
+                           received=received, sequence=sequence, **adc)
+            malformed_records = reader.malformed
+    finally:
+        if ser.isOpen() is True:
+            ser.write(COMMAND_SWEEP)
+        capture.close(malformed_records=reader.malformed - malformed, pipeline=pipeline.summary())
+        thread_flag = False
+        if library is not None:
+            library.add(session_path)
 
-    number = 0
-    MAX_NUM = 185
-            
-    while stop is False and number <= MAX_NUM and ser.isOpen() is True:
-        ser.flushInput()
-        try:
-            data = ser.readline()
-        except serial.SerialException:
-            print("Serial port is not open")
-        except serial.serialutil.SerialException:
-            print("Serial port is not open")
-        except AttributeError:
-            print("Invalid data")
-        else:    
-            if data != b'\n' and data != b'\0' and data != b'':
-                try:
-                    data = data.decode('ascii')
-                    data = int(data)
-
-                    data = convertToVoltage(data)
-                except ValueError:
-                    print("Incorrect input data")
-                except TypeError:
-                    print("Incorrect input data")    
-                else:
-                    data_ADC.append(data)       
-                    degree.append(number)
-                    number += 1
-
-    thread_flag = False
-    data_ADC = []
-    degree = []
 
 # Creating class SetupBar
 class SetupBar(tkinter.Frame):
@@ -142,13 +689,53 @@ class SetupBar(tkinter.Frame):
         self.init_window()
     def fetch_baud_rate(self):
         global baud_rate
-        baud_rate = self.ent1.get()
-        serial_port_init()
+        global baud_limit
+        text = self.ent1.get().strip()
+        if text.isdigit():
+            baud_rate = baud_limit = int(text)
+        else:
+            baud_limit = None   # 'auto', the highest baud rate which works
+        self.connect()
 
     def fetch_com_port(self):
         global com_port
-        com_port = self.ent2.get()
-        serial_port_init()
+        com_port = self.ent2.get().strip() or AUTO_PORT
+        self.connect()
+
+    def connect(self):
+        """ This method looks for the recorder and negotiates the baud rate. Firmware
+        without the handshake gets the port and baud rate of the entries as they are """
+
+        self.UpdateBaudRate.config(state=tkinter.DISABLED)
+        self.UpdateSerialPort.config(state=tkinter.DISABLED)
+        self.label_link['text'] = 'Looking for the recorder...'
+        self.connecting = connectRecorder()
+        self.after(100, self.connected)
+
+    def connected(self):
+        """ This method waits for the result of connect() without blocking the window """
+
+        if not self.connecting.done():
+            self.after(100, self.connected)
+            return
+        try:
+            connection = self.connecting.result()
+        except Exception as error:
+            print(error)
+            connection = None
+        serial_port_init(connection)
+        if connection is None and ser.port is None:
+            self.label_link['text'] = 'No recorder found on %s, nothing is connected' % com_port
+        elif connection is None:
+            self.label_link['text'] = 'No answer, %s at %s baud' % (ser.port, baud_rate)
+        else:
+            self.label_link['text'] = 'Firmware %s, %s at %d baud' % (firmware_version, com_port, baud_rate)
+        self.ent1.delete(0, tkinter.END)
+        self.ent1.insert(0, baud_rate)
+        self.ent2.delete(0, tkinter.END)
+        self.ent2.insert(0, com_port)
+        self.UpdateBaudRate.config(state=tkinter.NORMAL)
+        self.UpdateSerialPort.config(state=tkinter.NORMAL)
 
     def init_window(self):     
             
@@ -173,7 +760,7 @@ class SetupBar(tkinter.Frame):
         self.ent3 = tkinter.Entry(self)
         self.ent3.insert(0, steps) 
         self.ent3.grid(column = 1, row = 4)
-        self.UpdateSteps = tkinter.Button(self, text="    Update Steps    ")
+        self.UpdateSteps = tkinter.Button(self, text="    Update Steps    ", command=self.fetch_steps)
         self.UpdateSteps.grid(column = 1, row = 5, sticky=tkinter.W)
 
         self.label4 = tkinter.Label(self, text= 'Time:')
@@ -181,8 +768,328 @@ class SetupBar(tkinter.Frame):
         self.ent4 = tkinter.Entry(self)
         self.ent4.insert(0, timer) 
         self.ent4.grid(column = 1, row = 6)
-        self.UpdateTime = tkinter.Button(self, text="    Update Time    ")
+        self.UpdateTime = tkinter.Button(self, text="    Update Time    ", command=self.fetch_time)
         self.UpdateTime.grid(column = 1, row = 7, sticky=tkinter.W)
+
+        self.binary = tkinter.BooleanVar(self, value=binary_mode)
+        self.BinaryMode = tkinter.Checkbutton(self, text="Binary frames", variable=self.binary,
+                                              command=self.fetch_binary_mode)
+        self.BinaryMode.grid(column = 1, row = 8, sticky=tkinter.W)
+
+        self.label5 = tkinter.Label(self, text= 'Antenna ID:')
+        self.label5.grid(column = 0, row = 9, sticky=tkinter.E)
+        self.ent5 = tkinter.Entry(self)
+        self.ent5.insert(0, antenna_id)
+        self.ent5.grid(column = 1, row = 9)
+
+        self.label6 = tkinter.Label(self, text= 'Frequency, MHz:')
+        self.label6.grid(column = 0, row = 10, sticky=tkinter.E)
+        self.ent6 = tkinter.Entry(self)
+        self.ent6.insert(0, frequency)
+        self.ent6.grid(column = 1, row = 10)
+        self.UpdateAntenna = tkinter.Button(self, text="  Update Antenna  ", command=self.fetch_antenna)
+        self.UpdateAntenna.grid(column = 1, row = 11, sticky=tkinter.W)
+
+        self.label7 = tkinter.Label(self, text= 'Sweeps:')
+        self.label7.grid(column = 0, row = 12, sticky=tkinter.E)
+        self.ent7 = tkinter.Entry(self)
+        self.ent7.insert(0, sweep_count)
+        self.ent7.grid(column = 1, row = 12)
+        self.UpdateSweeps = tkinter.Button(self, text="   Update Sweeps   ", command=self.fetch_sweep_count)
+        self.UpdateSweeps.grid(column = 1, row = 13, sticky=tkinter.W)
+
+        self.label8 = tkinter.Label(self, text= 'Channels:')
+        self.label8.grid(column = 0, row = 14, sticky=tkinter.E)
+        self.ent8 = tkinter.Entry(self)
+        self.ent8.insert(0, settingText(COMMAND_CHANNELS))
+        self.ent8.grid(column = 1, row = 14)
+        self.UpdateChannels = tkinter.Button(self, text="  Update Channels  ", command=self.fetch_channels)
+        self.UpdateChannels.grid(column = 1, row = 15, sticky=tkinter.W)
+
+        self.label_link = tkinter.Label(self, text='Not connected')
+        self.label_link.grid(column = 0, row = 16, columnspan = 2, sticky=tkinter.W)
+
+    def fetch_steps(self):
+        self.fetch_setting(self.ent3, COMMAND_STEPS, 'Steps')
+
+    def fetch_time(self):
+        self.fetch_setting(self.ent4, COMMAND_TIMER, 'Time')
+
+    def fetch_channels(self):
+        # analog pins like '0,1,2', the firmware takes their mask
+        self.fetch_setting(self.ent8, COMMAND_CHANNELS, 'Channels', pins_mask)
+
+    def fetch_setting(self, entry, command, name, parse=int):
+        """ This method sends the value of the entry to the firmware. The host
+        takes it only when the firmware confirms it """
+
+        try:
+            value = parse(entry.get())
+        except ValueError:
+            print("%s is not valid" % name)
+            return
+        if thread_flag is True:
+            print("%s can not be changed during a sweep" % name)
+            return
+        if command in (COMMAND_TIMER, COMMAND_CHANNELS):
+            period, mask = (value, channel_mask) if command == COMMAND_TIMER else (int(timer), value)
+            if not samples_fit(period, mask, int(baud_rate)):
+                # the firmware would keep the old value
+                print("%s does not fit: the channels can not be read and sent within %d us at %s baud" %
+                      (name, period, baud_rate))
+                return
+        self.after(50, self.setting_confirmed, commandSetting(command, value), entry, command)
+
+    def setting_confirmed(self, future, entry, command):
+        """ This method waits for the answer of the firmware without blocking the window """
+
+        if not future.done():
+            self.after(50, self.setting_confirmed, future, entry, command)
+            return
+        try:
+            value = future.result()
+        except Exception as error:
+            print(error)
+            value = None
+        if value is None:
+            print("The recorder did not confirm the setting")
+        else:
+            adaptToSettings(command, value)
+        entry.delete(0, tkinter.END)
+        entry.insert(0, settingText(command))
+
+    def fetch_binary_mode(self):
+        global binary_mode
+        binary_mode = self.binary.get()
+        commandFrameFormat()
+
+    def fetch_antenna(self):
+        global antenna_id
+        global frequency
+        antenna_id = self.ent5.get().strip()
+        try:
+            frequency = float(self.ent6.get())
+        except ValueError:
+            print("Frequency is not a number")
+
+    def fetch_sweep_count(self):
+        global sweep_count
+        try:
+            sweep_count = max(int(self.ent7.get()), 1)
+        except ValueError:
+            print("Number of sweeps is not a number")
+
+
+# Creating class DiagnosticsPanel
+class DiagnosticsPanel(tkinter.Frame):
+    """ Metrics of the registry, refreshed twice a second, their export and
+    the switch of the sampling profiler """
+
+    def __init__(self, parent=None):
+        tkinter.Frame.__init__(self, parent)
+        self.init_window()
+        self.refresh()
+
+    def init_window(self):
+
+        self.label = tkinter.Label(self, text='Diagnostics')
+        self.label.grid(column = 0, row = 0, sticky=tkinter.W)
+
+        self.profile = tkinter.BooleanVar(value=profile_sweeps)
+        self.check_profile = tkinter.Checkbutton(self, text='Profile sweeps', variable=self.profile,
+                                                 command=self.fetch_profile)
+        self.check_profile.grid(column = 1, row = 0, columnspan = 2, sticky=tkinter.E)
+
+        self.capture = tkinter.BooleanVar(value=capture_raw)
+        self.check_capture = tkinter.Checkbutton(self, text='Capture raw stream', variable=self.capture,
+                                                 command=self.fetch_capture)
+        self.check_capture.grid(column = 1, row = 3, columnspan = 2, sticky=tkinter.E)
+
+        self.text = tkinter.Text(self, width=56, height=26, font='TkFixedFont')
+        self.text.grid(column = 0, row = 1, columnspan = 3)
+        self.text.config(state=tkinter.DISABLED)
+
+        self.button_json = tkinter.Button(self, text="Save JSON", command=lambda: self.save('.json'))
+        self.button_json.grid(column = 1, row = 2)
+        self.button_prometheus = tkinter.Button(self, text="Save Prometheus", command=lambda: self.save('.prom'))
+        self.button_prometheus.grid(column = 2, row = 2)
+
+    def refresh(self):
+        """ It shows every metric in one line, timings in milliseconds """
+
+        lines = []
+        for name, value in Metrics.REGISTRY.snapshot().items():
+            if value['type'] == 'histogram':
+                lines.append('%-28s %7d  p50 %s  p99 %s' % (name, value['count'], value['p50_ms'], value['p99_ms']))
+            else:
+                lines.append('%-28s %s' % (name, value['value']))
+        self.text.config(state=tkinter.NORMAL)
+        self.text.delete('1.0', tkinter.END)
+        self.text.insert(tkinter.END, '\n'.join(lines))
+        self.text.config(state=tkinter.DISABLED)
+        self.after(DIAGNOSTICS_PERIOD, self.refresh)
+
+    def fetch_profile(self):
+        global profile_sweeps
+        profile_sweeps = self.profile.get()
+
+    def fetch_capture(self):
+        global capture_raw
+        capture_raw = self.capture.get()
+
+    def save(self, extension):
+
+        path = tkinter.filedialog.asksaveasfilename(defaultextension=extension, initialdir=session_directory,
+                                                    filetypes=[('Metrics', '*' + extension)])
+        if path:
+            Metrics.REGISTRY.dump(path)
+
+
+# Creating class LibraryWindow
+class LibraryWindow(tkinter.Toplevel):
+    """ Search in the pattern library. Selected sweeps are overlaid on the plot
+    of the workspace """
+
+    def __init__(self, workspace):
+        tkinter.Toplevel.__init__(self, workspace.parent)
+        self.workspace = workspace
+        self.rows = []
+        self.title("Pattern Library")
+        self.init_window()
+        self.search()
+
+    def init_window(self):
+
+        labels = ('Antenna ID:', 'Frequency, MHz:', 'From (YYYY-MM-DD):', 'To (YYYY-MM-DD):')
+        self.entries = []
+        for row, text in enumerate(labels):
+            tkinter.Label(self, text=text).grid(column = 0, row = row, sticky=tkinter.E)
+            entry = tkinter.Entry(self)
+            entry.grid(column = 1, row = row, sticky=tkinter.W)
+            self.entries.append(entry)
+        self.entries[0].insert(0, antenna_id)
+
+        self.button_search = tkinter.Button(self, text="Search", command=self.search)
+        self.button_search.grid(column = 1, row = 4, sticky=tkinter.W)
+
+        self.listbox = tkinter.Listbox(self, selectmode=tkinter.EXTENDED, width=80, height=20)
+        self.listbox.grid(column = 0, row = 5, columnspan = 2)
+
+        self.button_overlay = tkinter.Button(self, text="Overlay", command=self.overlay)
+        self.button_overlay.grid(column = 1, row = 6, sticky=tkinter.E)
+
+    def search(self):
+        """ It fills the list with sweeps which match the filters """
+
+        antenna, frequency_text, first_day, last_day = (entry.get().strip() for entry in self.entries)
+        try:
+            start = time.mktime(time.strptime(first_day, '%Y-%m-%d')) if first_day else None
+            end = time.mktime(time.strptime(last_day, '%Y-%m-%d')) + 24 * 3600 if last_day else None
+            frequency = float(frequency_text) if frequency_text else None
+        except ValueError:
+            print("Wrong filter of the pattern library")
+            return
+
+        self.rows = library.query(start=start, end=end, antenna_id=antenna, frequency=frequency,
+                                  tolerance=FREQUENCY_TOLERANCE, limit=LIBRARY_ROWS)
+        self.listbox.delete(0, tkinter.END)
+        for row in self.rows:
+            self.listbox.insert(tkinter.END, libraryLabel(row))
+
+    def overlay(self):
+
+        selected = [self.rows[index] for index in self.listbox.curselection()]
+        self.workspace.overlay(selected)
+
+
+# Creating class DevicesWindow
+class DevicesWindow(tkinter.Toplevel):
+    """ Control of several recorders at once. Every device has its own port,
+    worker thread and session files, its pattern is a subplot of the workspace """
+
+    def __init__(self, workspace):
+        tkinter.Toplevel.__init__(self, workspace.parent)
+        self.workspace = workspace
+        self.status = []    # (device, label) of every row
+        self.status_timer = None
+        self.title("Devices")
+        self.bind('<Destroy>', self.on_destroy)
+        self.init_window()
+        self.show_devices()
+
+    def init_window(self):
+
+        tkinter.Label(self, text='Ports (up to %d):' % MAX_DEVICES).grid(column = 0, row = 0, sticky=tkinter.E)
+        self.ent_ports = tkinter.Entry(self, width=60)
+        self.ent_ports.grid(column = 1, row = 0, columnspan = 4, sticky=tkinter.W)
+        self.button_open = tkinter.Button(self, text="Open", command=self.open_ports)
+        self.button_open.grid(column = 5, row = 0)
+
+        self.device_frame = tkinter.Frame(self)
+        self.device_frame.grid(column = 0, row = 1, columnspan = 6, sticky=tkinter.W)
+
+        buttons = (("Left all", manager.left), ("Stop all", manager.stop), ("Right all", manager.right),
+                   ("Record all", manager.record), ("Close all", self.close_devices))
+        for column, (text, command) in enumerate(buttons):
+            tkinter.Button(self, text=text, command=command).grid(column = column, row = 2)
+
+    def open_ports(self):
+        """ It opens comma separated ports in addition to the open ones """
+
+        ports = [port.strip() for port in self.ent_ports.get().split(',') if port.strip()]
+        if ports:
+            self.workspace.open_devices(ports)
+            self.ent_ports.delete(0, tkinter.END)
+            self.show_devices()
+
+    def close_devices(self):
+
+        self.workspace.close_devices()
+        self.show_devices()
+
+    def show_devices(self):
+        """ It creates one row of buttons and status for every open device """
+
+        for widget in self.device_frame.winfo_children():
+            widget.destroy()
+        self.status = []
+        for row, device in enumerate(manager.devices):
+            tkinter.Label(self.device_frame, text=device.port).grid(column = 0, row = row, sticky=tkinter.W)
+            buttons = (("Left", device.left), ("Stop", device.stop), ("Right", device.right),
+                       ("Record", device.record))
+            for column, (text, command) in enumerate(buttons, 1):
+                tkinter.Button(self.device_frame, text=text, command=command).grid(column = column, row = row)
+            label = tkinter.Label(self.device_frame, text='-', width=70, anchor=tkinter.W)
+            label.grid(column = 5, row = row, sticky=tkinter.W)
+            self.status.append((device, label))
+        if self.status_timer is None:
+            self.update_status()
+
+    def update_status(self):
+        """ It shows state and metrics of every device, five times a second """
+
+        for device, label in self.status:
+            state = 'Recording' if device.recording else {-1: 'Left', 0: 'Stop', 1: 'Right'}[device.direction]
+            label['text'] = '%-9s %6d samples  %s' % (state, len(device.samples),
+                                                     metricsText(device.metrics.result()))
+        self.status_timer = self.after(200, self.update_status)
+
+    def on_destroy(self, event):
+
+        if event.widget is self and self.status_timer is not None:
+            self.after_cancel(self.status_timer)
+            self.status_timer = None
+
+
+def libraryLabel(row):
+    """ Text of a catalog row in the list and in the legend """
+
+    text = '%s  %s  %.1f MHz  %d samples' % (
+        time.strftime('%Y-%m-%d %H:%M', time.localtime(row['start_time'] or 0)),
+        row['antenna_id'] or '-', row['frequency'] or 0.0, row['samples'])
+    if row['peak_voltage'] is not None and row['peak_angle'] is not None:
+        text += '  peak %.2f V at %.1f' % (row['peak_voltage'], row['peak_angle'])
+    return text
    
    
 # Here, we are creating our class, WorkSpace, and inheriting from the Frame
@@ -198,12 +1105,31 @@ class WorkSpace(tkinter.Frame):
         #reference to the master widget, which is the tk window                 
         self.parent = parent
 
-        #plot instanses
-        self.fig, self.ax = plt.subplots()
-        
-        self.canvas = FigureCanvasTkAgg(self.fig, master=self.parent)  # A tk.DrawingArea.
-        self.toolbar = NavigationToolbar2Tk(self.canvas, self.parent)
-        self.toolbar.pack(side=tkinter.BOTTOM)
+        #plot instanses are created by init_plot() when the window is shown,
+        #matplotlib is the slowest part of the start
+        self.fig = None
+        self.ax = None
+        self.canvas = None
+        self.toolbar = None
+        self.renderer = None
+        self.toolbar_frame = tkinter.Frame(self.parent)
+        self.toolbar_frame.pack(side=tkinter.BOTTOM)
+        self.version = 0    # version of samples buffer which is on the plot
+        self.conversion = 0 # conversion of samples buffer which is on the plot
+        self.traces = None  # channel mask and plot mode of the traces of the renderer
+        self.plot_timer = None
+        self.overlays = []  # historical patterns, they are part of the cached background
+        self.sweep = 0      # finished sweeps of the batch which are on the plot
+        self.band = None    # confidence band and mean of the batch
+        self.mean_line = None
+        self.mask = None    # tolerance mask of the golden reference
+        self.mask_shift = None  # alignment of the unit which the mask is drawn for
+        self.device_views = []  # subplot of every open device of the manager
+        self.device_timer = None
+        self.continuous_line = None # envelope of the continuous capture
+        self.follow = True          # the continuous plot shows the newest samples
+        self.scrolling = False      # the limits are changed by the timer, not by the user
+        self.continuous_timer = None
 
         #with that, we want to then run init_window, which doesn't yet exist
         self.init_window()
@@ -222,6 +1148,47 @@ class WorkSpace(tkinter.Frame):
         #added "file" to our menu
         self.menu.add_cascade(label="File", menu=self.file)
 
+        self.library_menu = tkinter.Menu(self.menu)
+        self.library_menu.add_command(label="Open...", command=self.open_library)
+        self.library_menu.add_command(label="Clear overlays", command=self.clear_overlays)
+        self.menu.add_cascade(label="Library", menu=self.library_menu)
+
+        self.devices_menu = tkinter.Menu(self.menu)
+        self.devices_menu.add_command(label="Open...", command=self.open_devices_window)
+        self.menu.add_cascade(label="Devices", menu=self.devices_menu)
+
+        # profiles of the detector and units of the plot, raw ADC data are converted again
+        self.calibration_menu = tkinter.Menu(self.menu)
+        self.profile = tkinter.StringVar(self, value=calibration.name)
+        for name in profiles:
+            self.calibration_menu.add_radiobutton(label=name, variable=self.profile, value=name,
+                                                  command=self.fetch_calibration)
+        self.calibration_menu.add_separator()
+        self.unit = tkinter.StringVar(self, value=display_unit)
+        for unit in UNITS:
+            self.calibration_menu.add_radiobutton(label=UNIT_LABELS[unit], variable=self.unit, value=unit,
+                                                  command=self.fetch_calibration)
+        self.menu.add_cascade(label="Calibration", menu=self.calibration_menu)
+
+        # channels of the multi-channel recorder as overlaid traces or as ratios
+        self.channels_menu = tkinter.Menu(self.menu)
+        self.plot_mode = tkinter.StringVar(self, value=plot_mode)
+        self.channels_menu.add_radiobutton(label="Overlaid traces", variable=self.plot_mode, value='overlay',
+                                           command=self.fetch_plot_mode)
+        self.channels_menu.add_radiobutton(label="Ratio to the first channel", variable=self.plot_mode,
+                                           value='ratio', command=self.fetch_plot_mode)
+        self.menu.add_cascade(label="Channels", menu=self.channels_menu)
+
+        # production QA against a golden reference
+        self.qa_menu = tkinter.Menu(self.menu)
+        self.qa_menu.add_command(label="Load reference...", command=self.open_reference)
+        self.qa_menu.add_command(label="Save reference...", command=self.save_reference)
+        self.stop_failed = tkinter.BooleanVar(self, value=stop_failed)
+        self.qa_menu.add_checkbutton(label="Stop failed units", variable=self.stop_failed,
+                                     command=self.fetch_stop_failed)
+        self.qa_menu.add_command(label="Leave QA mode", command=self.close_reference)
+        self.menu.add_cascade(label="QA", menu=self.qa_menu)
+
         # changing the title of our master widget      
         self.master.title("Graphic Interface for Antenna Pattern Recorder")
         self.master.iconbitmap('clienticon.ico')
@@ -229,15 +1196,10 @@ class WorkSpace(tkinter.Frame):
         # allowing the widget to take the full space of the root window
         #self.pack(fill=tkinter.BOTH, expand=1)
 
-        self.plot()
-
-        #self.canvas = FigureCanvasTkAgg(self.fig, master=self.master)  # A tk.DrawingArea.
-        self.canvas.draw()
-        self.canvas.get_tk_widget().pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=1)
-
-        #self.toolbar = NavigationToolbar2Tk(self.canvas, self.master)
-        self.toolbar.update()
-        self.canvas.get_tk_widget().pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=1)
+        # place of the canvas, the plot is created as soon as it is visible
+        self.plot_frame = tkinter.Frame(master=self.parent)
+        self.plot_frame.pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=1)
+        self.plot_frame.bind('<Map>', self.on_map)
 
         # creating a button instances
         self.button_quit = tkinter.Button(master=self.parent, text="Quit", command=self._quit)
@@ -262,106 +1224,529 @@ class WorkSpace(tkinter.Frame):
         self.button_start = tkinter.Button(master=self.parent, text="Start record pattern", command=self.start_record)
         self.button_start.pack(side=tkinter.LEFT)
 
+        self.button_continuous = tkinter.Button(master=self.parent, text="Continuous", command=self.continuousCapture)
+        self.button_continuous.pack(side=tkinter.LEFT)
+
+        self.frame_label = tkinter.Label(master=self.parent, text="Frame: -")
+        self.frame_label.pack(side=tkinter.LEFT, padx=10)
+
+        self.metrics_label = tkinter.Label(master=self.parent, text="Peak: -")
+        self.metrics_label.pack(side=tkinter.LEFT, padx=10)
+
+        self.pipeline_label = tkinter.Label(master=self.parent, text="Lost: -")
+        self.pipeline_label.pack(side=tkinter.LEFT, padx=10)
+
+        self.qa_label = tkinter.Label(master=self.parent, text=qaText())
+        self.qa_label.pack(side=tkinter.LEFT, padx=10)
+
+    def on_map(self, event):
+        self.plot_frame.unbind('<Map>')
+        self.after_idle(self.init_plot)    # after the window is drawn
+
+    def init_plot(self):
+        """ This method imports matplotlib and creates the plot. The window, the
+        serial port and the motor buttons work before it is called"""
+
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+
+        self.fig = Figure()
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.plot_frame)  # A tk.DrawingArea.
+        self.toolbar = NavigationToolbar2Tk(self.canvas, self.toolbar_frame)
+        self.toolbar.update()
+
+        self.create_axes()
+        self.canvas.get_tk_widget().pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=1)
+
+    def create_axes(self):
+        """ This method creates the axes of the single recorder with the
+        persistent line of the live pattern"""
+
+        from Plot_Renderer import BlitRenderer
+
+        self.ax = self.fig.add_subplot()
+        self.setup_axes()
+        self.traces = (channel_mask, plot_mode)
+        self.renderer = BlitRenderer(self.ax, self.canvas, len(plotTraces(samples.snapshot()[1])), plotLabels())
+        self.draw_mask()
+        self.canvas.draw()
+
+    def remove_axes(self):
+        """ This method removes all subplots, overlays and statistics"""
+
+        if self.renderer is not None:
+            self.renderer.disconnect()
+        for view in self.device_views:
+            view['renderer'].disconnect()
+        self.fig.clear()
+        self.ax = None
+        self.renderer = None
+        self.device_views = []
+        self.continuous_line = None
+        self.overlays = []
+        self.band = None
+        self.mean_line = None
+        self.mask = None
+
     def start_record(self):
         self.leftRotation()
         
-    def plot(self):
-        """ This method is intended for drawing of the plot"""
-        
-        global degree
-        global data_ADC
-        global thread_flag
-        global stop
-        global motor_state
+    def setup_axes(self):
+        """ This method sets labels, limits and grid of the plot. They are drawn
+        only into the cached background of the renderer"""
 
-        number = len(data_ADC)
-
-        self.ax.set(xlabel='Degree', ylabel='Voltage', title='Antenna Pattern')
+        label, limits = plotAxis()
+        self.ax.set(xlabel='Degree', ylabel=label, title='Antenna Pattern')
         self.ax.set_xlim(left = 0, right = 180)
-        self.ax.set_ylim(bottom = 0, top = 5.5)
-        self.ax.plot(degree, data_ADC)
+        self.ax.set_ylim(*limits)
         self.ax.grid()
+
+    def update_traces(self):
+        """ This method takes other channels or another plot mode: one trace per
+        channel or per ratio, the axis of their unit """
+
+        self.traces = (channel_mask, plot_mode)
+        if self.renderer is None:
+            return
+        label, limits = plotAxis()
+        self.ax.set_ylabel(label)
+        self.ax.set_ylim(*limits)
+        version, sweep = samples.snapshot()
+        traces = plotTraces(sweep)
+        self.renderer.set_traces(len(traces), plotLabels())
+        self.renderer.update(sweep['angle'], traces, 0)
+        self.draw_mask()
         self.canvas.draw()
-        self.toolbar.update()
-   
-        if thread_flag is True and stop is False and number <= 180:
-            self.parent.after(10, self.plot) # It is timer. Timer expires every 10 ms and after that calls self.plot()
-            self.ax.clear()
+
+    def fetch_plot_mode(self):
+        """ This method switches between overlaid traces and ratios of the channels"""
+
+        global plot_mode
+
+        plot_mode = self.plot_mode.get()
+        self.update_traces()
+
+    def plot(self):
+        """ This method is intended for drawing of the plot. It is called by timer
+        and blits only the samples received since the previous call"""
+
+        global thread_flag
+        global stop
+
+        running = thread_flag   # read first, so the last samples of the job are drawn
+        finished = sweep_number
+        version, sweep = samples.snapshot()
+
+        if self.renderer is not None:
+            if self.traces != (channel_mask, plot_mode):
+                self.update_traces()
+            new = version - self.version
+            self.renderer.update(sweep['angle'], plotTraces(sweep), new)
+            if new > 0:
+                # time from the read to the screen, samples overwritten before this frame are overruns
+                drawn = min(new, len(sweep['received']))
+                pipeline.add_shown(sweep['received'][len(sweep['received']) - drawn:], time.perf_counter())
+                pipeline.overruns += max(new - samples.capacity, 0)
+            self.version = version
+            if conversion != self.conversion:
+                # a new peak in dB or the sweep was converted again with a new calibration
+                self.conversion = conversion
+                self.canvas.draw()
+            if golden_check is not None and golden_check.shift != self.mask_shift:
+                # the mask follows the alignment of the unit
+                self.draw_mask()
+                self.canvas.draw()
+            if finished != self.sweep:
+                # a sweep of the batch is over, the buffer holds the next one
+                self.sweep = finished
+                if sweep_count > 1:
+                    self.draw_statistics()
+                self.canvas.draw()
+            self.frame_label['text'] = 'Sweep: %d/%d  Frame: %.1f ms' % (
+                min(self.sweep + 1, sweep_count), sweep_count, self.renderer.mean_frame_time() * 1000)
+        self.metrics_label['text'] = metricsText(metrics.result())
+        self.pipeline_label['text'] = pipeline.text()
+        self.qa_label['text'] = qaText()
+
+        if running is True and stop is False:
+            self.plot_timer = self.parent.after(10, self.plot) # It is timer. Timer expires every 10 ms and after that calls self.plot()
         else:
-            self.parent.after_cancel(self.plot)
+            self.plot_timer = None
 
     def clear(self):
         """ This method is intended for reseting of the plot"""
 
-        global degree
-        global data_ADC
         global thread_flag
-        
-        self.ax.clear()
-        self.ax.set(xlabel='Degree', ylabel='Voltage', title='Antenna Pattern')
-        self.ax.set_xlim(left = 0, right = 180)
-        self.ax.set_ylim(bottom = 0, top = 5.5)
+
+        if stop is True or thread_flag is False:
+            samples.clear()
+            self.remove_statistics()
+            if self.continuous_line is not None:
+                self.restore_axes()
+
+        if self.renderer is not None:
+            self.renderer.reset()
+
+    def draw_statistics(self):
+        """ This method draws the mean of all finished sweeps of the batch with its
+        95 % confidence band. They are static, so they go into the cached background"""
+
+        self.remove_statistics()
+        result = statistics.result()
+        self.band = self.ax.fill_between(result['angle'], displayVolts(result['low']), displayVolts(result['high']),
+                                         color='C0', alpha=0.25, linewidth=0)
+        self.mean_line, = self.ax.plot(result['angle'], displayVolts(result['mean']), color='C0',
+                                       linestyle='--', linewidth=1)
+
+    def remove_statistics(self):
+
+        if self.band is not None:
+            self.band.remove()
+            self.mean_line.remove()
+            self.band = None
+            self.mean_line = None
+
+    def draw_mask(self):
+        """ This method draws the tolerance mask of the golden reference at the
+        alignment of the current unit. It is static, so it goes into the cached
+        background. Ratios of channels have no mask"""
+
+        if self.mask is not None:
+            self.mask.remove()
+            self.mask = None
+        self.mask_shift = golden_check.shift if golden_check is not None else None
+        if golden is None or self.ax is None or (plot_mode == 'ratio' and channels > 1):
+            return
+        bottom = self.ax.get_ylim()[0]
+        angle = golden.angle - (self.mask_shift or 0) * golden.step
+        self.mask = self.ax.fill_between(angle, np.maximum(displayLevel(golden.low), bottom),
+                                         displayLevel(golden.high), color='C2', alpha=0.2, linewidth=0)
+
+    def open_reference(self):
+        """ This method loads a golden reference (.npz, or a session of a known-good
+        antenna with the default mask) and starts the QA mode"""
+
+        global golden
+        global qa_log
+
+        path = tkinter.filedialog.askopenfilename(initialdir=session_directory, filetypes=[
+            ('Golden reference', '*' + REFERENCE_EXTENSION), ('Session', '*' + EXTENSION)])
+        if not path:
+            return
+        try:
+            reference = load_reference(path, calibration)
+        except (OSError, ValueError, KeyError) as error:
+            print(error)
+            return
+        if reference.calibration != calibration.name:
+            print('The reference is in dBm of calibration %s, not of %s' % (reference.calibration, calibration.name))
+        golden = reference
+        if qa_log is None:
+            qa_log = QALog(os.path.join(session_directory, QA_LOG_NAME))
+        self.qa_label['text'] = qaText()
+        if self.renderer is not None:
+            self.draw_mask()
+            self.canvas.draw()
+
+    def save_reference(self):
+        """ This method saves the golden reference with its mask, e.g. one made from a session"""
+
+        if golden is None:
+            return
+        path = tkinter.filedialog.asksaveasfilename(defaultextension=REFERENCE_EXTENSION, initialdir=session_directory,
+                                                    filetypes=[('Golden reference', '*' + REFERENCE_EXTENSION)])
+        if path:
+            golden.save(path)
+
+    def close_reference(self):
+        """ This method leaves the QA mode from the next sweep on, the log of the
+        units is kept"""
+
+        global golden
+
+        golden = None
+        self.qa_label['text'] = qaText()
+        if self.renderer is not None:
+            self.draw_mask()
+            self.canvas.draw()
+
+    def fetch_stop_failed(self):
+        global stop_failed
+        stop_failed = self.stop_failed.get()
+
+    def open_library(self):
+        """ This method opens the search window of the pattern library"""
+
+        if library is not None:
+            LibraryWindow(self)
+
+    def overlay(self, rows):
+        """ This method draws sweeps of the library under the live pattern. Sweeps
+        come from the cache of the library, the canvas is redrawn only once"""
+
+        if self.ax is None:
+            return
+        for row in rows:
+            angle, voltage = library.load(row['path'])
+            label = '%s %s' % (row['antenna_id'] or '-',
+                               time.strftime('%Y-%m-%d %H:%M', time.localtime(row['start_time'] or 0)))
+            line, = self.ax.plot(angle, displayVolts(voltage), color='C%d' % (len(self.overlays) % 9 + 1),
+                                 linewidth=0.8, alpha=0.6, label=label)
+            line.volts = voltage    # for another unit of the plot
+            self.overlays.append(line)
+        if self.overlays:
+            self.ax.legend(handles=self.overlays, fontsize='x-small')
+        self.canvas.draw()
+
+    def clear_overlays(self):
+        """ This method removes all sweeps of the library from the plot"""
+
+        if self.ax is None:
+            return
+        for line in self.overlays:
+            line.remove()
+        self.overlays = []
+        if self.ax.get_legend() is not None:
+            self.ax.get_legend().remove()
+        self.canvas.draw()
+
+    def fetch_calibration(self):
+        """ This method swaps the calibration profile or the unit of the plot. The
+        serial worker converts the sweep again from its ADC data; axes, overlays
+        and statistics are converted here """
+
+        future = setCalibration(lookup_table(profiles[self.profile.get()]), self.unit.get())
+        if self.continuous_line is not None:
+            label, limits = storedAxis()
+            self.ax.set_ylabel(label)
+            self.ax.set_ylim(*limits)
+            self.on_xlim_changed(self.ax)
+            self.canvas.draw_idle()
+            return
+        if self.device_views:
+            self.layout_devices()
+            return
+        if self.ax is None or self.renderer is None:
+            return  # the plot of the single recorder takes them when it is created again
+        label, limits = plotAxis()
+        self.ax.set_ylabel(label)
+        self.ax.set_ylim(*limits)
+        for line in self.overlays:
+            line.set_ydata(displayVolts(line.volts))
+        if self.band is not None:
+            self.draw_statistics()
+        self.draw_mask()
+        self.canvas.draw()
+        self.after(10, self.calibration_applied, future)
+
+    def calibration_applied(self, future):
+        """ This method redraws the sweep when the serial worker converted it. During
+        a sweep plot() does that, the job waits for the end of the sweep """
+
+        if not future.done():
+            self.after(10, self.calibration_applied, future)
+            return
+        if self.renderer is not None and conversion != self.conversion:
+            self.conversion = conversion
+            version, sweep = samples.snapshot()
+            self.renderer.update(sweep['angle'], plotTraces(sweep), 0)   # the lines take the new values
+            self.canvas.draw()
+
+    def open_devices_window(self):
+        """ This method opens the window of several recorders"""
+
+        if manager is not None and self.fig is not None:
+            DevicesWindow(self)
+
+    def open_devices(self, ports):
+        """ This method opens the ports with the settings of the setup bar and
+        shows one subplot per open device instead of the single recorder plot"""
+
+        try:
+            manager.open(ports, baud_rate=baud_rate, speed=speed, steps=steps, timer=timer,
+                         channel_mask=channel_mask, binary_mode=binary_mode, calibration=calibration)
+        except ValueError as error:
+            print(error)
+            return
+        self.layout_devices()
+
+    def layout_devices(self):
+        """ This method creates a grid of subplots, one for every device, with a
+        blit renderer each. They share one timer"""
+
+        from Plot_Renderer import BlitRenderer
+
+        self.remove_axes()
+        rows, columns = subplot_grid(len(manager.devices))
+        axes = list(self.fig.subplots(rows, columns, squeeze=False, sharex=True, sharey=True).flat)
+        label, limits = storedAxis()
+        for ax, device in zip(axes, manager.devices):
+            ax.set(xlabel='Degree', ylabel=label)
+            ax.set_title(device.port, fontsize='small')
+            ax.set_xlim(left = 0, right = 180)
+            ax.set_ylim(*limits)
+            ax.grid()
+            ax.label_outer()
+            self.device_views.append({'device': device, 'renderer': BlitRenderer(ax, self.canvas),
+                                      'version': 0, 'first': device.samples.first})
+        for ax in axes[len(manager.devices):]:
+            ax.set_visible(False)
+        self.canvas.draw()
+        if self.device_timer is None:
+            self.plot_devices()
+
+    def plot_devices(self):
+        """ This method blits the samples which every device received since the
+        previous call. It is called by timer while devices are open"""
+
+        for view in self.device_views:
+            buffer = view['device'].samples
+            if buffer.first != view['first']:
+                # the device started a new sweep
+                view['first'] = buffer.first
+                view['renderer'].reset()
+            version, sweep = buffer.snapshot()
+            if version != view['version']:
+                values = calibration.from_volts(sweep['voltage'], storedUnit(display_unit))
+                view['renderer'].update(sweep['angle'], values, version - view['version'])
+                view['version'] = version
+
+        if self.device_views:
+            self.device_timer = self.parent.after(10, self.plot_devices)
+        else:
+            self.device_timer = None
+
+    def close_devices(self):
+        """ This method closes all devices and returns to the single recorder plot"""
+
+        manager.close()
+        if self.device_views:
+            self.restore_axes()
+
+    def restore_axes(self):
+        """ This method returns to the single recorder plot from the subplots of
+        the devices or from the continuous capture"""
+
+        if self.fig is not None and self.renderer is None:
+            self.remove_axes()
+            self.create_axes()
+
+    def continuousCapture(self):
+        """ This method queues treadContinuousCapture() for the serial worker. The
+        plot shows the last CONTINUOUS_WINDOW seconds until the user pans or zooms
+        with the toolbar; only the points which fit on the screen are fetched"""
+
+        global stop
+        global thread_flag
+        global capture
+
+        if thread_flag is True or self.fig is None or self.device_views:
+            return
+        stop = False
+        thread_flag = True
+        capture = None
+        self.remove_axes()
+        self.ax = self.fig.add_subplot()
+        label, limits = storedAxis()
+        self.ax.set(xlabel='Time, s', ylabel=label, title='Continuous capture')
+        self.ax.set_xlim(left = 0, right = CONTINUOUS_WINDOW)
+        self.ax.set_ylim(*limits)
         self.ax.grid()
+        self.continuous_line, = self.ax.plot([], [], color='C0', linewidth=0.8)
+        self.follow = True
+        self.ax.callbacks.connect('xlim_changed', self.on_xlim_changed)
         self.canvas.draw()
-        self.toolbar.update()
+        worker.submit(treadContinuousCapture)
+        if self.continuous_timer is None:
+            self.plot_continuous()
+
+    def plot_continuous(self):
+        """ This method moves the continuous plot to the newest samples while it
+        follows the capture. It is called by timer during the capture"""
+
+        running = thread_flag   # read first, so the last samples of the job are drawn
+
+        if capture is not None and self.continuous_line is not None:
+            if self.follow is True:
+                end = capture.end_time()
+                self.scrolling = True
+                self.ax.set_xlim(left = max(end - CONTINUOUS_WINDOW, 0), right = max(end, CONTINUOUS_WINDOW))
+                self.scrolling = False
+                self.canvas.draw_idle()
+            self.frame_label['text'] = 'Samples: %d' % len(capture)
+        self.pipeline_label['text'] = pipeline.text()
+
+        if running is True:
+            self.continuous_timer = self.parent.after(CONTINUOUS_PERIOD, self.plot_continuous)
+        else:
+            self.continuous_timer = None
 
-        if stop is True or thread_flag is False:
-            data_ADC = []
-            degree = []
+    def on_xlim_changed(self, ax):
+        """ This method fetches the level of detail of the new limits of the
+        continuous plot, about two points per pixel"""
+
+        if capture is None or self.continuous_line is None:
+            return
+        start, end = ax.get_xlim()
+        if self.scrolling is False:
+            # panned or zoomed by the user, the plot follows again when the newest sample is visible
+            self.follow = end >= capture.end_time()
+        time_, voltage = capture.fetch(start, end, 2 * int(ax.bbox.width))
+        self.continuous_line.set_data(time_, calibration.from_volts(voltage, storedUnit(display_unit)))
 
     def leftRotation(self):
-        """ This method creates and launches thread which calls threadLeftRotation()
-            for left rotation of the motor"""
+        """ This method queues the command for left rotation of the motor"""
 
         global stop
         stop = False
-        thread_lr = threading.Thread(target=threadLeftRotation,)
-        thread_lr.start()      
+        commandLeftRotation()
 
     def stop(self):
-        """ This method creates and launches thread which calls threadStop()
-            for stop of the motor"""
+        """ This method queues the command for stop of the motor"""
 
         global stop
         stop = True
-        thread_s = threading.Thread(target=threadStop,)
-        thread_s.start()
+        commandStop()
 
     def rightRotation(self):
-        """ This function creates and launches thread which calls threadRightRotation()
-            for right rotation of the motor"""
+        """ This function queues the command for right rotation of the motor"""
 
         global stop
         stop = False
-        thread_rr = threading.Thread(target=threadRightRotation,)
-        thread_rr.start()
+        commandRightRotation()
 
     def dataProcessing(self):
-        """ This method creates and launches thread which calls treadDataProcessing()
+        """ This method queues treadDataProcessing() for the serial worker
             for input data processing"""
 
         global stop
         global thread_flag
         global motorState
         global currentMotorState
+        global sweep_number
 
         if (stop is False and thread_flag is False) and \
            (currentMotorState == motorState["ACTIVE_L"] or currentMotorState == motorState["ACTIVE_R"]):
-            thread_l = threading.Thread(target=treadDataProcessing,)
-            thread_l.start()
+            if self.continuous_line is not None:
+                self.restore_axes()
+            samples.clear()
+            self.remove_statistics()
+            if self.renderer is not None:
+                self.renderer.reset()
+            self.sweep = 0
+            sweep_number = 0
             thread_flag = True
+            worker.submit(treadDataProcessing)
             self.plot()
 
     def _quit(self):
         """Stops motor, closes com port and quits from program"""
         
-        cmd = b'0'
-        if ser.isOpen() is False:
-            ser.open()
-
-        ser.readline()
-        ser.write(cmd)
-        ser.close()  
+        global stop
+        stop = True    # the running job ends, so the port is closed after it
+        commandStop()
+        worker.close()
+        manager.close()
         self.master.quit()     # stops mainloop
         self.master.destroy()  # this is necessary on Windows to prevent
                                # Fatal Python Error: PyEval_RestoreThread: NULL tstate    
@@ -369,26 +1754,40 @@ class WorkSpace(tkinter.Frame):
     def client_exit(self):
         """Stops motor, closes com port and quits from program"""
         
-        cmd = b'0'
-        if ser.isOpen() is False:
-            ser.open()
-
-        ser.readline()
-        ser.write(cmd)
-        ser.close()
+        global stop
+        stop = True    # the running job ends, so the port is closed after it
+        commandStop()
+        worker.close()
+        manager.close()
         exit()    
  
 def main():
     # root window created. Here, that would be the only window, but
     # you can later have windows within windows.
+    global library
+    global manager
+    global profiles
+
+    os.makedirs(session_directory, exist_ok=True)
+    profiles = load_profiles(CALIBRATION_DIRECTORY)
+    library = PatternLibrary(os.path.join(session_directory, LIBRARY_NAME))
+    manager = AcquisitionManager(session_directory, library)
     serial_port_init()
     root = tkinter.Tk()
+    # sessions of Data_Recorder.py and of crashed runs, when the window is shown
+    root.after_idle(library.scan, session_directory)
     
 
     #creation of an instance
     app1 = SetupBar(root)
     app1.pack(side=tkinter.LEFT)
     app1.config(relief=tkinter.GROOVE, bd=2)
+    # the boards boot for a while after the ports are opened, see SetupBar.connect()
+    root.after_idle(app1.connect)
+
+    app3 = DiagnosticsPanel(root)
+    app3.pack(side=tkinter.LEFT)
+    app3.config(relief=tkinter.GROOVE, bd=2)
     
     app2 = WorkSpace(root)
     app2.pack(side=tkinter.LEFT)
@@ -0,0 +1,335 @@
+""" Golden-reference pass/fail check of antenna patterns for production QA.
+
+A reference is the pattern of a known-good antenna on the uniform angle grid,
+in dBm of the detector calibration, with a tolerance mask: lower and upper
+limits at every angle. The limits are the lowest and the highest level of
+the reference within +-`window` degrees, widened by `tolerance` dB, so the
+steep slopes next to nulls do not fail a unit for a fraction of a degree.
+Nulls and the noise floor differ from unit to unit, so more than `floor` dB
+below the peak a point only has to stay under the floor plus the tolerance.
+A reference is built from a recorded session and kept as .npz:
+
+    python Golden_Reference.py sessions/session_20200101_120000.aps --tolerance 3 --window 2 --output golden.npz
+
+While the sweep of a unit comes in, GoldenCheck aligns it to the reference,
+which absorbs the offset of its start angle, and checks the new grid points
+against the mask, so a failed unit is known as soon as one point is out.
+QALog appends one line per unit to a CSV file and counts units per hour.
+"""
+
+import argparse
+import csv
+import os
+import threading
+import time
+
+import numpy as np
+
+import Metrics
+from Angle_Model import GRID_STEP, TRAVEL_DEGREES
+from Session_File import EXTENSION, open_session
+from Calibration import CalibrationProfile, lookup_table, DEFAULT_PROFILE
+
+
+REFERENCE_EXTENSION = '.npz'
+TOLERANCE = 3.0         # dB above and below the reference
+WINDOW = 2.0            # degrees, angular tolerance of the mask
+FLOOR = 20.0            # dB below the peak where only the upper limit applies, about 10 ADC counts
+MAX_OFFSET = 10.0       # degrees, largest offset of the start angle of a unit
+MIN_COVERAGE = 20.0     # degrees of a sweep before it is aligned and checked
+SLACK = 3.0             # degrees of the reference a complete sweep may miss
+QA_LOG_NAME = 'qa_log.csv'
+
+QA_UNITS = Metrics.counter('qa_units_total', 'Units checked against the golden reference')
+QA_FAILED = Metrics.counter('qa_failed_units_total', 'Units which failed the golden reference check')
+
+
+class GoldenReference:
+    """ Pattern of a known-good antenna in dBm on the angle grid and its
+    tolerance mask. Point k is at angle k * step """
+
+    def __init__(self, name, level, low, high, step=GRID_STEP, calibration=DEFAULT_PROFILE.name):
+
+        self.name = name
+        self.level = np.asarray(level, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)     # -inf where only the upper limit applies
+        self.high = np.asarray(high, dtype=np.float64)
+        self.step = float(step)
+        self.calibration = calibration  # profile of the dBm of the reference
+
+    @property
+    def angle(self):
+        return np.arange(len(self.level)) * self.step
+
+    @classmethod
+    def from_level(cls, name, level, tolerance=TOLERANCE, floor=FLOOR, window=WINDOW, step=GRID_STEP, **kwargs):
+        """ Reference with a mask of +-`tolerance` dB and +-`window` degrees down to
+        `floor` dB below the peak """
+
+        level = np.asarray(level, dtype=np.float64)
+        width = int(round(window / step))
+        windows = np.lib.stride_tricks.sliding_window_view(np.pad(level, width, mode='edge'), 2 * width + 1)
+        bottom = level.max() - floor
+        low = windows.min(axis=1)
+        low = np.where(low >= bottom, low - tolerance, -np.inf)
+        high = np.maximum(windows.max(axis=1), bottom) + tolerance
+        return cls(name, level, low, high, step, **kwargs)
+
+    @classmethod
+    def from_session(cls, path, table, tolerance=TOLERANCE, floor=FLOOR, window=WINDOW, step=GRID_STEP,
+                     travel=TRAVEL_DEGREES):
+        """ Reference of a recorded sweep: samples are converted with the lookup
+        table and averaged in bins of the grid, empty bins are interpolated """
+
+        header, records = open_session(path)
+        angle = np.asarray(records['angle'], dtype=np.float64)
+        level = table.convert(np.asarray(records['adc']), 'dBm')
+        size = int(round(travel / step)) + 1
+        index = np.rint(angle / step)
+        inside = np.isfinite(index) & (index >= 0) & (index < size)
+        index = index[inside].astype(np.intp)
+        count = np.bincount(index, minlength=size)
+        if not count.any():
+            raise ValueError('%s has no samples between 0 and %g degrees' % (path, travel))
+        total = np.bincount(index, weights=level[inside], minlength=size)
+        grid = np.arange(size)
+        filled = count > 0
+        level = np.interp(grid, grid[filled], total[filled] / count[filled])
+        name = header['metadata'].get('antenna_id') or os.path.splitext(os.path.basename(path))[0]
+        return cls.from_level(name, level, tolerance, floor, window, step, calibration=table.name)
+
+    @classmethod
+    def from_file(cls, path):
+
+        with np.load(path) as data:
+            return cls(str(data['name']), data['level'], data['low'], data['high'],
+                       float(data['step']), str(data['calibration']))
+
+    def save(self, path):
+
+        np.savez(path, name=self.name, level=self.level, low=self.low, high=self.high,
+                 step=self.step, calibration=self.calibration)
+
+
+def load_reference(path, table, tolerance=TOLERANCE, floor=FLOOR, window=WINDOW):
+    """ Reference of a .npz file or of a session file with a new mask """
+
+    if path.endswith(EXTENSION):
+        return GoldenReference.from_session(path, table, tolerance, floor, window)
+    return GoldenReference.from_file(path)
+
+
+def _correlate(a, b, size, lags):
+    """ sum(a[i] * b[i + k]) for k = -lags ... lags, by FFT of `size` points """
+
+    spectrum = np.conj(np.fft.rfft(a, size)) * np.fft.rfft(b, size)
+    result = np.fft.irfft(spectrum, size)
+    return np.concatenate((result[size - lags:], result[:lags + 1]))
+
+
+def align(level, reference, lags, min_points=1):
+    """ Shift k of the reference which fits a partial sweep best: level[i] is
+    compared with reference[i + k]. The mean squared difference over the
+    overlapping points of every shift up to `lags` comes from four FFT
+    cross-correlations at once, missing points (NaN) have weight 0. It
+    returns the shift and its mean squared difference in dB^2 """
+
+    weight = ~np.isnan(level)
+    level = np.where(weight, level, 0.0)
+    weight = weight.astype(np.float64)
+    size = 1 << int(np.ceil(np.log2(len(reference) + lags + 1)))
+    ones = np.ones(len(reference))
+
+    count = np.rint(_correlate(weight, ones, size, lags))
+    squares = _correlate(level * level, ones, size, lags) - 2 * _correlate(level, reference, size, lags) + \
+              _correlate(weight, reference * reference, size, lags)
+    error = np.where(count >= max(min_points, 1), squares / np.maximum(count, 1), np.inf)
+    best = int(np.argmin(error))
+    return best - lags, max(float(error[best]), 0.0)
+
+
+class GoldenCheck:
+    """ Pass/fail check of the sweep of one unit while it is received.
+
+    Grid points come in any order (see Angle_Model.GridResampler). After
+    `min_coverage` degrees every chunk aligns the sweep so far to the
+    reference and checks only the points which are not checked yet against
+    the mask; the whole sweep is checked again only when the alignment
+    changes. Points which the shift moves out of the reference are not
+    checked. The unit fails when more than `allowed` points are out, it
+    passes only when the aligned sweep covers the reference but `slack`
+    degrees and the offset.
+    """
+
+    def __init__(self, reference, max_offset=MAX_OFFSET, min_coverage=MIN_COVERAGE, allowed=0, slack=SLACK):
+
+        self.reference = reference
+        self.lags = int(round(max_offset / reference.step))
+        self.min_points = int(round(min_coverage / reference.step)) + 1
+        self.slack = int(round(slack / reference.step))
+        self.allowed = allowed
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+
+        with self.lock:
+            size = len(self.reference.level)
+            self.level = np.full(size, np.nan)  # dBm of the received grid points
+            self.points = 0
+            self.shift = None       # grid steps, None until the sweep is aligned
+            self.error = None       # rms difference to the reference in dB
+            self._restart()
+
+    def _restart(self):
+
+        self.checked = np.zeros(len(self.level), dtype=bool)
+        self.outside = np.zeros(len(self.level), dtype=bool)
+        self.margin = np.inf    # dB to the nearest limit, negative outside the mask
+        self.worst = None       # grid index of the sweep with the least margin
+
+    @property
+    def failed(self):
+        return int(np.count_nonzero(self.outside)) > self.allowed
+
+    @property
+    def complete(self):
+        """ True when the aligned sweep covers the reference but the slack """
+
+        if self.shift is None:
+            return False
+        size = len(self.level)
+        received = np.flatnonzero(~np.isnan(self.level)) + self.shift
+        overlap = np.count_nonzero((received >= 0) & (received < size))
+        return overlap >= size - abs(self.shift) - self.slack
+
+    def add(self, grid, level):
+        """ It takes new grid points of the sweep, angles and dBm. It returns
+        True as soon as the unit failed """
+
+        index = np.rint(np.asarray(grid) / self.reference.step).astype(np.intp)
+        inside = (index >= 0) & (index < len(self.level))
+        with self.lock:
+            self.level[index[inside]] = np.asarray(level, dtype=np.float64)[inside]
+            self.points = int(np.count_nonzero(~np.isnan(self.level)))
+            if self.points < self.min_points:
+                return False
+            shift, error = align(self.level, self.reference.level, self.lags, self.min_points)
+            self.error = np.sqrt(error)
+            if shift != self.shift:
+                self.shift = shift
+                self._restart()
+            self._check(np.flatnonzero(~np.isnan(self.level) & ~self.checked))
+            return self.failed
+
+    def _check(self, index):
+
+        self.checked[index] = True
+        target = index + self.shift
+        valid = (target >= 0) & (target < len(self.level))
+        index = index[valid]
+        target = target[valid]
+        if len(index) == 0:
+            return
+        level = self.level[index]
+        margin = np.minimum(level - self.reference.low[target], self.reference.high[target] - level)
+        self.outside[index] = margin < 0
+        least = int(np.argmin(margin))
+        if margin[least] < self.margin:
+            self.margin = float(margin[least])
+            self.worst = int(index[least])
+
+    def result(self):
+        """ Verdict of the sweep so far: 'FAIL', 'PASS' when it is complete or
+        'INCOMPLETE', with the offset of the start angle, the rms difference
+        and the least margin to the mask in dB and the angle of the worst point """
+
+        with self.lock:
+            if self.shift is not None and self.failed:
+                verdict = 'FAIL'
+            elif self.complete:
+                verdict = 'PASS'
+            else:
+                verdict = 'INCOMPLETE'
+            step = self.reference.step
+            return {
+                'result': verdict,
+                'offset': None if self.shift is None else self.shift * step,
+                'rms_error': self.error,
+                'margin': None if self.shift is None or np.isinf(self.margin) else self.margin,
+                'worst_angle': None if self.worst is None else self.worst * step,
+                'outside': int(np.count_nonzero(self.outside)),
+                'coverage': self.points * step,
+            }
+
+
+class QALog:
+    """ One CSV line per checked unit and the throughput of the line since
+    the log was opened """
+
+    FIELDS = ('time', 'unit', 'reference', 'result', 'offset', 'rms_error', 'margin', 'worst_angle',
+              'outside', 'coverage', 'duration', 'session')
+
+    def __init__(self, path):
+
+        self.path = path
+        self.start = time.time()
+        self.units = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+        if not os.path.exists(path):
+            with open(path, 'w', newline='') as file:
+                csv.writer(file).writerow(self.FIELDS)
+
+    def add(self, unit, reference, result, duration, session=''):
+        """ It logs the result of GoldenCheck.result() of one unit """
+
+        def number(value):
+            return '' if value is None else '%.2f' % value
+
+        row = [time.strftime('%Y-%m-%d %H:%M:%S'), unit, reference, result['result'],
+               number(result['offset']), number(result['rms_error']), number(result['margin']),
+               number(result['worst_angle']), result['outside'], number(result['coverage']),
+               '%.1f' % duration, session]
+        with self.lock:
+            with open(self.path, 'a', newline='') as file:
+                csv.writer(file).writerow(row)
+            self.units += 1
+            self.failed += result['result'] == 'FAIL'
+        QA_UNITS.inc()
+        if result['result'] == 'FAIL':
+            QA_FAILED.inc()
+
+    def units_per_hour(self):
+
+        elapsed = time.time() - self.start
+        return self.units * 3600 / elapsed if elapsed > 0 else 0.0
+
+    def text(self):
+
+        return '%d units, %d failed, %.0f units/h' % (self.units, self.failed, self.units_per_hour())
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Golden reference of antenna patterns from a recorded sweep')
+    parser.add_argument('session', help='session file of a known-good antenna (%s)' % EXTENSION)
+    parser.add_argument('--output', help='reference file (%s), next to the session by default' % REFERENCE_EXTENSION)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='dB above and below the reference')
+    parser.add_argument('--floor', type=float, default=FLOOR,
+                        help='dB below the peak where only the upper limit applies')
+    parser.add_argument('--window', type=float, default=WINDOW, help='angular tolerance in degrees')
+    parser.add_argument('--calibration', help='calibration profile of the detector (.json)')
+    args = parser.parse_args()
+
+    profile = CalibrationProfile.from_file(args.calibration) if args.calibration else DEFAULT_PROFILE
+    reference = GoldenReference.from_session(args.session, lookup_table(profile), args.tolerance, args.floor,
+                                             args.window)
+    output = args.output or os.path.splitext(args.session)[0] + REFERENCE_EXTENSION
+    reference.save(output)
+    print('Reference %s: peak %.1f dBm at %.0f degrees -> %s' % (
+        reference.name, reference.level.max(), reference.angle[np.argmax(reference.level)], output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+""" Runtime metrics of the recorder: counters, gauges and timing histograms.
+
+Metrics are created once at import of the instrumented module and updated
+on the hot path, which costs a fraction of a microsecond. The registry is
+read by the diagnostics panel of the GUI and can be written to a file:
+
+    import Metrics
+    READS = Metrics.counter('serial_reads_total', 'Reads of the serial port')
+    READS.inc()
+    Metrics.REGISTRY.dump('metrics.json')   # or 'metrics.prom' for Prometheus text
+"""
+
+import functools
+import json
+import threading
+import time
+
+import numpy as np
+
+from Pipeline_Stats import Histogram
+
+
+class Counter:
+    """ Number of events since the start, it never decreases """
+
+    kind = 'counter'
+
+    def __init__(self, name, help=''):
+
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        return {'type': self.kind, 'value': self.value}
+
+
+class Gauge:
+    """ Current value of something. A gauge with a `function` calls it when it
+    is read, so values which already exist elsewhere are not copied """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help='', function=None):
+
+        self.name = name
+        self.help = help
+        self.function = function
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception:
+                return None
+        return self.value
+
+    def snapshot(self):
+        return {'type': self.kind, 'value': self.get()}
+
+
+class Timing:
+    """ Histogram of durations in seconds, e.g. of every read of the serial port """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help=''):
+
+        self.name = name
+        self.help = help
+        self.histogram = Histogram()
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+
+        with self.lock:
+            self.histogram.add_one(seconds)
+
+    def time(self):
+        """ Context manager which observes the time of its block """
+
+        return _TimingBlock(self)
+
+    def snapshot(self):
+
+        snapshot = self.histogram.summary()
+        snapshot['type'] = self.kind
+        snapshot['sum'] = self.histogram.total
+        return snapshot
+
+
+class _TimingBlock:
+
+    __slots__ = ('timing', 'start')
+
+    def __init__(self, timing):
+        self.timing = timing
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.timing.observe(time.perf_counter() - self.start)
+
+
+class MetricsRegistry:
+    """ All metrics of the process by name. Asking for an existing name returns
+    the existing metric, so modules can share one """
+
+    def __init__(self):
+
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help, **kwargs):
+
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError("Metric %s is a %s" % (name, metric.kind))
+            return metric
+
+    def counter(self, name, help=''):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help='', function=None):
+
+        gauge = self._get(Gauge, name, help)
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def timing(self, name, help=''):
+        return self._get(Timing, name, help)
+
+    def snapshot(self):
+        """ Values of all metrics, sorted by name """
+
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        return {name: metric.snapshot() for name, metric in metrics}
+
+    def to_json(self):
+        return json.dumps({'time': time.time(), 'metrics': self.snapshot()}, indent=2)
+
+    def to_prometheus(self):
+        """ Text exposition format of Prometheus. Histograms get the buckets
+        whose counts change, which keeps the file short """
+
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        lines = []
+        for name, metric in metrics:
+            lines.append('# HELP %s %s' % (name, metric.help))
+            lines.append('# TYPE %s %s' % (name, metric.kind))
+            if metric.kind == 'histogram':
+                histogram = metric.histogram
+                counts = histogram.counts.copy()
+                cumulative = np.cumsum(counts)
+                for index in np.flatnonzero(counts[:-1]):
+                    lines.append('%s_bucket{le="%g"} %d' % (name, histogram.edges[index], cumulative[index]))
+                lines.append('%s_bucket{le="+Inf"} %d' % (name, cumulative[-1]))
+                lines.append('%s_sum %r' % (name, histogram.total))
+                lines.append('%s_count %d' % (name, cumulative[-1]))
+            else:
+                value = metric.snapshot()['value']
+                lines.append('%s %s' % (name, 'NaN' if value is None else repr(value)))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """ It writes the metrics as JSON (.json) or as Prometheus text (any other extension) """
+
+        text = self.to_json() if path.endswith('.json') else self.to_prometheus()
+        with open(path, 'w') as file:
+            file.write(text)
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, help=''):
+    return REGISTRY.counter(name, help)
+
+
+def gauge(name, help='', function=None):
+    return REGISTRY.gauge(name, help, function)
+
+
+def timing(name, help=''):
+    return REGISTRY.timing(name, help)
+
+
+def timed(name, help=''):
+    """ Decorator which observes the time of every call of the function """
+
+    metric = timing(name, help)
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
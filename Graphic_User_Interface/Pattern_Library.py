@@ -0,0 +1,157 @@
+import glob
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from Session_File import EXTENSION, open_session, read_header, recover_session
+
+
+LIBRARY_NAME = 'library.sqlite'
+STALE_TIME = 60.0   # s without writes after which an unfinished session is recovered
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    start_time REAL,
+    antenna_id TEXT,
+    frequency REAL,
+    samples INTEGER,
+    peak_voltage REAL,
+    peak_angle REAL,
+    mean_voltage REAL,
+    min_voltage REAL,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_start_time ON sessions (start_time);
+CREATE INDEX IF NOT EXISTS sessions_antenna ON sessions (antenna_id, start_time);
+CREATE INDEX IF NOT EXISTS sessions_frequency ON sessions (frequency);
+"""
+
+
+class PatternLibrary:
+    """ Catalog of recorded sweeps. Metadata and summary statistics of every
+    session file are kept in SQLite, so sweeps are found without opening their
+    files. Sweeps loaded for plotting are kept in a small LRU cache """
+
+    def __init__(self, path, cache_size=64):
+
+        self.path = path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()    # sweeps are added by the serial worker
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def add(self, session_path):
+        """ It adds a session file to the catalog or updates it. It returns the id """
+
+        header, records = open_session(session_path)
+        metadata = header.get('metadata', {})
+        voltage = records['voltage']
+
+        row = {
+            'path': os.path.abspath(session_path),
+            'start_time': header.get('start_time'),
+            'antenna_id': metadata.get('antenna_id') or None,
+            'frequency': metadata.get('frequency') or None,
+            'samples': len(records),
+            'peak_voltage': None,
+            'peak_angle': None,
+            'mean_voltage': None,
+            'min_voltage': None,
+            'metadata': json.dumps(metadata),
+        }
+        if len(records) > 0:
+            peak = int(np.argmax(voltage))
+            row.update(peak_voltage=float(voltage[peak]),
+                       peak_angle=float(records['angle'][peak]),
+                       mean_voltage=float(voltage.mean()),
+                       min_voltage=float(voltage.min()))
+
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT OR REPLACE INTO sessions (%s) VALUES (%s)" %
+                (', '.join(row), ', '.join(':' + name for name in row)), row)
+        self.cache.pop(row['path'], None)
+        return cursor.lastrowid
+
+    def scan(self, directory):
+        """ It adds every session file of the directory which is not in the catalog yet.
+        Sessions which were not closed (crash, USB disconnect) and are not written
+        any more are recovered first. Files which cannot be read are skipped.
+        It returns the number of added files """
+
+        with self.lock:
+            known = {path for path, in self.connection.execute("SELECT path FROM sessions")}
+        added = 0
+        for path in sorted(glob.glob(os.path.join(directory, '*' + EXTENSION))):
+            if os.path.abspath(path) not in known:
+                try:
+                    if (not read_header(path)['finished'] and
+                            time.time() - os.path.getmtime(path) > STALE_TIME):
+                        recover_session(path)
+                    self.add(path)
+                except (OSError, ValueError, KeyError, struct.error):
+                    continue    # not a session file, truncated or still being written
+                added += 1
+        return added
+
+    def query(self, start=None, end=None, antenna_id=None, frequency=None,
+              tolerance=0.0, limit=None):
+        """ It returns catalog rows matching all given conditions, newest first.
+        start and end are Unix times, frequency matches within the tolerance """
+
+        conditions = []
+        parameters = []
+        if start is not None:
+            conditions.append("start_time >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("start_time < ?")
+            parameters.append(end)
+        if antenna_id:
+            conditions.append("antenna_id = ?")
+            parameters.append(antenna_id)
+        if frequency is not None:
+            conditions.append("frequency BETWEEN ? AND ?")
+            parameters += [frequency - tolerance, frequency + tolerance]
+
+        sql = "SELECT * FROM sessions"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY start_time DESC"
+        if limit is not None:
+            sql += " LIMIT %d" % int(limit)
+
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def load(self, path):
+        """ It returns angle and voltage arrays of a sweep. Recently used sweeps
+        come from memory, others are read from their session files """
+
+        if path in self.cache:
+            self.cache.move_to_end(path)
+            return self.cache[path]
+
+        header, records = open_session(path)
+        sweep = (np.array(records['angle']), np.array(records['voltage']))
+        del records
+
+        self.cache[path] = sweep
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return sweep
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,157 @@
+import threading
+
+import numpy as np
+
+from Angle_Model import GRID_STEP, TRAVEL_DEGREES
+
+
+NULL_HYSTERESIS = 1.0       # dB, a null ends when the pattern rises this much above it
+
+
+class PatternMetrics:
+    """ Metrics of a sweep which are updated while the sweep is received:
+    peak level and direction, half-power (-3 dB) beamwidth, sidelobe level and
+    front-to-back ratio.
+
+    Samples come on the uniform angle grid (see Angle_Model.GridResampler).
+    Every search keeps its position, so a chunk is only compared with the
+    running peak, the half-power level and the running sidelobe maximum.
+    Everything is searched again only when the peak moves, which happens
+    at the start of a sweep. The detector output is proportional to power
+    unless power=False.
+    """
+
+    def __init__(self, step=GRID_STEP, travel=TRAVEL_DEGREES, power=True, hysteresis=NULL_HYSTERESIS):
+
+        self.step = step
+        self.size = int(round(travel / step)) + 1
+        self.decibel = 10 if power else 20
+        self.half = 0.5 if power else np.sqrt(0.5)     # -3 dB level relative to the peak
+        self.rise = 10 ** (hysteresis / self.decibel)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+
+        with self.lock:
+            self.values = np.full(self.size, np.nan)
+            self.low = self.size    # received grid points are low..high
+            self.high = -1
+            self.peak = -1
+            self._restart()
+
+    def _restart(self):
+        """ Searches of both sides of a new peak """
+
+        self.sides = {side: {
+            'position': self.peak,  # next grid point which is not searched yet
+            'crossing': None,       # angle of the -3 dB crossing
+            'minimum': np.inf,      # running minimum after the crossing
+            'minimum_index': None,
+            'null': None,           # grid point of the first null
+            'sidelobe': -np.inf,    # maximum beyond the null
+        } for side in (-1, 1)}
+
+    def add(self, angle, value):
+        """ It adds grid points of the sweep in any order of angles """
+
+        index = np.rint(np.asarray(angle, dtype=float) / self.step).astype(np.intp)
+        value = np.asarray(value, dtype=float)
+        inside = (index >= 0) & (index < self.size)
+        index = index[inside]
+        value = value[inside]
+        if len(index) == 0:
+            return
+
+        with self.lock:
+            self.values[index] = value
+            self.low = min(self.low, int(index.min()))
+            self.high = max(self.high, int(index.max()))
+
+            top = int(np.argmax(value))
+            if self.peak < 0 or value[top] > self.values[self.peak]:
+                self.peak = int(index[top])
+                self._restart()
+
+            for side in (-1, 1):
+                self._search(side)
+
+    def _search(self, side):
+        """ It continues the search of the crossing, the null and the sidelobe on
+        one side of the peak over the grid points received since the last call """
+
+        state = self.sides[side]
+        edge = self.high if side > 0 else self.low
+        start = state['position'] + side
+        if (edge - start) * side < 0:
+            return
+        span = np.arange(start, edge + side, side)
+        window = self.values[span]
+        state['position'] = edge
+        peak = self.values[self.peak]
+
+        if state['crossing'] is None:
+            level = peak * self.half
+            below = np.flatnonzero(window < level)
+            if len(below) == 0:
+                return
+            first = below[0]
+            # linear interpolation between the crossing point and its neighbour towards the peak
+            inner = self.values[span[first] - side]
+            fraction = (inner - level) / (inner - window[first]) if inner != window[first] else 1.0
+            state['crossing'] = (span[first] - side + side * fraction) * self.step
+            span = span[first:]
+            window = window[first:]
+
+        if state['null'] is None:
+            running = np.minimum.accumulate(np.concatenate(([state['minimum']], window)))[1:]
+            rising = np.flatnonzero(window > running * self.rise)
+            end = rising[0] if len(rising) > 0 else len(window)
+            if end > 0 and window[:end].min() < state['minimum']:
+                lowest = int(np.argmin(window[:end]))
+                state['minimum'] = window[lowest]
+                state['minimum_index'] = int(span[lowest])
+            if len(rising) == 0:
+                return
+            state['null'] = state['minimum_index']
+            span = span[end:]
+            window = window[end:]
+
+        if len(window) > 0:
+            state['sidelobe'] = max(state['sidelobe'], float(window.max()))
+
+    def result(self):
+        """ It returns the metrics, levels in volts, angles in degrees and ratios
+        in dB. Metrics which are not known yet are None """
+
+        with self.lock:
+            if self.peak < 0:
+                return {'peak': None, 'peak_angle': None, 'beamwidth': None,
+                        'half_power_angles': None, 'sidelobe_level': None, 'front_to_back': None}
+            peak = float(self.values[self.peak])
+            left = self.sides[-1]
+            right = self.sides[1]
+            sidelobe = max(left['sidelobe'], right['sidelobe'])
+            opposite = int(round(180 / self.step))
+            back = self.peak + opposite if self.peak + opposite <= self.high else self.peak - opposite
+            back = self.values[back] if self.low <= back <= self.high else np.nan
+
+        def ratio(level):
+            if not level > 0 or not peak > 0:
+                return None
+            return float(self.decibel * np.log10(level / peak))
+
+        crossings = None
+        beamwidth = None
+        if left['crossing'] is not None and right['crossing'] is not None:
+            crossings = (float(left['crossing']), float(right['crossing']))
+            beamwidth = crossings[1] - crossings[0]
+        front_to_back = ratio(back)
+        return {
+            'peak': peak,
+            'peak_angle': self.peak * self.step,
+            'beamwidth': beamwidth,
+            'half_power_angles': crossings,
+            'sidelobe_level': ratio(sidelobe),
+            'front_to_back': -front_to_back if front_to_back is not None else None,
+        }
@@ -0,0 +1,161 @@
+import bisect
+
+import numpy as np
+
+
+HISTOGRAM_LOW = 1e-5    # s, the first bin holds everything shorter
+HISTOGRAM_HIGH = 10.0   # s, the last bin holds everything longer
+BINS_PER_DECADE = 20
+
+
+class Histogram:
+    """ Histogram of durations with logarithmic bins. Adding is vectorized and
+    the memory does not grow with the number of values. There must be one
+    writer; readers on other threads may see a value missing in the sums """
+
+    def __init__(self, low=HISTOGRAM_LOW, high=HISTOGRAM_HIGH, bins_per_decade=BINS_PER_DECADE):
+
+        number = int(round(np.log10(high / low) * bins_per_decade))
+        self.edges = low * 10 ** (np.arange(number + 1) / bins_per_decade)
+        self.edge_list = self.edges.tolist()    # for add_one(), bisect is faster than numpy for one value
+        self.reset()
+
+    def reset(self):
+
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, values, weight=1):
+        """ It adds durations in seconds, every one `weight` times """
+
+        values = np.atleast_1d(values)
+        if len(values) == 0:
+            return
+        index = np.searchsorted(self.edges, values)
+        self.counts += np.bincount(index, minlength=len(self.counts)) * weight
+        self.total += float(values.sum()) * weight
+        self.maximum = max(self.maximum, float(values.max()))
+
+    def add_one(self, value):
+        """ It adds one duration, it is cheap enough for every call of a hot function """
+
+        self.counts[bisect.bisect_left(self.edge_list, value)] += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+
+    def count(self):
+        return int(self.counts.sum())
+
+    def mean(self):
+
+        count = self.count()
+        return self.total / count if count > 0 else None
+
+    def percentile(self, q):
+        """ Upper edge of the bin of the q-th percentile, or None without values """
+
+        cumulative = np.cumsum(self.counts)
+        if cumulative[-1] == 0:
+            return None
+        index = int(np.searchsorted(cumulative, q / 100 * cumulative[-1]))
+        if index >= len(self.edges):
+            return self.maximum
+        return min(float(self.edges[index]), self.maximum)
+
+    def summary(self):
+        """ Count, mean, median, 99th percentile and maximum in milliseconds """
+
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+
+        return {
+            'count': self.count(),
+            'mean_ms': ms(self.mean()),
+            'p50_ms': ms(self.percentile(50)),
+            'p99_ms': ms(self.percentile(99)),
+            'max_ms': ms(self.maximum if self.count() > 0 else None),
+        }
+
+
+class PipelineStats:
+    """ Health of the acquisition pipeline during one run (a batch of sweeps or
+    a continuous capture). Losses are counted where they happen:
+
+    - parse failures, sequence gaps, lost and duplicated frames by the reader,
+    - errors of the serial port by the reading job,
+    - overruns of the display buffer (samples overwritten before they were
+      drawn) by the plot.
+
+    There are two histograms: `interval`, the time per sample between reads
+    which returned samples (about the Timer1 period when nothing stalls), and
+    `latency`, the time from the read of a sample to its appearance on the
+    screen. The reading job and the plot are the only writers of their fields """
+
+    def __init__(self, reader=None):
+
+        self.interval = Histogram()
+        self.latency = Histogram()
+        self.reset(reader)
+
+    def reset(self, reader=None):
+        """ It starts a new run, counters of the reader are taken as they are """
+
+        self.reader = reader
+        self.samples = 0
+        self.reads = 0
+        self.serial_errors = 0
+        self.overruns = 0
+        self.last_read = None   # time of the last read which returned samples
+        self.interval.reset()
+        self.latency.reset()
+
+    def add_read(self, count, received):
+        """ It is called by the reading job after every read which returned
+        `count` samples at `received` (seconds of time.perf_counter) """
+
+        self.reads += 1
+        if count == 0:
+            return
+        if self.last_read is not None:
+            self.interval.add((received - self.last_read) / count, count)
+        self.last_read = received
+        self.samples += count
+
+    def add_shown(self, received, shown):
+        """ It is called by the plot with the read times of the samples which
+        it has just drawn at `shown` """
+
+        self.latency.add(shown - np.asarray(received))
+
+    def counters(self):
+
+        reader = self.reader
+        return {
+            'samples': self.samples,
+            'reads': self.reads,
+            'parse_failures': getattr(reader, 'malformed', 0),
+            'gaps': getattr(reader, 'gaps', 0),
+            'lost': getattr(reader, 'lost', 0),
+            'duplicates': getattr(reader, 'duplicates', 0),
+            'skipped_bytes': getattr(reader, 'skipped_bytes', 0),
+            'serial_errors': self.serial_errors,
+            'overruns': self.overruns,
+        }
+
+    def summary(self):
+        """ Counters and histograms, it is stored in the metadata of sessions """
+
+        summary = self.counters()
+        summary.update(interval=self.interval.summary(), latency=self.latency.summary())
+        return summary
+
+    def text(self):
+        """ One line for the status of the window """
+
+        counters = self.counters()
+        latency = self.latency.percentile(99)
+        return 'Lost: %d  Dup: %d  Bad: %d  Overruns: %d  Latency p99: %s' % (
+            counters['lost'], counters['duplicates'], counters['parse_failures'], counters['overruns'],
+            '-' if latency is None else '%.1f ms' % (latency * 1000))
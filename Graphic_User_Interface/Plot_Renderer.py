@@ -0,0 +1,140 @@
+import time
+from collections import deque
+
+from matplotlib.lines import Line2D
+
+import Metrics
+
+FRAME_TIME = Metrics.timing('plot_frame_seconds', 'Time of one frame of a live plot')
+FULL_REDRAWS = Metrics.counter('plot_full_redraws_total', 'Full redraws of the axes of live plots')
+
+
+class SourceLine(Line2D):
+    """ Line2D which takes its data only when it is really drawn. Line2D copies
+    the data in set_data(), so doing that on every tick would cost as much as
+    the whole sweep """
+
+    source = None
+
+    def draw(self, renderer):
+        if self.source is not None:
+            self.set_data(*self.source)
+            self.source = None
+        super().draw(renderer)
+
+
+class BlitRenderer:
+    """ Incremental renderer for the live antenna pattern plot.
+
+    It keeps one persistent Line2D with all samples (drawn only on full
+    redraws such as resize, pan or zoom) and caches the static background
+    of the axes. Every tick restores the background, draws only the segment
+    received since the previous tick and blits the axes. The result becomes
+    the next background, so the cost of a tick does not depend on the number
+    of points which are already on the screen.
+
+    Several traces (e.g. the channels of a multi-channel recorder) share the
+    background and the blit, each one has its own pair of lines.
+    """
+
+    def __init__(self, ax, canvas, traces=1, labels=(), **line_kw):
+
+        self.ax = ax
+        self.canvas = canvas
+        self.line_kw = line_kw
+        self._add_lines(traces, labels)
+
+        self.background = None
+        self.pending = 0    # number of samples which are not in self.background yet
+        self.frame_time = 0.0
+        self.frame_times = deque(maxlen=100)
+
+        self.draw_id = self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def _add_lines(self, traces, labels):
+
+        self.lines = []
+        self.tails = []
+        for trace in range(traces):
+            line_kw = dict(self.line_kw)
+            line_kw.setdefault('color', 'C%d' % trace)
+            if trace < len(labels):
+                line_kw['label'] = labels[trace]
+            line = self.ax.add_line(SourceLine([], [], **line_kw))
+            tail, = self.ax.plot([], [], color=line.get_color(), animated=True)
+            self.lines.append(line)
+            self.tails.append(tail)
+        self.line = self.lines[0]
+        self.tail = self.tails[0]
+
+        legend = self.ax.get_legend()
+        if legend is not None:
+            legend.remove()
+        if labels:
+            self.ax.legend(handles=self.lines, loc='upper right', fontsize='small')
+
+    def set_traces(self, traces, labels=()):
+        """ It replaces the lines by `traces` empty ones and redraws the
+        background. `labels` of the traces go into a legend """
+
+        for artist in self.lines + self.tails:
+            artist.remove()
+        self._add_lines(traces, labels)
+        self.canvas.draw()
+
+    def _on_draw(self, event):
+        """ It is called after every full redraw of the canvas. It caches the
+        background together with all samples drawn by self.line"""
+
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.pending = 0
+        FULL_REDRAWS.inc()
+
+    def update(self, x, y, new):
+        """ It draws the last `new` samples of x and y. x and y hold all samples
+        of the sweep (views are enough, they are not copied) and are used for
+        full redraws only. y is an array or a sequence of arrays, one per trace """
+
+        start = time.perf_counter()
+        number = len(x)
+        traces = list(zip(self.lines, self.tails, y if isinstance(y, (list, tuple)) else (y,)))
+
+        for line, tail, values in traces:
+            line.source = (x, values)
+        self.pending = min(self.pending + new, number)
+
+        if self.background is None:
+            self.canvas.draw()
+        elif self.pending > 0:
+            first = max(number - self.pending - 1, 0)  # previous point joins the segments
+            self.canvas.restore_region(self.background)
+            for line, tail, values in traces:
+                tail.set_data(x[first:], values[first:])
+                self.ax.draw_artist(tail)
+            self.canvas.blit(self.ax.bbox)
+            self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+            self.pending = 0
+
+        self.frame_time = time.perf_counter() - start
+        self.frame_times.append(self.frame_time)
+        FRAME_TIME.observe(self.frame_time)
+
+    def reset(self):
+        """ It removes all samples from the plot and redraws the background """
+
+        for line, tail in zip(self.lines, self.tails):
+            line.source = ([], [])
+            tail.set_data([], [])
+        self.canvas.draw()
+
+    def disconnect(self):
+        """ It stops caching of the background, the axes are going to be removed """
+
+        self.canvas.mpl_disconnect(self.draw_id)
+
+    def mean_frame_time(self):
+        """ Mean time of the last frames in seconds """
+
+        if not self.frame_times:
+            return 0.0
+        return sum(self.frame_times) / len(self.frame_times)
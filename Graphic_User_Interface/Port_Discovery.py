@@ -0,0 +1,237 @@
+""" Discovery of recorder boards and negotiation of the baud rate.
+
+All candidate ports are probed at once: a port is opened at the baud rate of
+the firmware after reset, which resets the Uno, and the board is asked for
+its identity with the handshake command '?'. The link of every board found is
+stepped up through BAUD_RATES while the board keeps answering at the new baud
+rate. The best baud rate of every board is cached, so the next start switches
+to it at once instead of stepping up again:
+
+    connection = connect(['auto'], 'sessions/devices.json')
+    worker = SerialWorker(connection.ser)   # the port stays open at connection.baud_rate
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from serial.tools import list_ports
+
+from Acquisition_Manager import make_serial
+from Virtual_Recorder import URL_SCHEME
+from Serial_Worker import COMMAND_IDENTIFY, COMMAND_BAUD, FIRMWARE_ID, BAUD_RATES, BAUD_CONFIRM_TIME
+
+
+AUTO_PORT = 'auto'          # port name which stands for all ports of the system
+CACHE_NAME = 'devices.json'
+BOOT_BAUD_RATE = BAUD_RATES[0]
+BOOT_TIMEOUT = 3.0          # s, the bootloader of the Uno runs for about 1.6 s after reset
+REPLY_TIMEOUT = 0.1         # s for the answer of one handshake
+SWITCH_DELAY = 0.02         # s for "OK <baud rate>" at the old baud rate and the switch of the UART
+CHECKS = 3                  # handshakes which must succeed at a new baud rate
+
+
+class Connection:
+    """ Recorder board found on a port. `ser` is open at `baud_rate` """
+
+    def __init__(self, port, key, ser, version, baud_rate):
+
+        self.port = port
+        self.key = key              # serial number of the USB adapter or the port name
+        self.ser = ser
+        self.version = version
+        self.baud_rate = baud_rate
+
+    def __repr__(self):
+        return 'Connection(%r, version=%r, baud_rate=%d)' % (self.port, self.version, self.baud_rate)
+
+
+def candidate_ports(ports=(AUTO_PORT,)):
+    """ (port, key) of the given ports, AUTO_PORT is replaced by all ports of the
+    system. The key identifies the board in the cache when it moves to another port """
+
+    found = {info.device: info.serial_number or info.hwid or info.device
+             for info in list_ports.comports()} if AUTO_PORT in ports else {}
+    candidates = []
+    for port in ports:
+        if port == AUTO_PORT:
+            candidates += sorted(found.items())
+        else:
+            candidates.append((port, port if port.startswith(URL_SCHEME) else found.get(port, port)))
+    return list(dict(candidates).items())     # without repeated ports
+
+
+def handshake(ser, timeout=REPLY_TIMEOUT):
+    """ It sends '?' and returns (version, baud rate) of the answer of the
+    firmware, or None. Samples and garbage are skipped """
+
+    ser.reset_input_buffer()
+    ser.write(COMMAND_IDENTIFY)
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        line = ser.readline()
+        start = line.find(FIRMWARE_ID)
+        if start < 0:
+            continue
+        fields = line[start + len(FIRMWARE_ID):].split()
+        if len(fields) == 2 and fields[1].isdigit():
+            return fields[0].decode('ascii', 'replace'), int(fields[1])
+    return None
+
+
+def wait_for_identity(ser, timeout=BOOT_TIMEOUT):
+    """ It repeats the handshake while the board boots. The bootloader drops
+    the bytes which it receives """
+
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        identity = handshake(ser)
+        if identity is not None:
+            return identity
+    return None
+
+
+def switch_baud_rate(ser, baud_rate, checks=CHECKS):
+    """ It switches the board and the port to `baud_rate` and checks the link
+    with `checks` handshakes. When one fails, the port returns to the old baud
+    rate after the firmware did. It returns True if the new baud rate works """
+
+    old = ser.baudrate
+    ser.write(COMMAND_BAUD + b'%d' % BAUD_RATES.index(baud_rate))
+    ser.flush()
+    time.sleep(SWITCH_DELAY)
+    ser.baudrate = baud_rate
+    for _ in range(checks):
+        identity = handshake(ser)
+        if identity is None or identity[1] != baud_rate:
+            break
+    else:
+        return True
+
+    # the firmware returns to the old baud rate unless one handshake confirmed the new one
+    time.sleep(BAUD_CONFIRM_TIME)
+    ser.baudrate = old
+    if handshake(ser) is None:
+        ser.baudrate = baud_rate
+        if handshake(ser) is None:
+            ser.baudrate = old
+    return False
+
+
+def negotiate(ser, highest=None):
+    """ It steps the link up through BAUD_RATES until a baud rate fails and
+    returns the last one which works """
+
+    for baud_rate in BAUD_RATES:
+        if baud_rate <= ser.baudrate or (highest is not None and baud_rate > highest):
+            continue
+        if not switch_baud_rate(ser, baud_rate):
+            break
+    return ser.baudrate
+
+
+def probe(port, key, cached=None, highest=None):
+    """ It opens the port and returns its Connection, or None if no recorder
+    answers. A `cached` baud rate is tried first, the link is stepped up
+    only if it fails """
+
+    ser = make_serial(port, BOOT_BAUD_RATE)
+    try:
+        ser.open()  # it resets the board
+        identity = wait_for_identity(ser)
+        if identity is None:
+            ser.close()
+            return None
+        if cached in BAUD_RATES and cached > ser.baudrate and (highest is None or cached <= highest):
+            if not switch_baud_rate(ser, cached):
+                negotiate(ser, cached)
+        else:
+            negotiate(ser, highest)
+        return Connection(port, key, ser, identity[0], ser.baudrate)
+    except Exception:
+        if ser.isOpen():
+            ser.close()
+        return None
+
+
+class DeviceCache:
+    """ Settings of known boards by key in a JSON file: port, baud rate,
+    firmware version and time of the last connection """
+
+    def __init__(self, path):
+
+        self.path = path
+        try:
+            with open(path) as file:
+                self.devices = json.load(file)
+        except (OSError, ValueError):
+            self.devices = {}
+
+    def get(self, key):
+        return self.devices.get(key, {})
+
+    def put(self, connection):
+
+        self.devices[connection.key] = {'port': connection.port, 'baud_rate': connection.baud_rate,
+                                        'version': connection.version, 'time': time.time()}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.devices, file, indent=2)
+        os.replace(temporary, self.path)
+
+    def recent(self):
+        """ Keys from the last connected board to the first one """
+
+        return sorted(self.devices, key=lambda key: self.devices[key].get('time', 0), reverse=True)
+
+
+def discover(ports=(AUTO_PORT,), cache=None, highest=None):
+    """ It probes all candidate ports at once and returns the Connections of the
+    recorders found, in the order of the ports. The cache is updated """
+
+    return probe_all(candidate_ports(ports), cache, highest)
+
+
+def probe_all(candidates, cache=None, highest=None):
+    """ It probes (port, key) candidates on one thread each, see discover() """
+
+    if not candidates:
+        return []
+    with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+        futures = [executor.submit(probe, port, key,
+                                   cache.get(key).get('baud_rate') if cache is not None else None, highest)
+                   for port, key in candidates]
+        connections = [future.result() for future in futures]
+    connections = [connection for connection in connections if connection is not None]
+    if cache is not None:
+        for connection in connections:
+            cache.put(connection)
+    return connections
+
+
+def connect(ports=(AUTO_PORT,), cache_path=None, highest=None):
+    """ Connection of one recorder, or None. The board of the last connection is
+    probed alone first, which is quick when it is still on the same port. The
+    other boards which were found are closed """
+
+    cache = DeviceCache(cache_path) if cache_path is not None else None
+    candidates = candidate_ports(ports)
+    if cache is not None:
+        keys = dict((key, port) for port, key in candidates)
+        for key in cache.recent():
+            if key in keys:
+                connection = probe(keys[key], key, cache.get(key).get('baud_rate'), highest)
+                if connection is not None:
+                    cache.put(connection)
+                    return connection
+                candidates.remove((keys[key], key))
+                break
+
+    connections = probe_all(candidates, cache, highest)
+    for connection in connections[1:]:
+        connection.ser.close()
+    return connections[0] if connections else None
@@ -0,0 +1,346 @@
+""" Replay of recorded streams through the live pipeline.
+
+ReplaySerial is a drop-in replacement of serial.Serial, like VirtualSerial,
+which plays back a recording instead of a board, so parsing, conversion,
+buffering and plotting run exactly as with live data. It is created from
+port names like 'replay://sessions/session_20200101_120000.aps?speed=4':
+
+- raw captures of the serial stream (CAPTURE_EXTENSION, written by
+  CaptureTee) are played back as the host read them, chunk by chunk,
+- session files (.aps) are played back sample by sample with all their
+  channels, as ASCII lines or as binary frames, whichever the host selects
+  with 'a' or 'b',
+- text files with one ADC value per line (data.txt) are played back one
+  sample per Timer1 period (timer=... in us).
+
+The handshake ('?') is answered like the firmware does.
+Playback starts with the first rotation command ('7' or '9') and pauses with
+'8', like the turntable does. speed=1 is real time, speed=N is N times faster
+and speed=0 is as fast as the host reads. Settings ('T', 'S') are confirmed
+as they are asked for, so the host can match the recording, which they do not change.
+A channel mask ('C') is confirmed only with the number of channels of the
+recording, otherwise the mask of the recording is answered, so the host parses
+the records as they were recorded. Raw captures and text files have one channel.
+"""
+
+import os
+import struct
+import time
+from urllib.parse import parse_qsl
+
+import numpy as np
+
+from Binary_Protocol import COMMAND_ASCII, COMMAND_BINARY, DEGREES_PER_STEP, encode_frames
+from Serial_Reader import ANALOG_PINS, channel_names, mask_channels
+from Serial_Worker import COMMAND_LEFT, COMMAND_RIGHT, COMMAND_STOP, COMMAND_SPEED, COMMAND_TIMER, COMMAND_STEPS, \
+    COMMAND_CHANNELS, COMMAND_IDENTIFY, FIRMWARE_ID
+from Session_File import EXTENSION, open_session
+from Virtual_Recorder import encode_ascii, TIME, TRAVEL, FIRMWARE_VERSION
+
+
+REPLAY_SCHEME = 'replay://'
+CAPTURE_EXTENSION = '.raw'
+CAPTURE_MAGIC = b'APRRAW1\n'
+CAPTURE_RECORD = struct.Struct('<dI')   # time of the read from the start of the capture, number of bytes
+
+
+class CaptureTee:
+    """ Serial port which writes every byte read from it into a raw capture
+    file together with the time of the read. All other attributes are those
+    of the port. close() closes the capture only, the port stays open """
+
+    def __init__(self, ser, path, clock=time.perf_counter):
+
+        self.ser = ser
+        self.path = path
+        self.clock = clock
+        self.file = open(path, 'wb')
+        self.file.write(CAPTURE_MAGIC)
+        self.start = clock()
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+    def _record(self, data):
+
+        if data:
+            self.file.write(CAPTURE_RECORD.pack(self.clock() - self.start, len(data)))
+            self.file.write(data)
+
+    def read(self, size=1):
+
+        data = self.ser.read(size)
+        self._record(data)
+        return data
+
+    def readline(self):
+
+        data = self.ser.readline()
+        self._record(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class RawStream:
+    """ Chunks of a raw capture with their read times """
+
+    def __init__(self, path):
+
+        with open(path, 'rb') as capture:
+            if capture.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+                raise ValueError("%s is not a raw capture" % path)
+            content = capture.read()
+
+        times = []
+        ends = []
+        chunks = []
+        offset = 0
+        while offset + CAPTURE_RECORD.size <= len(content):
+            moment, length = CAPTURE_RECORD.unpack_from(content, offset)
+            offset += CAPTURE_RECORD.size
+            chunks.append(content[offset:offset + length])
+            offset += length
+            times.append(moment)
+            ends.append((ends[-1] if ends else 0) + len(chunks[-1]))
+        self.data = b''.join(chunks)
+        self.ends = np.array([0] + ends, dtype=np.int64)
+        self.times = np.array(times)
+        self.channel_mask = 1   # the capture does not tell, so it is played back as it was read
+
+    def __len__(self):
+        return len(self.times)
+
+    def encode(self, first, last, binary_mode, sequence):
+        """ Bytes of chunks first ... last - 1, the format is that of the capture """
+
+        return self.data[self.ends[first]:self.ends[last]], sequence
+
+
+class SampleStream:
+    """ ADC values and step indexes of samples with their times. They are
+    encoded when they are sent, in the format which the host selected. adc
+    of shape (samples, channels) gives records of several channels """
+
+    def __init__(self, times, adc, step, channel_mask=None):
+
+        self.times = np.asarray(times, dtype=float)
+        self.adc = np.clip(np.rint(adc), 0, 1023).astype(np.int64)
+        self.step = np.asarray(step, dtype=np.int64)
+        channels = self.adc.shape[1] if self.adc.ndim > 1 else 1
+        if channel_mask is None or mask_channels(channel_mask) != channels:
+            channel_mask = (1 << channels) - 1
+        self.channel_mask = channel_mask
+
+    def __len__(self):
+        return len(self.times)
+
+    def encode(self, first, last, binary_mode, sequence):
+        """ ASCII lines or binary frames of samples first ... last - 1 and the
+        next frame sequence """
+
+        adc = self.adc[first:last]
+        if not binary_mode:
+            return encode_ascii(adc), sequence
+        sequences = sequence + np.arange(len(adc))
+        return encode_frames(sequences, self.step[first:last], adc), (sequence + len(adc)) % 256
+
+    @classmethod
+    def from_session(cls, path):
+        """ Samples of a session file with all its channels, steps come from the angles """
+
+        header, records = open_session(path)
+        times = records['timestamp'] - (records['timestamp'][0] if len(records) else 0)
+        step = np.rint(np.nan_to_num(records['angle'].astype(float)) / DEGREES_PER_STEP)
+        names = [name for name in channel_names(ANALOG_PINS) if name in records.dtype.names]
+        adc = records['adc'] if len(names) == 1 else np.column_stack([records[name] for name in names])
+        return cls(times, adc, step, header['metadata'].get('channel_mask'))
+
+    @classmethod
+    def from_text(cls, path, period=TIME * 1e-6):
+        """ Samples of a text file with one ADC value per line, a sweep to the right """
+
+        adc = np.atleast_1d(np.loadtxt(path, dtype=float, ndmin=1))
+        step = np.rint(np.linspace(0, TRAVEL, len(adc))) if len(adc) > 1 else np.zeros(len(adc))
+        return cls(period * np.arange(len(adc)), adc, step)
+
+
+def load_source(path, period=TIME * 1e-6):
+    """ Stream of a recording, by the extension of the file """
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == CAPTURE_EXTENSION:
+        return RawStream(path)
+    if extension == EXTENSION:
+        return SampleStream.from_session(path)
+    return SampleStream.from_text(path, period)
+
+
+class ReplaySerial:
+    """ Drop-in replacement of serial.Serial which plays back a recording.
+    Opening the port rewinds it, like opening resets the board """
+
+    def __init__(self, source, port=REPLAY_SCHEME, speed=1.0, baudrate=9600, timeout=None,
+                 write_timeout=None, clock=time.perf_counter):
+
+        self.source = source
+        self.port = port
+        self.speed = speed      # 0 is as fast as possible
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.clock = clock
+        self.is_open = False
+        self.rewind()
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """ 'replay://path/to/recording?speed=4&timer=24383' """
+
+        path, _, query = url[len(REPLAY_SCHEME):].partition('?')
+        options = dict(parse_qsl(query))
+        source = load_source(path, int(options.get('timer', TIME)) * 1e-6)
+        return cls(source, port=url, speed=float(options.get('speed', 1.0)), **kwargs)
+
+    def rewind(self):
+
+        self.position = 0       # units (chunks or samples) which were sent
+        self.elapsed = 0.0      # time of the recording which was played before the last pause
+        self.started = None     # clock() of the last start of playback, None while paused
+        self.configured = False # the first speed command is taken silently like motorSetup() does
+        self.binary_mode = False
+        self.sequence = 0
+        self.setting = None     # 'T', 'S' or 'C' while its digits come
+        self.output = bytearray()
+
+    def open(self):
+        self.rewind()
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def isOpen(self):
+        return self.is_open
+
+    def stream_time(self):
+        """ Time of the recording which has been played """
+
+        if self.started is None:
+            return self.elapsed
+        if self.speed <= 0:
+            return np.inf
+        return self.elapsed + (self.clock() - self.started) * self.speed
+
+    def _advance(self):
+
+        if self.started is None:
+            return  # everything up to the pause was sent when it began
+        last = int(np.searchsorted(self.source.times, self.stream_time(), side='right'))
+        if last > self.position:
+            data, self.sequence = self.source.encode(self.position, last, self.binary_mode, self.sequence)
+            self.output += data
+            self.position = last
+
+    def _wait(self):
+        """ Clock time until the next unit of the recording is due """
+
+        if self.started is None or self.position >= len(self.source) or self.speed <= 0:
+            return 0.01
+        return max((self.source.times[self.position] - self.stream_time()) / self.speed, 1e-4)
+
+    def _take(self, size):
+
+        data = bytes(self.output[:size])
+        del self.output[:size]
+        return data
+
+    @property
+    def in_waiting(self):
+        self._advance()
+        return len(self.output)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def read(self, size=1):
+
+        deadline = None if self.timeout is None else self.clock() + self.timeout
+        while self.in_waiting < size:
+            remaining = None if deadline is None else deadline - self.clock()
+            if remaining is not None and remaining <= 0:
+                break
+            pause = min(self._wait(), 0.01)
+            time.sleep(pause if remaining is None else min(pause, remaining))
+        return self._take(size)
+
+    def readline(self):
+
+        deadline = None if self.timeout is None else self.clock() + self.timeout
+        while True:
+            self._advance()
+            end = self.output.find(b'\n') + 1
+            if end > 0:
+                return self._take(end)
+            if deadline is not None and self.clock() >= deadline:
+                return self._take(len(self.output))
+            time.sleep(min(self._wait(), 1e-3))
+
+    def write(self, data):
+        """ Commands of the firmware which matter for playback """
+
+        for command in data:
+            command = bytes((command,))
+            if self.setting is not None:
+                if command.isdigit():
+                    self.setting += command
+                else:
+                    value = self.setting[1:]
+                    if self.setting[:1] == COMMAND_CHANNELS:
+                        value = self._channel_mask(value)
+                    self.output += self.setting[:1] + b' ' + value + b'\r\n'
+                    self.setting = None
+                continue
+            if command in (COMMAND_TIMER, COMMAND_STEPS, COMMAND_CHANNELS):
+                self.setting = command
+                continue
+            if command == COMMAND_IDENTIFY:
+                self.output += FIRMWARE_ID + b' ' + FIRMWARE_VERSION + b' %d\r\n' % self.baudrate
+                continue
+            if not self.configured:
+                self.configured = command in COMMAND_SPEED
+                continue
+            if command in (COMMAND_LEFT, COMMAND_RIGHT) and self.started is None:
+                self.started = self.clock()
+            elif command == COMMAND_STOP and self.started is not None:
+                self._advance()
+                if self.speed > 0:
+                    self.elapsed = self.stream_time()
+                else:
+                    self.elapsed = self.source.times[self.position - 1] if self.position > 0 else 0.0
+                self.started = None
+            elif command == COMMAND_BINARY:
+                self.binary_mode = True
+            elif command == COMMAND_ASCII:
+                self.binary_mode = False
+        return len(data)
+
+    def _channel_mask(self, value):
+        """ The asked mask if it has the channels of the recording, otherwise
+        the mask of the recording """
+
+        mask = self.source.channel_mask
+        if value and mask_channels(int(value)) == mask_channels(mask):
+            return value
+        return b'%d' % mask
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self._advance()
+        self.output.clear()
+
+    def flushInput(self):
+        self.reset_input_buffer()
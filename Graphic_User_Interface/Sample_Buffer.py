@@ -0,0 +1,114 @@
+import numpy as np
+
+
+COLUMNS = ('voltage', 'angle', 'timestamp')
+
+
+class SampleBuffer:
+    """ Preallocated ring of samples shared by the serial reader thread and the plot.
+
+    There must be exactly one writer. Every column is stored twice, one copy
+    right after the other, so the last `capacity` samples are always one
+    contiguous slice and readers get views instead of copies. `version` is
+    the total number of samples ever written. It is increased only after the
+    data are in place, so a reader which has seen a version can safely use
+    every sample up to it. Samples older than `capacity` are overwritten.
+    """
+
+    def __init__(self, capacity, columns=COLUMNS, dtype=np.float32):
+
+        self.capacity = capacity
+        self.columns = {name: np.zeros(2 * capacity, dtype=dtype) for name in columns}
+        self.version = 0    # number of samples written since creation
+        self.first = 0      # version at the moment of the last clear()
+
+    def __len__(self):
+        return min(self.version - self.first, self.capacity)
+
+    def append(self, **values):
+        """ It writes a chunk of samples. Every column must be given, as a
+        scalar or as an array of the same length. It is called by the writer only """
+
+        values = {name: np.atleast_1d(values[name]) for name in self.columns}
+        number = max(len(value) for value in values.values())
+        if number == 0:
+            return
+
+        # Only the last `capacity` samples of a chunk can be kept
+        skip = max(number - self.capacity, 0)
+        start = (self.version + skip) % self.capacity
+
+        for name, column in self.columns.items():
+            self._write(column, start, np.broadcast_to(values[name], (number,))[skip:])
+
+        self.version += number
+
+    def _write(self, column, start, data):
+
+        capacity = self.capacity
+        end = start + len(data)
+
+        if end <= capacity:
+            column[start:end] = data
+            column[start + capacity:end + capacity] = data
+        else:
+            split = capacity - start
+            column[start:capacity] = data[:split]
+            column[start + capacity:] = data[:split]
+            column[:end - capacity] = data[split:]
+            column[capacity:end] = data[split:]
+
+    def clear(self):
+        """ It starts a new sweep. Samples written before are not returned any more """
+
+        self.first = self.version
+
+    def resize(self, capacity, columns=None):
+        """ It replaces the columns by empty ones of another capacity, and of
+        other names if `columns` is given, and starts a new sweep. The version
+        goes on, so readers need not know about it. It is called by the writer
+        only, while no sweep is written """
+
+        dtype = next(iter(self.columns.values())).dtype
+        columns = self.columns if columns is None else columns
+        self.columns = {name: np.zeros(2 * capacity, dtype=dtype) for name in columns}
+        self.capacity = capacity
+        self.first = self.version
+
+    def remap(self, target, source, table, reference=None):
+        """ It replaces column `target` of the samples of the sweep by `table`
+        indexed by column `source`, e.g. values in another unit of the ADC
+        counts. With a `reference` column the table of it is subtracted, e.g.
+        the ratio of two detectors in dB. Samples before the last clear() are
+        not converted. It is called by the writer only """
+
+        number = len(self)
+        end = self.version % self.capacity + self.capacity
+        window = slice(end - number, end)
+        values = table.take(self.columns[source][window].astype(np.intp), mode='clip')
+        if reference is not None:
+            values -= table.take(self.columns[reference][window].astype(np.intp), mode='clip')
+        self._write(self.columns[target], (end - number) % self.capacity, values)
+
+    def _window(self, version, number):
+        """ Views of `number` samples which end at `version` """
+
+        end = version % self.capacity + self.capacity
+        return {name: column[end - number:end] for name, column in self.columns.items()}
+
+    def snapshot(self):
+        """ It returns the current version and views of all samples of the sweep.
+        No data are copied """
+
+        version = self.version
+        number = min(version - self.first, self.capacity)
+        return version, self._window(version, number)
+
+    def since(self, version):
+        """ It returns the current version and views of the samples written after
+        `version`. If the reader lags more than `capacity` samples behind, only
+        the last `capacity` samples are returned """
+
+        current = self.version
+        number = min(current - max(version, self.first), self.capacity)
+        return current, self._window(current, max(number, 0))
@@ -0,0 +1,100 @@
+""" Sampling profiler for the hot path of the recorder.
+
+A thread takes the stacks of the profiled threads every few milliseconds,
+so the profiled code is not slowed down by tracing like with cProfile. The
+result is a table of the functions which were seen most often and a file
+of folded stacks for flame graph tools (flamegraph.pl, speedscope).
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_INTERVAL = 0.002    # s between samples
+
+
+class SamplingProfiler:
+    """ It samples stacks of the threads with the given idents, or of all
+    threads, from start() until stop(). It can be used as a context manager """
+
+    def __init__(self, threads=None, interval=PROFILE_INTERVAL):
+
+        self.threads = set(threads) if threads is not None else None
+        self.interval = interval
+        self.stacks = Counter()     # stack (tuple of frames from the root) : number of samples
+        self.samples = 0
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='SamplingProfiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+
+        own = threading.get_ident()
+        names = {}
+        start = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (self.threads is not None and ident not in self.threads):
+                    continue
+                if ident not in names:
+                    names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                                                 code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+        self.elapsed = time.perf_counter() - start
+
+    def folded(self):
+        """ Lines 'thread;outer;...;inner count' of the folded stack format """
+
+        return ['%s %d' % (';'.join(stack), count) for stack, count in self.stacks.most_common()]
+
+    def save(self, path):
+
+        with open(path, 'w') as file:
+            file.write('\n'.join(self.folded()) + '\n')
+
+    def report(self, top=15, file=sys.stdout):
+        """ Functions seen most often at the top of a stack (own) and anywhere
+        in it (total), in percent of all samples of the profiled threads """
+
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack[1:]):
+                total[function] += count
+        number = sum(self.stacks.values()) or 1
+
+        print('%d samples in %.2f s' % (self.samples, self.elapsed), file=file)
+        print('%7s %7s  %s' % ('own, %', 'total,%', 'function'), file=file)
+        for function, count in own.most_common(top):
+            print('%7.1f %7.1f  %s' % (100 * count / number, 100 * total[function] / number, function),
+                  file=file)
@@ -0,0 +1,157 @@
+import time
+
+import numpy as np
+
+import Metrics
+
+
+NEWLINE = ord('\n')
+CARRIAGE_RETURN = ord('\r')
+COMMA = ord(',')
+ZERO = ord('0')
+MAX_DIGITS = 9          # longer records can not be ADC data
+MAX_RECORD_LENGTH = 64  # unterminated data longer than that is dropped, six channels take 30 bytes
+ANALOG_PINS = 6         # A0 ... A5 of the Uno, bit 0 of a channel mask is A0
+EMPTY = np.empty(0, dtype=np.int64)
+
+READ_TIME = Metrics.timing('serial_read_seconds', 'Time of one read of the serial port with the wait for data')
+READ_BYTES = Metrics.counter('serial_read_bytes_total', 'Bytes read from the serial port')
+PARSE_TIME = Metrics.timing('parse_seconds', 'Time of parsing of the data of one read')
+PARSED = Metrics.counter('parsed_samples_total', 'Samples parsed from the serial stream')
+PARSE_FAILURES = Metrics.counter('parse_failures_total', 'Malformed ASCII records and binary frames')
+
+
+def channel_names(channels, prefix='adc'):
+    """ Names of the columns of the channels of a record: 'adc', 'adc1', 'adc2' ... """
+
+    return tuple(prefix if channel == 0 else '%s%d' % (prefix, channel) for channel in range(channels))
+
+
+def mask_channels(mask):
+    """ Number of channels of a mask of analog pins """
+
+    return bin(mask).count('1')
+
+
+def mask_pins(mask):
+    """ Analog pins of a mask in the order of the channels of a record """
+
+    return [pin for pin in range(ANALOG_PINS) if mask >> pin & 1]
+
+
+def pins_mask(text):
+    """ Mask of a list of analog pins like '0,1,2' (A0, A1 and A2). It raises
+    ValueError if a pin does not exist """
+
+    pins = [int(pin) for pin in text.replace(' ', '').split(',') if pin]
+    if not pins or any(pin < 0 or pin >= ANALOG_PINS for pin in pins):
+        raise ValueError("Analog pins must be 0 ... %d: %r" % (ANALOG_PINS - 1, text))
+    return sum(1 << pin for pin in set(pins))
+
+
+def parse_records(data, channels=1):
+    """ It parses newline-terminated ASCII records of decimal numbers in one
+    vectorized step. Bytes after the last newline are ignored. A record of
+    several channels is a line of `channels` comma separated numbers.
+    It returns an array of values, of shape (records, channels) for several
+    channels, and the number of malformed records.
+    Empty records are skipped and are not counted as malformed """
+
+    raw = np.frombuffer(data, dtype=np.uint8)
+    raw = raw[raw != CARRIAGE_RETURN]
+    newline = raw == NEWLINE
+    ends = np.flatnonzero(newline)
+    if len(ends) == 0:
+        return (EMPTY if channels == 1 else EMPTY.reshape(0, channels)), 0
+
+    raw = raw[:ends[-1] + 1]
+    newline = newline[:ends[-1] + 1]
+    # numbers end at a newline, or at a comma in records of several channels
+    terminator = newline | (raw == COMMA) if channels > 1 else newline
+    if channels > 1:
+        ends = np.flatnonzero(terminator)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts
+
+    # Every byte gets the index of its number and the position of its digit
+    # counting from the end of the number
+    number = np.cumsum(terminator) - terminator
+    position = ends[number] - np.arange(len(raw)) - 1
+
+    digits = raw.astype(np.int64) - ZERO
+    bad = ~terminator & ((digits < 0) | (digits > 9))
+    weights = 10 ** np.clip(position, 0, MAX_DIGITS - 1)
+    contribution = np.where(terminator | bad, 0, digits * weights)
+
+    # A number always contains at least its terminator, so no segment is empty
+    values = np.add.reduceat(contribution, starts)
+    invalid = np.add.reduceat(bad, starts, dtype=np.int64)
+
+    valid = (lengths > 0) & (lengths <= MAX_DIGITS) & (invalid == 0)
+    if channels == 1:
+        malformed = int(np.count_nonzero((lengths > 0) & ~valid))
+        return values[valid], malformed
+
+    # A record is taken when all of its `channels` numbers are valid
+    last = newline[ends]    # the number ends its record
+    record = np.cumsum(last) - last
+    count = np.bincount(record)
+    wrong = np.bincount(record, weights=~valid)
+    empty = (count == 1) & (lengths[last] == 0)
+    good = (count == channels) & (wrong == 0)
+    malformed = int(np.count_nonzero(~good & ~empty))
+
+    return values[good[record]].reshape(-1, channels), malformed
+
+
+class ChunkReader:
+    """ It reads all bytes which are waiting in the serial port in one call and
+    parses every complete record of them at once. An incomplete record is kept
+    for the next call. Nothing is flushed, so no sample is lost between calls.
+    Records of several channels are returned as a structured array with one
+    field per channel ('adc', 'adc1' ...), a view of the parsed values """
+
+    def __init__(self, ser, channels=1):
+
+        self.ser = ser
+        self.channels = channels
+        self.dtype = np.dtype([(name, np.int64) for name in channel_names(channels)])
+        self.empty = EMPTY if channels == 1 else np.empty(0, dtype=self.dtype)
+        self.carry = bytearray()
+        self.received = 0   # number of parsed records
+        self.malformed = 0  # number of records which are not numbers
+
+    def read(self):
+        """ It returns an array of the ADC values received since the previous call.
+        It waits up to the timeout of the port when nothing is waiting """
+
+        start = time.perf_counter()
+        data = self.ser.read(max(self.ser.in_waiting, 1))
+        parsed = time.perf_counter()
+        READ_TIME.observe(parsed - start)
+        if not data:
+            return self.empty
+        READ_BYTES.inc(len(data))
+
+        self.carry += data
+        end = self.carry.rfind(b'\n') + 1
+        if end == 0:
+            if len(self.carry) > MAX_RECORD_LENGTH:
+                self.carry.clear()
+                self.malformed += 1
+                PARSE_FAILURES.inc()
+            return self.empty
+
+        with memoryview(self.carry) as view:
+            values, malformed = parse_records(view[:end], self.channels)
+        del self.carry[:end]
+
+        self.received += len(values)
+        self.malformed += malformed
+        PARSED.inc(len(values))
+        if malformed:
+            PARSE_FAILURES.inc(malformed)
+        PARSE_TIME.observe(time.perf_counter() - parsed)
+        if self.channels > 1:
+            return values.view(self.dtype).ravel()
+        return values
@@ -0,0 +1,160 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+# Commands of the firmware (see serialEvent() in AntennaPatternRecorder.ino)
+COMMAND_LEFT = b'7'
+COMMAND_STOP = b'8'
+COMMAND_RIGHT = b'9'
+COMMAND_SPEED = (b'0', b'1', b'2', b'3', b'4', b'5')
+COMMAND_CONTINUOUS = b'c'   # samples are sent while the motor stands too
+COMMAND_SWEEP = b's'        # samples are sent only while the motor turns
+COMMAND_IDENTIFY = b'?'     # answer FIRMWARE_ID, version and baud rate, it confirms a new baud rate
+COMMAND_BAUD = b'B'         # followed by the index of the new baud rate in BAUD_RATES
+
+FIRMWARE_ID = b'AntennaPatternRecorder'
+BAUD_RATES = (9600, 19200, 38400, 57600, 115200, 250000, 500000, 1000000)
+BAUD_CONFIRM_TIME = 0.5     # s after which the firmware returns to the old baud rate
+COMMAND_TIMER = b'T'        # followed by the period of Timer1 in us and a new line
+COMMAND_STEPS = b'S'        # followed by the steps per revolution of the Stepper library and a new line
+COMMAND_CHANNELS = b'C'     # followed by the mask of the sampled analog pins (bit 0 is A0) and a new line
+TIMER_RANGE = (200, 1000000)    # us, periods which the firmware takes
+STEPS_RANGE = (1, 2048)
+CHANNELS_RANGE = (1, 63)    # masks of A0 ... A5
+ADC_TIME = 112              # us of one analogRead(), the channels of a mask must be read within the period
+RECORD_BYTES = 5            # bytes per channel of the longest record, "1023," of an ASCII line
+SETTING_TIMEOUT = 0.5       # s for the answer of a setting command
+
+READ_TIMEOUT = 0.01     # longest delay of a command while samples are read
+
+
+def samples_fit(period, mask, baud_rate):
+    """ samplesFit() of the firmware: all channels of the mask are read and
+    their longest record is sent at `baud_rate` (10 bits per byte) within the
+    period of Timer1 in us, otherwise the ISR overruns the timer """
+
+    channels = bin(mask).count('1')
+    transmit = channels * RECORD_BYTES * 10 * 1000000 // baud_rate
+    return channels * ADC_TIME + transmit < period
+
+
+def write_setting(ser, command, value, timeout=SETTING_TIMEOUT):
+    """ It writes a setting command ('T', 'S' or 'C') with its value and returns the
+    value which the firmware confirms ("T 12000"), or None without an answer.
+    The firmware keeps the old value if the new one is out of range. Samples
+    which were not read yet are discarded, so it must not run during a sweep.
+    A readline() which times out returns a part of the answer, so parts are
+    joined until a new line """
+
+    ser.reset_input_buffer()
+    ser.write(command + b'%d\n' % value)
+    prefix = command + b' '
+    buffer = b''
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        buffer += ser.readline()
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if line.startswith(prefix) and line[len(prefix):].strip().isdigit():
+                return int(line[len(prefix):])
+    return None
+
+
+class SerialWorker(threading.Thread):
+    """ The only thread which uses the serial port. It keeps the port open and
+    executes queued items in order:
+
+    - bytes are written to the port,
+    - callables (jobs) are called on this thread with no arguments.
+
+    Every submitted item gets a Future. A long job, like reading of a sweep,
+    must call write_pending() between reads, so queued commands are written
+    within READ_TIMEOUT instead of waiting for the end of the job.
+    """
+
+    def __init__(self, ser):
+
+        threading.Thread.__init__(self, daemon=True)
+        self.ser = ser
+        self.commands = queue.Queue()
+        self.deferred = deque()     # jobs submitted while another job runs
+        self.running = True
+        self.in_job = False
+
+    def submit(self, item):
+        """ It queues bytes or a job and returns a Future of its result """
+
+        future = Future()
+        self.commands.put((item, future))
+        return future
+
+    def close(self, timeout=1.0):
+        """ It writes pending commands, closes the port and stops the thread """
+
+        def _close():
+            self.running = False
+            if self.ser.isOpen():
+                self.ser.close()
+
+        future = self.submit(_close)
+        if self.is_alive() and threading.current_thread() is not self:
+            future.exception(timeout)
+            self.join(timeout)
+
+    def _open(self):
+
+        if self.ser.isOpen() is False:
+            self.ser.timeout = READ_TIMEOUT
+            self.ser.open()
+
+    def _write(self, data, future):
+
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            self._open()
+            future.set_result(self.ser.write(data))
+        except Exception as error:
+            future.set_exception(error)
+
+    def _call(self, job, future):
+
+        if not future.set_running_or_notify_cancel():
+            return
+        self.in_job = True
+        try:
+            self._open()
+            future.set_result(job())
+        except Exception as error:
+            future.set_exception(error)
+        finally:
+            self.in_job = False
+
+    def write_pending(self):
+        """ It writes all queued commands. Jobs are kept until the running one ends.
+        It must be called on this thread only """
+
+        while True:
+            try:
+                item, future = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            if callable(item):
+                self.deferred.append((item, future))
+            else:
+                self._write(item, future)
+
+    def run(self):
+
+        while self.running:
+            if self.deferred:
+                item, future = self.deferred.popleft()
+            else:
+                item, future = self.commands.get()
+            if callable(item):
+                self._call(item, future)
+            else:
+                self._write(item, future)
@@ -0,0 +1,192 @@
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+import Metrics
+from Serial_Reader import channel_names
+
+
+# Session file:
+#   magic (8 bytes), uint32 length of the JSON header, JSON header padded with
+#   spaces up to HEADER_SIZE, then fixed-size little endian records.
+# Records are only appended, so after a crash or a USB disconnect everything
+# up to the last complete record is valid. Columns of a finished (or
+# recovered) session are strided views of a read-only memory map.
+MAGIC = b'APRSESS1'
+HEADER_SIZE = 4096
+PREFIX = struct.Struct('<8sI')
+EXTENSION = '.aps'
+
+WRITE_TIME = Metrics.timing('session_write_seconds', 'Time of writing of one chunk to a session file')
+FLUSH_TIME = Metrics.timing('session_flush_seconds', 'Time of one flush (with fsync) of a session file')
+WRITTEN_BYTES = Metrics.counter('session_written_bytes_total', 'Bytes of records written to session files')
+
+# received is the host time of the read which returned the sample, sequence is
+# the frame counter of the firmware or -1 for ASCII lines
+RECORD = np.dtype([('timestamp', '<f8'), ('angle', '<f4'), ('adc', '<u2'), ('voltage', '<f4'),
+                   ('received', '<f8'), ('sequence', '<i2')])
+
+
+def record_dtype(channels=1):
+    """ Record of a recorder with several channels: RECORD with the ADC data of
+    the other channels ('adc1', 'adc2' ...). voltage is the one of channel 'adc' """
+
+    return np.dtype(RECORD.descr + [(name, '<u2') for name in channel_names(channels)[1:]])
+
+
+def new_session_path(directory, prefix='session'):
+    """ Name of a new session file in the directory, it contains the start time """
+
+    os.makedirs(directory, exist_ok=True)
+    name = '%s_%s' % (prefix, time.strftime('%Y%m%d_%H%M%S'))
+    path = os.path.join(directory, name + EXTENSION)
+    number = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, '%s_%d%s' % (name, number, EXTENSION))
+        number += 1
+    return path
+
+
+def _pack_header(header):
+
+    text = json.dumps(header).encode('utf-8')
+    if PREFIX.size + len(text) > HEADER_SIZE:
+        raise ValueError("Session metadata is longer than %d bytes" % HEADER_SIZE)
+    return PREFIX.pack(MAGIC, len(text)) + text.ljust(HEADER_SIZE - PREFIX.size)
+
+
+def read_header(path):
+    """ It returns the header of a session file as a dictionary """
+
+    with open(path, 'rb') as session:
+        prefix = session.read(PREFIX.size)
+        if len(prefix) < PREFIX.size:
+            raise ValueError("%s is not a session file" % path)
+        magic, length = PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError("%s is not a session file" % path)
+        text = session.read(length)
+        if len(text) < length:
+            raise ValueError("The header of %s is truncated" % path)
+        return json.loads(text.decode('utf-8'))
+
+
+def _dtype(header):
+
+    return np.dtype([(name, kind) for name, kind in header['columns']])
+
+
+class SessionWriter:
+    """ It appends samples to a session file while they arrive. The data are
+    flushed to the disk every `flush_interval` seconds. The header keeps the
+    metadata (port, baud rate, steps, timer period, start time etc.) and the
+    number of records written so far """
+
+    def __init__(self, path, metadata, dtype=RECORD, flush_interval=1.0):
+
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.flush_interval = flush_interval
+        self.count = 0
+        self.header = {
+            'columns': [(name, self.dtype[name].str) for name in self.dtype.names],
+            'count': 0,
+            'finished': False,
+            'start_time': time.time(),
+            'metadata': metadata,
+        }
+        self.file = open(path, 'wb')
+        self.file.write(_pack_header(self.header))
+        self.file.flush()
+        os.fsync(self.file.fileno())    # a crash before the first flush leaves a readable session
+        self.last_flush = time.monotonic()
+
+    def append(self, **columns):
+        """ It writes a chunk of samples. Columns are arrays of the same length or
+        scalars; missing columns are written as zeros """
+
+        number = max(np.size(value) for value in columns.values())
+        if number == 0:
+            return
+        start = time.perf_counter()
+        records = np.zeros(number, dtype=self.dtype)
+        for name, value in columns.items():
+            records[name] = value
+        self.file.write(records.tobytes())
+        self.count += number
+        WRITE_TIME.observe(time.perf_counter() - start)
+        WRITTEN_BYTES.inc(records.nbytes)
+
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def _write_header(self):
+
+        self.header['count'] = self.count
+        self.file.seek(0)
+        self.file.write(_pack_header(self.header))
+        self.file.seek(0, os.SEEK_END)
+
+    def flush(self):
+        """ It puts everything written so far on the disk """
+
+        start = time.perf_counter()
+        self._write_header()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_flush = time.monotonic()
+        FLUSH_TIME.observe(time.perf_counter() - start)
+
+    def close(self, **metadata):
+        """ It finishes the session. Keyword arguments are added to the metadata """
+
+        if self.file.closed:
+            return
+        self.header['metadata'].update(metadata)
+        self.header['finished'] = True
+        self.header['end_time'] = time.time()
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_session(path):
+    """ It maps a session file without copying or parsing of the data.
+    It returns the header and a read-only record array; columns are accessed
+    by name, e.g. records['voltage']. An unfinished session is mapped up to
+    its last complete record """
+
+    header = read_header(path)
+    dtype = _dtype(header)
+    count = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+    if count <= 0:
+        return header, np.zeros(0, dtype=dtype)
+    return header, np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
+
+
+def recover_session(path):
+    """ It repairs a session which was not closed (crash, USB disconnect): an
+    incomplete last record is cut and the header is marked as finished.
+    It returns the number of records """
+
+    header = read_header(path)
+    dtype = _dtype(header)
+    count = max(os.path.getsize(path) - HEADER_SIZE, 0) // dtype.itemsize
+
+    with open(path, 'r+b') as session:
+        session.truncate(HEADER_SIZE + count * dtype.itemsize)
+        if not header['finished']:
+            header['finished'] = True
+            header['recovered'] = True
+        header['count'] = count
+        session.seek(0)
+        session.write(_pack_header(header))
+    return count
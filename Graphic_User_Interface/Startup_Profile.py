@@ -0,0 +1,93 @@
+""" Import cost of the modules of a program at start.
+
+It runs a script with a timer around every import and prints the modules
+which took the most time, with their own time and with the time of
+everything they imported. The main() of the script is not run.
+
+Usage:
+    python Startup_Profile.py GUI_AntennaPatternRecorder.py
+    python Startup_Profile.py ../App/AntennaPatternRecorder.py --top 40
+"""
+
+import argparse
+import builtins
+import os
+import runpy
+import sys
+import time
+
+
+class ImportProfiler:
+    """ It replaces builtins.__import__ while it is active. Modules which are
+    already imported cost nothing and are not timed """
+
+    def __init__(self):
+
+        self.cumulative = {}    # module name: seconds including nested imports
+        self.own = {}           # module name: seconds without nested imports
+        self.nested = [0.0]     # time of nested imports of every active import
+        self.original = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+
+        if level == 0 and name in sys.modules:
+            return self.original(name, globals, locals, fromlist, level)
+
+        self.nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self.original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self.nested.pop()
+            self.nested[-1] += elapsed
+            if level > 0 and globals is not None:
+                name = '.'.join(part for part in (globals.get('__package__'), name) if part)
+            self.cumulative[name] = self.cumulative.get(name, 0.0) + elapsed
+            self.own[name] = self.own.get(name, 0.0) + elapsed - nested
+
+    def __enter__(self):
+
+        self.original = builtins.__import__
+        builtins.__import__ = self._import
+        return self
+
+    def __exit__(self, *exc_info):
+
+        builtins.__import__ = self.original
+
+    def total(self):
+        return self.nested[0]
+
+    def report(self, top=25, file=sys.stdout):
+
+        print('%10s %10s  %s' % ('own, ms', 'total, ms', 'module'), file=file)
+        ranking = sorted(self.cumulative, key=self.cumulative.get, reverse=True)
+        for name in ranking[:top]:
+            print('%10.1f %10.1f  %s' % (self.own[name] * 1000, self.cumulative[name] * 1000, name),
+                  file=file)
+        print('%10s %10.1f  all imports' % ('', self.total() * 1000), file=file)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Import cost of the modules of a program')
+    parser.add_argument('script', help='Python file of the program')
+    parser.add_argument('--top', type=int, default=25, help='number of modules in the report')
+    args = parser.parse_args()
+
+    script = os.path.abspath(args.script)
+    sys.path.insert(0, os.path.dirname(script))
+    sys.argv = [script]
+
+    start = time.perf_counter()
+    with ImportProfiler() as profiler:
+        runpy.run_path(script, run_name='startup_profile')
+    elapsed = time.perf_counter() - start
+
+    profiler.report(args.top)
+    print('%10s %10.1f  %s' % ('', elapsed * 1000, os.path.basename(script)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+""" Reading of one sweep of the turntable from the serial port.
+
+read_sweep() is the one loop which reads a sweep for the GUI, the headless
+Data_Recorder and the devices of Acquisition_Manager. It timestamps every
+chunk of the reader on arrival, gives its samples the angle of the rotation
+model or, in binary mode, of the step index, splits the channels into
+columns, converts the first one to voltage and resamples it onto the angle
+grid. The chunk is then passed to the sinks, which store it (samples buffer,
+session file) or evaluate it (metrics, statistics, QA). The sweep ends at a
+limit switch, when samples stop coming.
+"""
+
+import time
+
+import serial
+
+from Angle_Model import GridResampler, sample_times, TIME
+from Binary_Protocol import DEGREES_PER_STEP
+from Serial_Reader import ANALOG_PINS, channel_names
+
+
+LIMIT_TIMEOUT = 0.25    # s without samples after which the motor stands at a limit switch
+START_TIMEOUT = 1.0     # s, the motor stands at the limit switch if no sample comes
+
+
+class SweepChunk:
+    """ Samples of one read of a sweep. `adc` holds the ADC data of every
+    channel by column ('adc', 'adc1' ...), `voltage` is that of the first
+    one, `grid` and `values` are the new points of the resampled sweep """
+
+    def __init__(self, read_time, received, timestamp, angle, sequence, adc, voltage, grid, values):
+
+        self.read_time = read_time      # perf_counter() of the read
+        self.received = received        # s from the start of the sweep
+        self.timestamp = timestamp
+        self.angle = angle
+        self.sequence = sequence        # frame counters, -1 in ASCII mode
+        self.adc = adc
+        self.voltage = voltage
+        self.grid = grid
+        self.values = values
+
+    def __len__(self):
+        return len(self.timestamp)
+
+
+def channel_columns(data):
+    """ ADC data of every channel of a chunk by column ('adc', 'adc1' ...).
+    Channels are fields of the records, so they are views and nothing is copied """
+
+    if data.dtype.names is None:
+        return {'adc': data}
+    return {name: data[name] for name in channel_names(ANALOG_PINS) if name in data.dtype.names}
+
+
+def session_sink(session):
+    """ Sink which appends the samples of every chunk to a session file """
+
+    def append(chunk):
+        session.append(timestamp=chunk.timestamp, angle=chunk.angle, voltage=chunk.voltage,
+                       received=chunk.received, sequence=chunk.sequence, **chunk.adc)
+    return append
+
+
+def metrics_sink(metrics):
+    """ Sink which adds the resampled voltage of every chunk to PatternMetrics
+    or SweepStatistics """
+
+    def add(chunk):
+        metrics.add(chunk.grid, chunk.values['voltage'])
+    return add
+
+
+def read_sweep(reader, model, sinks, convert, period=TIME * 1e-6, binary_mode=False, start_angle=None,
+               origin=None, last_sample=None, start_timeout=None, stopped=None, idle=None, stats=None):
+    """ It reads one sweep from `reader` (ChunkReader or FrameReader) and
+    passes every chunk of samples to the sinks in order. A sink which returns
+    True ends the sweep, like `stopped()` before every read and `idle()` runs
+    before every read too (queued commands of the serial worker). `convert`
+    turns ADC data into voltage, the lookup table of the calibration.
+
+    The sweep ends LIMIT_TIMEOUT after the last sample, or `start_timeout`
+    after the start when no sample comes at all. At most `last_sample` + 1
+    samples are read. In binary mode the angle comes from the step index
+    counted from `origin`, the first step of a batch which starts at
+    `start_angle` (the start of the model by default). Reads and serial
+    errors are counted in PipelineStats `stats`. It returns the number of
+    samples and the origin """
+
+    resampler = GridResampler(model.direction)
+    if start_angle is None:
+        start_angle = model.start_angle
+    number = 0
+    start = time.perf_counter()
+    previous = None     # timestamp of the last sample
+    last_read = None    # time of the last read which returned samples
+
+    while (last_sample is None or number <= last_sample) and not (stopped is not None and stopped()):
+        if idle is not None:
+            idle()
+        try:
+            data = reader.read()
+        except serial.SerialException:
+            data = ()
+            if stats is not None:
+                stats.serial_errors += 1
+        read_time = time.perf_counter()
+        received = read_time - start
+        if last_sample is not None:
+            data = data[:last_sample + 1 - number]
+        if stats is not None:
+            stats.add_read(len(data), read_time)
+        if len(data) == 0:
+            if last_read is not None and received - last_read > LIMIT_TIMEOUT:
+                break   # the motor stands at a limit switch
+            if last_read is None and start_timeout is not None and received > start_timeout:
+                break   # it stood there from the start
+            continue
+
+        timestamp = sample_times(len(data), received, period, previous)
+        previous = timestamp[-1]
+        last_read = received
+        sequence = -1
+        if binary_mode is True:
+            if origin is None:
+                origin = int(data['step'][0])
+            angle = start_angle + (data['step'] - origin) * DEGREES_PER_STEP
+            sequence = data['sequence']
+        else:
+            angle = model.angle(timestamp)
+        adc = channel_columns(data)
+        voltage = convert(adc['adc'])
+        grid, values = resampler.add(angle, voltage=voltage, timestamp=timestamp)
+        chunk = SweepChunk(read_time, received, timestamp, angle, sequence, adc, voltage, grid, values)
+        number += len(data)
+        if any([sink(chunk) is True for sink in sinks]):
+            break   # every sink gets the chunk, then the sweep ends
+    return number, origin
@@ -0,0 +1,92 @@
+import threading
+
+import numpy as np
+
+
+class SweepStatistics:
+    """ Running statistics of many sweeps in angle bins: number of samples, mean,
+    minimum, maximum and standard deviation of every bin.
+
+    Every chunk is reduced per bin with np.bincount and merged into the
+    running values with the parallel variant of Welford's algorithm (Chan et
+    al.), so memory does not depend on the number of sweeps and no sample is
+    handled by Python code one at a time.
+    """
+
+    def __init__(self, start=0.0, stop=180.0, width=1.0):
+
+        self.start = start
+        self.width = width
+        self.size = int(np.ceil((stop - start) / width))
+        self.centers = start + width * (np.arange(self.size) + 0.5)
+        self.lock = threading.Lock()    # chunks come from the serial worker
+        self.reset()
+
+    def reset(self):
+
+        with self.lock:
+            self.count = np.zeros(self.size, dtype=np.int64)
+            self.mean = np.zeros(self.size)
+            self.m2 = np.zeros(self.size)   # sum of squared deviations from the mean
+            self.minimum = np.full(self.size, np.inf)
+            self.maximum = np.full(self.size, -np.inf)
+            self.sweeps = 0
+
+    def add(self, angle, value):
+        """ It adds a chunk of samples. Samples out of the angle range are ignored """
+
+        index = np.floor((np.asarray(angle, dtype=float) - self.start) / self.width).astype(np.intp)
+        value = np.asarray(value, dtype=float)
+        inside = (index >= 0) & (index < self.size)
+        index = index[inside]
+        value = value[inside]
+        if len(index) == 0:
+            return
+
+        count = np.bincount(index, minlength=self.size)
+        total = np.bincount(index, weights=value, minlength=self.size)
+        used = count > 0
+        chunk_mean = np.zeros(self.size)
+        chunk_mean[used] = total[used] / count[used]
+        chunk_m2 = np.bincount(index, weights=(value - chunk_mean[index]) ** 2, minlength=self.size)
+
+        with self.lock:
+            merged = self.count + count
+            delta = chunk_mean - self.mean
+            self.mean[used] += delta[used] * count[used] / merged[used]
+            self.m2[used] += chunk_m2[used] + delta[used] ** 2 * self.count[used] * count[used] / merged[used]
+            self.count = merged
+            np.minimum.at(self.minimum, index, value)
+            np.maximum.at(self.maximum, index, value)
+
+    def end_sweep(self):
+        with self.lock:
+            self.sweeps += 1
+
+    def result(self, z=1.96):
+        """ It returns centers, count, mean, standard deviation, minimum, maximum and
+        the confidence band of the mean (mean -/+ z standard errors) of the bins
+        which have samples. The arrays are copies """
+
+        with self.lock:
+            used = self.count > 0
+            count = self.count[used]
+            mean = self.mean[used].copy()
+            variance = np.zeros(len(count))
+            many = count > 1
+            variance[many] = self.m2[used][many] / (count[many] - 1)
+            minimum = self.minimum[used]
+            maximum = self.maximum[used]
+
+        std = np.sqrt(variance)
+        error = z * std / np.sqrt(count)
+        return {
+            'angle': self.centers[used],
+            'count': count,
+            'mean': mean,
+            'std': std,
+            'min': minimum,
+            'max': maximum,
+            'low': mean - error,
+            'high': mean + error,
+        }
@@ -0,0 +1,523 @@
+""" Software model of the Antenna Pattern Recorder firmware (AntennaPatternRecorder.ino).
+
+It lets the host pipeline run without an Arduino: as a drop-in replacement of
+serial.Serial (VirtualSerial, also created from 'virtual://' port names) or
+behind a pseudo terminal which any program can open as a real serial port.
+
+Usage:
+    python Virtual_Recorder.py --rate 2000 --baud 1000000
+"""
+
+import argparse
+import os
+import threading
+import time
+from urllib.parse import urlparse, parse_qsl
+
+import numpy as np
+
+from Binary_Protocol import COMMAND_ASCII, COMMAND_BINARY, DEGREES_PER_STEP, encode_frames, frame_dtype
+from Serial_Reader import COMMA, mask_channels
+from Serial_Worker import (COMMAND_IDENTIFY, COMMAND_BAUD, FIRMWARE_ID, BAUD_RATES, BAUD_CONFIRM_TIME,
+                           COMMAND_TIMER, COMMAND_STEPS, COMMAND_CHANNELS, TIMER_RANGE, STEPS_RANGE,
+                           CHANNELS_RANGE, samples_fit)
+
+
+# Constants of the firmware
+BAUDE_RATE = 9600
+STEPS = 30
+TIME = 24383                # period of Timer1 in us
+SPEED_MOTOR = (0, 100, 200, 300, 400, 500)
+TX_BUFFER_SIZE = 64         # serial transmit buffer of the Uno
+TRAVEL = 1024               # steps between limit switches (180 degrees)
+FIRMWARE_VERSION = b'1.1'
+
+URL_SCHEME = 'virtual://'
+
+# ASCII records of every 10-bit value, padded to the longest one
+ASCII_RECORDS = [b'%d\n' % value for value in range(1024)]
+ASCII_LENGTHS = np.array([len(record) for record in ASCII_RECORDS])
+ASCII_TABLE = np.array([np.frombuffer(record.ljust(5, b'\0'), dtype=np.uint8)
+                        for record in ASCII_RECORDS])
+
+
+def default_pattern(angle):
+    """ Synthetic pattern in ADC counts: main lobe at 90 degrees with sidelobes
+    and a -30 dB floor """
+
+    power = np.sinc((np.asarray(angle) - 90) / 30) ** 2
+    return 800 * np.maximum(power, 1e-3)
+
+
+def cross_polar_pattern(angle):
+    """ Synthetic cross-polar pattern in ADC counts: about 20 dB below the
+    main lobe of default_pattern() with a null on its axis """
+
+    offset = np.asarray(angle) - 90
+    return 8 + 80 * np.sin(np.radians(offset) * 3) ** 2 * np.sinc(offset / 60) ** 2
+
+
+def reference_level(ticks):
+    """ Synthetic reference detector in ADC counts: the source power with a
+    slow drift of +-2 % """
+
+    return 600 * (1 + 0.02 * np.sin(2 * np.pi * np.asarray(ticks) / 60))
+
+
+def encode_ascii(adc):
+    """ It formats ADC values as the firmware does ("%d\\n") in one vectorized
+    step. adc of shape (samples, channels) gives records of comma separated values """
+
+    adc = np.asarray(adc, dtype=np.intp)
+    records = ASCII_TABLE[adc]
+    lengths = ASCII_LENGTHS[adc]
+    if adc.ndim > 1:
+        # the newline of every value but the last one of a record becomes a comma
+        np.put_along_axis(records[:, :-1], lengths[:, :-1, None] - 1, COMMA, axis=2)
+    mask = np.arange(ASCII_TABLE.shape[1]) < lengths[..., None]
+    return records[mask].tobytes()
+
+
+class VirtualRecorder:
+    """ Model of the firmware: command set ('0'-'5' speed, '7'/'8'/'9' left, stop
+    and right, 'a'/'b' frame format, 'c'/'s' continuous or sweep stream, '?'
+    handshake, 'B<n>' baud rate, 'T<us>' Timer1 period, 'S<n>' steps and 'C<mask>'
+    analog pins), Timer1 driven ADC stream, limit switches
+    and a serial link of limited speed. Above `max_baud_rate` the link garbles
+    every byte, like a long cable or a poor USB adapter does.
+
+    The model is lazy, advance() computes everything which happened since the
+    previous call in one vectorized pass. Samples which do not fit into the
+    link are dropped and counted in `overruns`. The pins of the channel mask
+    get the co-polar pattern, the cross-polar one and the reference level in
+    turn.
+    """
+
+    def __init__(self, sample_period=TIME * 1e-6, baud_rate=BAUDE_RATE, steps=STEPS,
+                 travel=TRAVEL, position=0, pattern=default_pattern, noise=2.0,
+                 rx_buffer_size=1 << 16, seed=None, clock=time.perf_counter, max_baud_rate=None):
+
+        self.boot_sample_period = sample_period    # TIME of the firmware
+        self.boot_steps = steps                     # STEPS of the firmware
+        self.sample_period = sample_period
+        self.boot_baud_rate = baud_rate     # BAUDE_RATE of the firmware, the baud rate after reset
+        self.baud_rate = baud_rate
+        self.max_baud_rate = max_baud_rate
+        self.steps = steps
+        self.travel = travel
+        self.pattern = pattern
+        self.noise = noise
+        self.rx_buffer_size = rx_buffer_size
+        self.random = np.random.default_rng(seed)
+        self.clock = clock
+        self.lock = threading.Lock()
+
+        self.position = position    # step index of the motor
+        self.output = bytearray()   # bytes which the host can read
+        self.sent = 0               # number of samples put on the link
+        self.overruns = 0           # samples dropped because the link is too slow
+        self.rx_overflow = 0        # bytes dropped because the host does not read
+        self.reset()
+
+    def reset(self):
+        """ Reset of the board, it happens every time the port is opened """
+
+        with self.lock:
+            self.time = self.clock()
+            self.configured = False     # motorSetup() waits for a speed command
+            self.velocity = SPEED_MOTOR[0]
+            self.direction = 0
+            self.binary_mode = False
+            self.continuous = False     # samples are sent while the motor stands
+            self.baud_rate = self.boot_baud_rate
+            self.previous_baud_rate = self.baud_rate
+            self.baud_deadline = None   # the old baud rate returns then if the new one is not confirmed
+            self.baud_argument = False  # the next byte is the argument of 'B'
+            self.sample_period = self.boot_sample_period
+            self.steps = self.boot_steps
+            self.channel_mask = 1       # analog pins sampled every tick, bit 0 is A0
+            self.setting = None         # 'T', 'S' or 'C' while its digits come
+            self.setting_value = 0
+            self.sequence = 0
+            self.next_tick = self.time + self.sample_period
+            self.credit = TX_BUFFER_SIZE
+            self.output.clear()
+
+    def link_works(self, baudrate):
+        """ True when bytes at `baudrate` of the host arrive unchanged """
+
+        return baudrate == self.baud_rate and (self.max_baud_rate is None or baudrate <= self.max_baud_rate)
+
+    @property
+    def step_period(self):
+        """ Delay between steps of the Stepper library in seconds """
+
+        return 60 / (self.steps * self.velocity)
+
+    def _position_at(self, moment):
+
+        done = np.floor((moment - self.motion_start) / self.step_period)
+        done = np.minimum(done, self.steps_to_limit)
+        return self.motion_origin + self.direction * done
+
+    def _start(self, direction):
+
+        limit = self.travel - self.position if direction > 0 else self.position
+        if limit <= 0 or self.velocity == 0:
+            return  # the limit switch is pressed
+        self.direction = direction
+        self.steps_to_limit = limit
+        self.motion_start = self.time
+        self.motion_origin = self.position
+
+    def _turn(self, direction):
+        """ '7' or '9' of serialEvent(): the motor turns to `direction` at once,
+        also from the other direction, unless the limit switch of that side is
+        pressed, then it goes on as before """
+
+        moving = self.direction
+        self._stop()
+        self._start(direction)
+        if self.direction == 0 and moving != 0:
+            self._start(moving)
+
+    def _stop(self):
+
+        if self.direction != 0:
+            self.position = int(self._position_at(self.time))
+        self.direction = 0
+
+    def advance(self, now=None):
+        """ It runs the model up to `now` """
+
+        if now is None:
+            now = self.clock()
+
+        with self.lock:
+            if self.baud_deadline is not None and now > self.baud_deadline:
+                self.baud_rate = self.previous_baud_rate    # checkBaudRate()
+                self.baud_deadline = None
+            if now <= self.time:
+                return
+
+            if self.next_tick <= now:
+                count = int((now - self.next_tick) // self.sample_period) + 1
+                ticks = self.next_tick + self.sample_period * np.arange(count)
+                self.next_tick += count * self.sample_period
+                if self.direction != 0:
+                    if not self.continuous:
+                        end = self.motion_start + self.steps_to_limit * self.step_period
+                        ticks = ticks[ticks <= end]
+                    self._emit(ticks, self._position_at(ticks).astype(np.int64), now)
+                elif self.continuous:
+                    self._emit(ticks, np.full(count, self.position, dtype=np.int64), now)
+                else:
+                    self._emit(ticks[:0], ticks[:0].astype(np.int64), now)
+
+            if self.direction != 0:
+                position = int(self._position_at(now))
+                if abs(position - self.motion_origin) >= self.steps_to_limit:
+                    self.position = position    # stopMotor() of the limit switch
+                    self.direction = 0
+            self.time = now
+
+    def _signals(self, angle, ticks):
+        """ Levels of the detectors of every channel, shape (samples, channels) """
+
+        models = (lambda: self.pattern(angle), lambda: cross_polar_pattern(angle),
+                  lambda: reference_level(ticks))
+        channels = mask_channels(self.channel_mask)
+        return np.column_stack([models[channel % len(models)]() for channel in range(channels)])
+
+    def _emit(self, ticks, positions, now):
+
+        elapsed = now - self.time
+        budget = self.credit + elapsed * self.baud_rate / 10
+        count = len(ticks)
+
+        if count > 0:
+            angle = positions * DEGREES_PER_STEP
+            adc = self._signals(angle, ticks)
+            adc = adc + self.random.normal(0, self.noise, adc.shape)
+            adc = np.clip(np.rint(adc), 0, 1023).astype(np.int64)
+            if adc.shape[1] == 1:
+                adc = adc[:, 0]
+
+            if self.binary_mode:
+                sizes = np.full(count, frame_dtype(adc.shape[1] if adc.ndim > 1 else 1).itemsize)
+            else:
+                sizes = ASCII_LENGTHS[adc].reshape(count, -1).sum(axis=1)
+            fit = int(np.searchsorted(np.cumsum(sizes), budget, side='right'))
+
+            if self.binary_mode:
+                sequence = self.sequence + np.arange(count)
+                data = encode_frames(sequence[:fit], positions[:fit], adc[:fit])
+                self.sequence = (self.sequence + count) % 256
+            else:
+                data = encode_ascii(adc[:fit])
+
+            self.sent += fit
+            self.overruns += count - fit
+            budget -= len(data)
+            self._deliver(data)
+
+        self.credit = min(budget, TX_BUFFER_SIZE)
+
+    def _deliver(self, data):
+
+        room = self.rx_buffer_size - len(self.output)
+        if len(data) > room:
+            self.rx_overflow += len(data) - room
+            data = data[:room]
+        self.output += data
+
+    def command(self, data):
+        """ It handles bytes written by the host like motorSetup() and serialEvent() do """
+
+        self.advance()
+        with self.lock:
+            for command in data:
+                self._command(bytes((command,)))
+
+    def _link_command(self, command):
+        """ linkCommand() of the firmware, True if the byte belongs to '?' or 'B<n>' """
+
+        if self.baud_argument:
+            self.baud_argument = False
+            index = command[0] - ord('0')
+            if 0 <= index < len(BAUD_RATES):
+                self._deliver(b'OK %d\r\n' % BAUD_RATES[index])
+                self.previous_baud_rate = self.baud_rate
+                self.baud_rate = BAUD_RATES[index]
+                self.baud_deadline = self.time + BAUD_CONFIRM_TIME
+            return True
+        if command == COMMAND_IDENTIFY:
+            self.baud_deadline = None
+            self._deliver(FIRMWARE_ID + b' ' + FIRMWARE_VERSION + b' %d\r\n' % self.baud_rate)
+            return True
+        if command == COMMAND_BAUD:
+            self.baud_argument = True
+            return True
+        return False
+
+    def _setting_command(self, command):
+        """ settingCommand() of the firmware, True if the byte belongs to 'T<us>\\n',
+        'S<n>\\n' or 'C<mask>\\n' """
+
+        if self.setting is not None:
+            if command.isdigit():
+                self.setting_value = self.setting_value * 10 + int(command)
+                return True
+            value = self.setting_value
+            if self.setting == COMMAND_TIMER:
+                if TIMER_RANGE[0] <= value <= TIMER_RANGE[1] and samples_fit(value, self.channel_mask, self.baud_rate):
+                    self.sample_period = value * 1e-6
+                    self.next_tick = self.time + self.sample_period    # Timer1.setPeriod() restarts the period
+                self._deliver(b'T %d\r\n' % round(self.sample_period * 1e6))
+            elif self.setting == COMMAND_CHANNELS:
+                period = round(self.sample_period * 1e6)
+                if CHANNELS_RANGE[0] <= value <= CHANNELS_RANGE[1] and samples_fit(period, value, self.baud_rate):
+                    self.channel_mask = value
+                self._deliver(b'C %d\r\n' % self.channel_mask)
+            else:
+                if STEPS_RANGE[0] <= value <= STEPS_RANGE[1]:
+                    moving = self.direction
+                    self._stop()
+                    self.steps = value
+                    if moving != 0:
+                        self._start(moving)
+                self._deliver(b'S %d\r\n' % self.steps)
+            self.setting = None
+            return True
+        if command in (COMMAND_TIMER, COMMAND_STEPS, COMMAND_CHANNELS):
+            self.setting = command
+            self.setting_value = 0
+            return True
+        return False
+
+    def _command(self, command):
+
+        if self._link_command(command) or self._setting_command(command):
+            return
+
+        if not self.configured:
+            # motorSetup(): '0' falls through to '1' in the firmware
+            if command in b'012345':
+                self.velocity = SPEED_MOTOR[max(int(command), 1)]
+                self.configured = True
+            return
+
+        if command == b'8':
+            self._stop()
+        elif command == b'7':
+            self._turn(-1)
+        elif command == b'9':
+            self._turn(1)
+        elif command == b'0':
+            self._stop()
+            self.velocity = SPEED_MOTOR[0]
+        elif command in b'12345':
+            moving = self.direction
+            self._stop()
+            self.velocity = SPEED_MOTOR[int(command)]
+            if moving != 0:
+                self._start(moving)
+        elif command == COMMAND_BINARY:
+            self.binary_mode = True
+        elif command == COMMAND_ASCII:
+            self.binary_mode = False
+        elif command == b'c':
+            self.continuous = True
+        elif command == b's':
+            self.continuous = False
+
+    def take(self, size):
+        """ It removes up to `size` bytes from the output and returns them """
+
+        with self.lock:
+            data = bytes(self.output[:size])
+            del self.output[:size]
+        return data
+
+
+class VirtualSerial:
+    """ Drop-in replacement of serial.Serial connected to a VirtualRecorder.
+    Opening the port resets the recorder like DTR resets the Uno """
+
+    def __init__(self, recorder=None, port=URL_SCHEME, baudrate=BAUDE_RATE,
+                 timeout=None, write_timeout=None):
+
+        self.recorder = recorder if recorder is not None else VirtualRecorder(baud_rate=baudrate)
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.is_open = False
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """ 'virtual://?rate=2000&baud=1000000&noise=2&seed=1&max_baud=250000' """
+
+        options = dict(parse_qsl(urlparse(url).query))
+        baud = int(options.get('baud', BAUDE_RATE))
+        recorder = VirtualRecorder(sample_period=1 / float(options.get('rate', 1e6 / TIME)),
+                                   baud_rate=baud,
+                                   travel=int(options.get('travel', TRAVEL)),
+                                   noise=float(options.get('noise', 2.0)),
+                                   seed=int(options['seed']) if 'seed' in options else None,
+                                   max_baud_rate=int(options['max_baud']) if 'max_baud' in options else None)
+        kwargs.setdefault('baudrate', baud)
+        return cls(recorder, port=url, **kwargs)
+
+    def open(self):
+        self.recorder.reset()
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def isOpen(self):
+        return self.is_open
+
+    @property
+    def in_waiting(self):
+        self.recorder.advance()
+        return len(self.recorder.output)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def _garble(self, data):
+        """ Bytes received with a wrong baud rate are garbage """
+
+        if self.recorder.link_works(self.baudrate) or not data:
+            return data
+        return self.recorder.random.integers(0, 256, len(data), dtype=np.uint8).tobytes()
+
+    def read(self, size=1):
+
+        deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        while True:
+            if self.in_waiting >= size:
+                break
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if remaining is not None and remaining <= 0:
+                break
+            pause = self.recorder.next_tick - self.recorder.clock()
+            pause = min(max(pause, 1e-4), 0.01)
+            time.sleep(pause if remaining is None else min(pause, remaining))
+        return self._garble(self.recorder.take(size))
+
+    def readline(self):
+
+        deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        while True:
+            self.recorder.advance()
+            end = self.recorder.output.find(b'\n') + 1
+            if end > 0:
+                return self._garble(self.recorder.take(end))
+            if deadline is not None and time.perf_counter() >= deadline:
+                return self._garble(self.recorder.take(len(self.recorder.output)))
+            time.sleep(1e-3)
+
+    def write(self, data):
+        if self.recorder.link_works(self.baudrate):
+            self.recorder.command(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.recorder.advance()
+        self.recorder.take(len(self.recorder.output))
+
+    def flushInput(self):
+        self.reset_input_buffer()
+
+
+def serve_pty(recorder):
+    """ It connects the recorder to a new pseudo terminal and returns the name of
+    the device which can be opened as a serial port. POSIX only """
+
+    import select
+    import tty
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+
+    def serve():
+        while True:
+            readable, _, _ = select.select([master], [], [], 0.001)
+            if readable:
+                recorder.command(os.read(master, 1024))
+            recorder.advance()
+            data = recorder.take(1 << 16)
+            if data:
+                os.write(master, data)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return os.ttyname(slave)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Virtual Antenna Pattern Recorder on a pseudo terminal')
+    parser.add_argument('--rate', type=float, default=1e6 / TIME, help='samples per second')
+    parser.add_argument('--baud', type=int, default=BAUDE_RATE, help='speed of the link')
+    parser.add_argument('--travel', type=int, default=TRAVEL, help='steps between limit switches')
+    parser.add_argument('--noise', type=float, default=2.0, help='noise in ADC counts')
+    args = parser.parse_args()
+
+    recorder = VirtualRecorder(sample_period=1 / args.rate, baud_rate=args.baud,
+                               travel=args.travel, noise=args.noise)
+    print('Virtual recorder on', serve_pty(recorder))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()